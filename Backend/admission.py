@@ -0,0 +1,280 @@
+"""
+Admission control.
+
+With HIVE_ADMISSION=1 every request passes through here before its handler
+runs, so one organization's import or bulk job can't take every worker thread
+and pooled connection.
+
+Requests are sorted into lanes, each with its own concurrency limit, so a lane
+never waits behind another:
+
+- auth: /auth/*; no concurrency limit
+- bulk: imports, exports, bulk assignment, background deletes and /init-db
+  (HIVE_ADMISSION_BULK_CONCURRENCY)
+- read: other GET/HEAD/OPTIONS requests (HIVE_ADMISSION_READ_CONCURRENCY)
+- write: everything else (HIVE_ADMISSION_WRITE_CONCURRENCY)
+
+On top of its lane, a request counts against its route
+(HIVE_ADMISSION_ROUTE_CONCURRENCY) and its organization
+(HIVE_ADMISSION_ORG_CONCURRENCY). The organization comes from the
+X-Organization-Id header, the URL (/organizations/<id>/...) or an
+organizationId query parameter. Requests without one have no organization cap.
+
+A request that doesn't fit waits, up to HIVE_ADMISSION_QUEUE_TIMEOUT_SECONDS,
+in its lane's queue of at most HIVE_ADMISSION_QUEUE_SIZE requests. If the queue
+is full or the wait times out, the request is shed:
+
+- 429 when its organization is at its cap
+- 503 when the lane or route is at capacity
+
+Independently, each client (by remote address) has a token bucket of
+HIVE_RATE_LIMIT_BURST requests refilled at HIVE_RATE_LIMIT_PER_SECOND. A client
+with an empty bucket gets 429. Every rejection carries Retry-After. Behind a
+proxy or load balancer (App Hosting, Cloud Run) the remote address is the
+proxy's, so set HIVE_PROXY_HOPS to the number of proxies in front of the app:
+the client is then the address that many hops back in X-Forwarded-For.
+Only set it when the app can't be reached except through those proxies, since
+a client can put anything in the header.
+
+Outcomes are counted in hive_admission_total (lane, outcome) and waits in
+hive_admission_wait_seconds, served by GET /metrics when HIVE_METRICS=1.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import g, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+from instrumentation import metrics
+
+ADMISSION_ENABLED = os.environ.get('HIVE_ADMISSION', '').lower() in ('1', 'true', 'yes')
+READ_CONCURRENCY = int(os.environ.get('HIVE_ADMISSION_READ_CONCURRENCY', '32'))
+WRITE_CONCURRENCY = int(os.environ.get('HIVE_ADMISSION_WRITE_CONCURRENCY', '16'))
+BULK_CONCURRENCY = int(os.environ.get('HIVE_ADMISSION_BULK_CONCURRENCY', '2'))
+ROUTE_CONCURRENCY = int(os.environ.get('HIVE_ADMISSION_ROUTE_CONCURRENCY', '16'))
+ORG_CONCURRENCY = int(os.environ.get('HIVE_ADMISSION_ORG_CONCURRENCY', '8'))
+QUEUE_SIZE = int(os.environ.get('HIVE_ADMISSION_QUEUE_SIZE', '64'))
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get('HIVE_ADMISSION_QUEUE_TIMEOUT_SECONDS', '2'))
+RATE_LIMIT_PER_SECOND = float(os.environ.get('HIVE_RATE_LIMIT_PER_SECOND', '20'))
+RATE_LIMIT_BURST = float(os.environ.get('HIVE_RATE_LIMIT_BURST', '40'))
+PROXY_HOPS = int(os.environ.get('HIVE_PROXY_HOPS', '0'))
+
+# Suggested wait after a capacity rejection
+RETRY_AFTER_SECONDS = 1
+
+# Token buckets kept at once; the least recently seen clients go first
+MAX_CLIENTS = 10000
+
+ORGANIZATION_HEADER = 'X-Organization-Id'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Routes (URL rules) in the bulk lane
+BULK_RULES = {
+    '/organizations/import',
+    '/organizations/<int:organization_id>/export',
+    '/events/personnel/bulk',
+    '/init-db',
+}
+
+# Never limited, so monitoring works when the API is overloaded
+EXEMPT_RULES = {'/metrics'}
+
+LANE_CONCURRENCY = {
+    'auth': None,
+    'read': READ_CONCURRENCY,
+    'write': WRITE_CONCURRENCY,
+    'bulk': BULK_CONCURRENCY,
+}
+
+metrics.counter('hive_admission_total', 'Requests by admission lane and outcome')
+metrics.histogram('hive_admission_wait_seconds', 'Time admitted requests waited in the admission queue by lane')
+
+
+class Rejected(Exception):
+    """A request that is shed instead of admitted"""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBuckets:
+    """Per-client token buckets of `burst` tokens refilled at `rate` per second"""
+
+    def __init__(self, rate=RATE_LIMIT_PER_SECOND, burst=RATE_LIMIT_BURST, max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, client):
+        """Take a token; returns 0 on success, else the seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class AdmissionController:
+    """Concurrency counts per lane, route and organization, with a bounded wait queue per lane"""
+
+    def __init__(self, lane_concurrency=LANE_CONCURRENCY, route_concurrency=ROUTE_CONCURRENCY,
+                 org_concurrency=ORG_CONCURRENCY, queue_size=QUEUE_SIZE, queue_timeout=QUEUE_TIMEOUT_SECONDS):
+        self.lane_concurrency = lane_concurrency
+        self.route_concurrency = route_concurrency
+        self.org_concurrency = org_concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._running = {}
+        self._waiting = {}
+        self._condition = threading.Condition()
+
+    def _blocker(self, lane, route, organization):
+        """What keeps a request from starting now: 'lane', 'route', 'organization' or None"""
+        limit = self.lane_concurrency.get(lane)
+        if limit is None:
+            return None
+        if self._running.get(('lane', lane), 0) >= limit:
+            return 'lane'
+        if self._running.get(('route', route), 0) >= self.route_concurrency:
+            return 'route'
+        if organization is not None and self._running.get(('organization', organization), 0) >= self.org_concurrency:
+            return 'organization'
+        return None
+
+    def _keys(self, lane, route, organization):
+        keys = [('lane', lane), ('route', route)]
+        if organization is not None:
+            keys.append(('organization', organization))
+        return keys
+
+    def acquire(self, lane, route, organization):
+        """Wait for a slot; returns a ticket for release(), or raises Rejected"""
+        deadline = time.monotonic() + self.queue_timeout
+        with self._condition:
+            blocker = self._blocker(lane, route, organization)
+            if blocker is not None:
+                if self._waiting.get(lane, 0) >= self.queue_size:
+                    raise self._rejection(blocker)
+                self._waiting[lane] = self._waiting.get(lane, 0) + 1
+                try:
+                    while blocker is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise self._rejection(blocker)
+                        self._condition.wait(remaining)
+                        blocker = self._blocker(lane, route, organization)
+                finally:
+                    self._waiting[lane] -= 1
+
+            keys = self._keys(lane, route, organization)
+            for key in keys:
+                self._running[key] = self._running.get(key, 0) + 1
+            return keys
+
+    def release(self, ticket):
+        with self._condition:
+            for key in ticket:
+                self._running[key] -= 1
+                if not self._running[key]:
+                    del self._running[key]
+            self._condition.notify_all()
+
+    def _rejection(self, blocker):
+        if blocker == 'organization':
+            return Rejected(429, 'Too many concurrent requests for this organization', RETRY_AFTER_SECONDS)
+        return Rejected(503, 'The server is busy', RETRY_AFTER_SECONDS)
+
+
+buckets = TokenBuckets()
+controller = AdmissionController()
+
+
+def admission_enabled():
+    return ADMISSION_ENABLED
+
+
+def _lane(route):
+    if request.path.startswith('/auth/'):
+        return 'auth'
+    if route in BULK_RULES or request.args.get('background', '').lower() in ('1', 'true', 'yes'):
+        return 'bulk'
+    if request.method in SAFE_METHODS:
+        return 'read'
+    return 'write'
+
+
+def _organization():
+    organization = request.headers.get(ORGANIZATION_HEADER)
+    if organization is None and request.view_args:
+        organization = request.view_args.get('organization_id')
+    if organization is None:
+        organization = request.args.get('organizationId')
+    return str(organization) if organization not in (None, '') else None
+
+
+def _reject(lane, outcome, status, message, retry_after):
+    metrics.inc('hive_admission_total', {'lane': lane, 'outcome': outcome})
+    return {'error': message}, status, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+
+def _before_request():
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if route in EXEMPT_RULES:
+        return None
+    lane = _lane(route)
+
+    wait = buckets.take(request.remote_addr or 'unknown')
+    if wait:
+        return _reject(lane, 'rate_limited', 429, 'Too many requests', wait)
+
+    started = time.perf_counter()
+    try:
+        g.hive_admission_ticket = controller.acquire(lane, route, _organization())
+    except Rejected as e:
+        return _reject(lane, 'rejected_organization' if e.status == 429 else 'rejected_capacity',
+                       e.status, e.reason, e.retry_after)
+    metrics.inc('hive_admission_total', {'lane': lane, 'outcome': 'admitted'})
+    metrics.observe('hive_admission_wait_seconds', time.perf_counter() - started, {'lane': lane})
+    return None
+
+
+def _after_request(response):
+    # Teardown runs before a streamed body is generated, so a streamed request holds its slot until it is closed
+    if response.is_streamed:
+        ticket = g.pop('hive_admission_ticket', None)
+        if ticket is not None:
+            response.call_on_close(lambda: controller.release(ticket))
+    return response
+
+
+def _teardown_request(exc):
+    # Also runs when the handler raised, which skips after_request
+    ticket = g.pop('hive_admission_ticket', None)
+    if ticket is not None:
+        controller.release(ticket)
+
+
+def init_app(app):
+    """Admit or shed every request before it reaches its handler"""
+    if PROXY_HOPS > 0:
+        # remote_addr becomes the client the trusted proxies forwarded for
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,8 @@
+"""
+Benchmarks for the Hive API.
+
+datagen.py builds deterministic synthetic datasets at any scale factor and
+run.py drives the API through Flask's test client, recording latency
+percentiles, SQL statement counts and peak memory per scenario to a JSON
+baseline that later runs can be compared against.
+"""
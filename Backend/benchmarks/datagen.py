@@ -0,0 +1,246 @@
+"""
+Deterministic synthetic data for load testing.
+
+    python -m benchmarks.datagen --scale 10 --database-url sqlite:///bench.db
+
+The same scale and seed always produce the same rows. Everything is written
+in large chunks (Core executemany inserts, or COPY on PostgreSQL), with ids
+assigned up front so rows can reference each other without reading anything
+back.
+"""
+
+import argparse
+import random
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import create_engine
+
+from models import (
+    Base, Event, Organization, Personnel, Project, Role, Shot, Shot_Request, User,
+    ROLE_FLAG_PHOTOGRAPHER, deadline_sort, event_personnel, project_key_personnel
+)
+import dialects
+
+# Row counts at scale 1; organizations scale linearly, everything else is per parent
+BASE_SIZES = {
+    'organizations': 2,
+    'projects_per_organization': 5,
+    'events_per_project': 8,
+    'personnel_per_organization': 20,
+    'shots_per_event': 50,
+    'shot_requests_per_event': 10,
+    'assignments_per_event': 4,
+    'key_personnel_per_project': 3,
+}
+
+CHUNK_SIZE = 5000
+
+ROLES = ['Lead Photographer', 'Photographer', 'Assistant Photographer', 'Editor', 'Producer', 'Event Coordinator']
+PROCESS_POINTS = ['idle', 'capturing', 'editing', 'review', 'delivered']
+EVENT_WORDS = ['Keynote', 'Gala', 'Summit', 'Panel', 'Workshop', 'Reception', 'Launch', 'Awards', 'Breakfast', 'Expo']
+SHOT_WORDS = ['CEO on stage', 'Crowd wide shot', 'Sponsor booth', 'Speaker portrait', 'Award handoff',
+              'Networking candid', 'Venue exterior', 'Product detail', 'Panel group shot', 'Backstage']
+CAMERAS = ['Canon EOS R5', 'Sony A1', 'Nikon Z9', 'Canon EOS R3', 'Sony A7 IV']
+FIRST_NAMES = ['Alex', 'Jordan', 'Sam', 'Taylor', 'Morgan', 'Casey', 'Riley', 'Jamie', 'Avery', 'Quinn']
+LAST_NAMES = ['Smith', 'Johnson', 'Lee', 'Garcia', 'Brown', 'Davis', 'Miller', 'Wilson', 'Moore', 'Clark']
+
+
+def dataset_sizes(scale):
+    sizes = dict(BASE_SIZES)
+    sizes['organizations'] = max(1, int(BASE_SIZES['organizations'] * scale))
+    return sizes
+
+
+def _chunks(rows):
+    for i in range(0, len(rows), CHUNK_SIZE):
+        yield rows[i:i + CHUNK_SIZE]
+
+
+def _insert(conn, table, rows):
+    for chunk in _chunks(rows):
+        dialects.copy_rows(conn, table, chunk)
+
+
+def generate(engine, scale=1, seed=42):
+    """Fill an empty database with a deterministic dataset and return the row counts"""
+    rng = random.Random(seed)
+    sizes = dataset_sizes(scale)
+    start_date = date(2024, 1, 1)
+
+    roles = [{
+        'id': i + 1,
+        'name': name,
+        'slug': Role.slugify(name),
+        'flags': Role.flags_for(name)
+    } for i, name in enumerate(ROLES)]
+
+    organizations, users, projects, personnel, events = [], [], [], [], []
+    shots, shot_requests, assignments, key_personnel = [], [], [], []
+
+    for org_index in range(sizes['organizations']):
+        org_id = org_index + 1
+        organizations.append({
+            'id': org_id,
+            'name': f'Organization {org_id}',
+            'description': f'Synthetic organization {org_id}',
+            'signup_code': f'BENCH{org_id:05d}'
+        })
+        users.append({
+            'id': org_id,
+            'email': f'admin{org_id}@bench.example',
+            # Fixed, non-functional hash: hashing a password per user would dominate generation time
+            'password_hash': 'pbkdf2:sha256:bench',
+            'name': f'Admin {org_id}',
+            'organization_id': org_id
+        })
+
+        org_personnel = []
+        for _ in range(sizes['personnel_per_organization']):
+            person_id = len(personnel) + 1
+            role = rng.choice(roles)
+            name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+            personnel.append({
+                'id': person_id,
+                'name': name,
+                'role': role['name'],
+                'phone': f'555-{person_id:07d}',
+                'email': f'person{person_id}@bench.example',
+                'role_id': role['id'],
+                'has_photographer_role': bool(role['flags'] & ROLE_FLAG_PHOTOGRAPHER)
+            })
+            org_personnel.append(personnel[-1])
+        photographers = [p for p in org_personnel if p['has_photographer_role']] or org_personnel
+
+        for project_index in range(sizes['projects_per_organization']):
+            project_id = len(projects) + 1
+            project_start = start_date + timedelta(days=rng.randrange(365))
+            projects.append({
+                'id': project_id,
+                'name': f'{rng.choice(EVENT_WORDS)} Series {project_id}',
+                'client': f'Client {rng.randrange(1, 50)}',
+                'organization_id': org_id,
+                'status': rng.choice(['In Planning', 'Active', 'Completed']),
+                'description': f'Synthetic project {project_id}',
+                'start_date': project_start,
+                'end_date': project_start + timedelta(days=30),
+                'location': f'Venue {rng.randrange(1, 100)}'
+            })
+            for person in rng.sample(org_personnel, min(sizes['key_personnel_per_project'], len(org_personnel))):
+                key_personnel.append({'project_id': project_id, 'personnel_id': person['id'], 'role': person['role']})
+
+            for _ in range(sizes['events_per_project']):
+                event_id = len(events) + 1
+                event_date = project_start + timedelta(days=rng.randrange(30))
+                start_hour = rng.randrange(7, 20)
+                events.append({
+                    'id': event_id,
+                    'name': f'{rng.choice(EVENT_WORDS)} {event_id}',
+                    'date': event_date,
+                    'start_time': f'{start_hour:02d}:00',
+                    'end_time': f'{start_hour + 2:02d}:00',
+                    'event_type': None,
+                    'standard_shot_package': rng.random() < 0.7,
+                    'location': f'Hall {rng.randrange(1, 20)}',
+                    'status': rng.choice(['Upcoming', 'In Progress', 'Completed']),
+                    'description': f'Synthetic event {event_id}',
+                    'project_id': project_id,
+                    'organization_id': org_id,
+                    'discipline': 'Photography',
+                    'is_quick_turnaround': rng.random() < 0.2,
+                    'is_covered': rng.random() < 0.8,
+                    'deadline': (event_date + timedelta(days=rng.randrange(1, 7))).isoformat(),
+                    'process_point': rng.choice(PROCESS_POINTS)
+                })
+
+                crew = rng.sample(org_personnel, min(sizes['assignments_per_event'], len(org_personnel)))
+                assignments.extend({'event_id': event_id, 'personnel_id': person['id']} for person in crew)
+
+                for _ in range(sizes['shots_per_event']):
+                    shot_id = len(shots) + 1
+                    photographer = rng.choice(photographers)
+                    shots.append({
+                        'id': shot_id,
+                        'image': f'/images/{event_id}/{shot_id}.jpg',
+                        'date_created': event_date,
+                        'camera': rng.choice(CAMERAS),
+                        'filename': f'IMG_{shot_id:07d}.CR3',
+                        'captured_at': datetime.combine(event_date, time(start_hour)) + timedelta(seconds=rng.randrange(7200)),
+                        'event_id': event_id,
+                        'photographer_id': photographer['id']
+                    })
+
+                for _ in range(sizes['shot_requests_per_event']):
+                    shot_requests.append({
+                        'id': len(shot_requests) + 1,
+                        'shot_description': rng.choice(SHOT_WORDS),
+                        'start_time': f'{start_hour:02d}:{rng.randrange(0, 60, 15):02d}',
+                        'end_time': f'{start_hour + 1:02d}:00',
+                        'stakeholder': rng.choice(['Marketing', 'Sales', 'Executive', 'PR']),
+                        'quick_turn': rng.random() < 0.25,
+                        'deadline': (event_date + timedelta(days=rng.randrange(0, 3))).isoformat(),
+                        'key_sponsor': f'Sponsor {rng.randrange(1, 30)}',
+                        'status': None,
+                        'process_point': rng.choice(PROCESS_POINTS),
+                        'event_id': event_id
+                    })
+                    shot_requests[-1]['deadline_sort'] = deadline_sort(shot_requests[-1]['deadline'])
+
+    tables = [
+        (Role.__table__, roles),
+        (Organization.__table__, organizations),
+        (User.__table__, users),
+        (Personnel.__table__, personnel),
+        (Project.__table__, projects),
+        (project_key_personnel, key_personnel),
+        (Event.__table__, events),
+        (event_personnel, assignments),
+        (Shot.__table__, shots),
+        (Shot_Request.__table__, shot_requests),
+    ]
+    with engine.begin() as conn:
+        for table, rows in tables:
+            _insert(conn, table, rows)
+
+    return {table.name: len(rows) for table, rows in tables}
+
+
+def prepare_database(engine):
+    """Create the schema, search indexes and everything else the API expects"""
+    import search
+    from models import migrate_database
+    Base.metadata.create_all(engine)
+    migrate_database(engine)
+    search.create_search_index(engine)
+
+
+def finish_database(engine):
+    """Rebuild derived data that bulk inserts bypass"""
+    import stats
+    from sqlalchemy.orm import Session
+    with engine.begin() as conn:
+        # Rows were written with explicit ids, which PostgreSQL sequences don't see
+        dialects.reset_sequences(conn, Base.metadata.sorted_tables)
+    session = Session(bind=engine)
+    try:
+        stats.rebuild_stats(session)
+        session.commit()
+    finally:
+        session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a deterministic Hive dataset')
+    parser.add_argument('--scale', type=float, default=1, help='scale factor (1, 10, 100, ...)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database-url', default='sqlite:///bench.db')
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    prepare_database(engine)
+    counts = generate(engine, scale=args.scale, seed=args.seed)
+    finish_database(engine)
+    for table, count in counts.items():
+        print(f'{table}: {count}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+API benchmark harness.
+
+    # Record a baseline
+    python -m benchmarks.run --scale 10 --output benchmarks/baseline.json
+
+    # Fail (exit code 1) if anything regressed against it
+    python -m benchmarks.run --scale 10 --compare benchmarks/baseline.json
+
+    # Run against an empty PostgreSQL database instead of a temporary SQLite file
+    python -m benchmarks.run --database-url postgresql+psycopg2://localhost/hive_bench
+
+Each run builds a fresh database with benchmarks.datagen, then drives every
+scenario through Flask's test client. Latency percentiles come from the timed
+iterations; statement counts from an engine listener; peak memory from one
+extra tracemalloc pass so tracing doesn't distort the timings.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# (name, method, path, JSON body). Paths may use {event_id}, {project_id}, {organization_id},
+# {personnel_id} and {shot_request_id}, which are filled from the generated dataset.
+SCENARIOS = [
+    ('list_events', 'GET', '/events', None),
+    ('list_events_calendar', 'GET', '/events?fields=id,name,date', None),
+    ('get_event', 'GET', '/events/{event_id}', None),
+    ('event_shots', 'GET', '/events/{event_id}/shots', None),
+    ('event_shots_window', 'GET', '/events/{event_id}/shots?from=2000-01-01&to=2100-01-01', None),
+    ('event_personnel', 'GET', '/events/{event_id}/personnel', None),
+    ('list_personnel', 'GET', '/personnel', None),
+    ('list_photographers', 'GET', '/photographers', None),
+    ('list_shots', 'GET', '/shots', None),
+    ('list_shot_requests', 'GET', '/shot-requests', None),
+    ('list_projects', 'GET', '/projects', None),
+    ('get_project', 'GET', '/projects/{project_id}', None),
+    ('project_events', 'GET', '/projects/{project_id}/events', None),
+    ('list_organizations', 'GET', '/organizations', None),
+    ('search', 'GET', '/search?q=gala', None),
+    ('project_stats', 'GET', '/stats/projects/{project_id}', None),
+    ('export_organization', 'GET', '/organizations/{organization_id}/export', None),
+    ('create_shot', 'POST', '/shots', {
+        'image': '/images/bench.jpg', 'date_created': '2024-01-01', 'camera': 'Bench Cam',
+        'filename': 'BENCH-{n}.CR3', 'event_id': '{event_id}', 'photographer_id': '{personnel_id}'
+    }),
+    ('update_shot_request', 'PUT', '/shot-requests/{shot_request_id}', {'processPoint': 'review'}),
+    ('bulk_assign', 'POST', '/events/personnel/bulk', {
+        'assign': [['{event_id}', '{personnel_id}']], 'remove': []
+    }),
+]
+
+# Relative slack before a slower/larger result counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def _fill(value, ids):
+    if isinstance(value, str):
+        filled = value.format(**ids)
+        return int(filled) if filled.isdigit() and value.startswith('{') else filled
+    if isinstance(value, list):
+        return [_fill(item, ids) for item in value]
+    if isinstance(value, dict):
+        return {key: _fill(item, ids) for key, item in value.items()}
+    return value
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def _pick_ids(session):
+    """Choose representative ids from the middle of the dataset"""
+    from sqlalchemy import func
+    from models import Event, Personnel, Shot_Request
+
+    def middle(column, *criteria):
+        count = session.query(func.count(column)).filter(*criteria).scalar()
+        return session.query(column).filter(*criteria).order_by(column).offset(count // 2).limit(1).scalar()
+
+    event_id = middle(Event.id)
+    event = session.get(Event, event_id)
+    return {
+        'event_id': event_id,
+        'project_id': event.project_id,
+        'organization_id': event.organization_id,
+        'personnel_id': middle(Personnel.id, Personnel.has_photographer_role.is_(True)),
+        'shot_request_id': middle(Shot_Request.id)
+    }
+
+
+def run(scale=1, iterations=20, warmup=2, seed=42, database_url=None):
+    """Build a dataset and benchmark every scenario; returns the results document.
+
+    database_url must be an empty database; by default a temporary SQLite file is used.
+    """
+    if database_url is None:
+        workdir = tempfile.mkdtemp(prefix='hive-bench-')
+        database_url = f'sqlite:///{os.path.join(workdir, "bench.db")}'
+    # main.py and models.py read DATABASE_URL at import time
+    os.environ['DATABASE_URL'] = database_url
+    # Every iteration should run the handler, so repeat GETs aren't served from the response cache
+    os.environ['HIVE_RESPONSE_CACHE_TTL_SECONDS'] = '0'
+
+    from benchmarks import datagen
+    from sqlalchemy import create_engine, event
+    setup_engine = create_engine(database_url)
+    datagen.prepare_database(setup_engine)
+    counts = datagen.generate(setup_engine, scale=scale, seed=seed)
+    datagen.finish_database(setup_engine)
+    setup_engine.dispose()
+
+    import main
+    client = main.create_app().test_client()
+
+    statements = []
+    event.listen(main.get_engine(), 'before_cursor_execute', lambda *args: statements.append(1))
+
+    session = main.Session()
+    try:
+        ids = _pick_ids(session)
+    finally:
+        session.close()
+
+    results = {}
+    for name, method, path, body in SCENARIOS:
+        url = path.format(**ids)
+        # {n} numbers the calls, so creates don't collide with the unique constraints
+        calls = itertools.count()
+
+        def call():
+            payload = _fill(body, {**ids, 'n': next(calls)}) if body is not None else None
+            response = client.open(url, method=method, json=payload)
+            response.get_data()
+            return response.status_code
+
+        for _ in range(warmup):
+            call()
+
+        latencies = []
+        statement_counts = []
+        status = None
+        for _ in range(iterations):
+            statements.clear()
+            started = time.perf_counter()
+            status = call()
+            latencies.append((time.perf_counter() - started) * 1000)
+            statement_counts.append(len(statements))
+
+        tracemalloc.start()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = {
+            'method': method,
+            'path': path,
+            'status': status,
+            'p50Ms': round(_percentile(latencies, 0.50), 3),
+            'p95Ms': round(_percentile(latencies, 0.95), 3),
+            'p99Ms': round(_percentile(latencies, 0.99), 3),
+            'meanMs': round(sum(latencies) / len(latencies), 3),
+            'queries': max(statement_counts),
+            'peakMemoryKb': round(peak / 1024, 1)
+        }
+        print(f'{name:24s} {results[name]["p50Ms"]:9.2f} ms p50 {results[name]["p95Ms"]:9.2f} ms p95 '
+              f'{results[name]["queries"]:5d} queries {results[name]["peakMemoryKb"]:10.1f} KB', file=sys.stderr)
+
+    return {
+        'meta': {
+            'scale': scale,
+            'seed': seed,
+            'iterations': iterations,
+            'database': main.get_engine().dialect.name,
+            'rows': counts,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'createdAt': datetime.now().isoformat()
+        },
+        'results': results
+    }
+
+
+def compare(baseline, current, tolerance=DEFAULT_TOLERANCE):
+    """Return a list of regression messages (empty when current is no worse than baseline)"""
+    regressions = []
+    if baseline['meta']['scale'] != current['meta']['scale']:
+        regressions.append(f'scale differs: baseline {baseline["meta"]["scale"]}, current {current["meta"]["scale"]}')
+        return regressions
+    # Results from before the database was recorded are from SQLite
+    databases = baseline['meta'].get('database', 'sqlite'), current['meta'].get('database', 'sqlite')
+    if databases[0] != databases[1]:
+        regressions.append(f'database differs: baseline {databases[0]}, current {databases[1]}')
+        return regressions
+
+    for name, before in baseline['results'].items():
+        after = current['results'].get(name)
+        if after is None:
+            regressions.append(f'{name}: scenario missing from current run')
+            continue
+        if after['status'] != before['status']:
+            regressions.append(f'{name}: status {before["status"]} -> {after["status"]}')
+        # Statement counts are deterministic, so any increase is a regression (e.g. a new N+1)
+        if after['queries'] > before['queries']:
+            regressions.append(f'{name}: queries {before["queries"]} -> {after["queries"]}')
+        if after['p95Ms'] > before['p95Ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {before["p95Ms"]} ms -> {after["p95Ms"]} ms')
+        if after['peakMemoryKb'] > before['peakMemoryKb'] * (1 + tolerance):
+            regressions.append(f'{name}: peak memory {before["peakMemoryKb"]} KB -> {after["peakMemoryKb"]} KB')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Hive API')
+    parser.add_argument('--scale', type=float, default=1, help='dataset scale factor (1, 10, 100, ...)')
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database-url', help='empty database to run against (default: a temporary SQLite file)')
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--compare', help='baseline JSON to compare against; exits 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed relative increase in p95 latency and peak memory')
+    args = parser.parse_args()
+
+    current = run(scale=args.scale, iterations=args.iterations, warmup=args.warmup, seed=args.seed,
+                  database_url=args.database_url)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+        print(f'Results written to {args.output}', file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, tolerance=args.tolerance)
+        if regressions:
+            print('Regressions found:', file=sys.stderr)
+            for regression in regressions:
+                print(f'  {regression}', file=sys.stderr)
+            sys.exit(1)
+        print('No regressions', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
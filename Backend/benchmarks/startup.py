@@ -0,0 +1,144 @@
+"""
+Cold start budget.
+
+    # Boot the API 5 times; exit code 1 if the fastest boot is over budget
+    python -m benchmarks.startup --repeat 5 --budget-ms 300
+
+    # The same check runs with the test suite (tests/test_startup.py)
+    python -m pytest -q tests/test_startup.py
+
+Each run starts a fresh interpreter with `python -X importtime`, imports main
+and calls create_app(), the work an autoscaled instance does before it can
+accept requests. The import total comes from the -X importtime report; the
+slowest direct imports of the fastest run are listed so a regression points
+at its cause.
+
+The budget covers the app's own share of the boot: main, models, the Backend
+modules and create_app(). The frameworks it is built on (FRAMEWORK_MODULES)
+are imported first in the same interpreter and timed separately, because they
+cost 400-600 ms on their own on a small instance, vary with the machine far
+more than anything in this tree, and cannot be made lazy. Their time is
+reported but not budgeted; the app's share is typically 130-200 ms.
+
+A boot also fails the check if it imported a module that must stay lazy
+(LAZY_MODULES) or touched the database, which should wait for the first request.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+DEFAULT_BUDGET_MS = 300
+DEFAULT_REPEAT = 3
+
+# Loaded on first use only (see firebase_admin_init.py and main.get_engine)
+LAZY_MODULES = ('firebase_admin', 'google.cloud.firestore', 'psycopg2')
+
+# Imported before main and timed apart from it (see the module docstring)
+FRAMEWORK_MODULES = ('flask', 'flask_cors', 'flask_restful', 'sqlalchemy', 'sqlalchemy.orm')
+
+BOOT_SCRIPT = f'''
+import time
+started = time.perf_counter()
+import {", ".join(FRAMEWORK_MODULES)}
+frameworks = time.perf_counter()
+import main
+main.create_app()
+print(f"{{(frameworks - started) * 1000:.3f}} {{(time.perf_counter() - frameworks) * 1000:.3f}}")
+'''
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_importtime(report):
+    """{module: (self us, cumulative us, depth)} from -X importtime output, in report order"""
+    modules = {}
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return modules
+
+
+def boot(workdir):
+    """Boot the API once in a fresh interpreter.
+
+    Returns (app ms, framework ms, imported modules, database created).
+    """
+    database_path = os.path.join(workdir, 'startup.db')
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database_path}', PYTHONPATH=BACKEND_DIR)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    created = os.path.exists(database_path)
+    if created:
+        os.remove(database_path)
+    framework_ms, app_ms = (float(value) for value in result.stdout.strip().splitlines()[-1].split())
+    return app_ms, framework_ms, parse_importtime(result.stderr), created
+
+
+def main_imports(modules):
+    """{module: cumulative us} for what main imported directly (and the frameworks had not already)"""
+    # The report lists a module's imports (one level deeper) just before the module itself
+    pending = {}
+    for name, (_, cumulative, depth) in modules.items():
+        if depth == 1:
+            pending[name] = cumulative
+        elif depth == 0:
+            if name == 'main':
+                return pending
+            pending = {}
+    return pending
+
+
+def check(repeat=DEFAULT_REPEAT, budget_ms=DEFAULT_BUDGET_MS, top=10, out=sys.stderr):
+    """Boot the API repeat times and report on the fastest; returns the list of failures"""
+    workdir = tempfile.mkdtemp(prefix='hive-startup-')
+    try:
+        runs = [boot(workdir) for _ in range(repeat)]
+    finally:
+        os.rmdir(workdir)
+    app_ms, framework_ms, modules, created = min(runs, key=lambda run: run[0])
+
+    import_ms = modules['main'][1] / 1000
+    direct = main_imports(modules)
+    print(f'boot {app_ms:.1f} ms (fastest of {repeat}) after {framework_ms:.1f} ms of frameworks, '
+          f'imports {import_ms:.1f} ms', file=out)
+    for name, cumulative in sorted(direct.items(), key=lambda item: -item[1])[:top]:
+        print(f'  {name:32s} {cumulative / 1000:9.1f} ms', file=out)
+
+    failures = []
+    if app_ms > budget_ms:
+        failures.append(f'boot took {app_ms:.1f} ms, budget is {budget_ms:.0f} ms')
+    eager = sorted(name for name in modules if name.startswith(LAZY_MODULES))
+    if eager:
+        failures.append(f'imported at boot: {", ".join(eager)}')
+    if any(run[3] for run in runs):
+        failures.append('the database was opened at boot')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the API cold start time')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help='largest acceptable time for the fastest run to import main and call create_app(), after the frameworks')
+    parser.add_argument('--top', type=int, default=10, help='slowest direct imports to list')
+    args = parser.parse_args()
+
+    failures = check(args.repeat, args.budget_ms, args.top)
+    if failures:
+        print('Startup budget exceeded:', file=sys.stderr)
+        for failure in failures:
+            print(f'  {failure}', file=sys.stderr)
+        sys.exit(1)
+    print('Within budget', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""
+Checksum verification of ingest copies.
+
+    # Verify a card's backup against its working copy on 8 processes
+    python checksums.py /Volumes/Working/CARD01 /Volumes/Backup/CARD01 --processes 8
+
+Ingest copies every file of a card twice, a working copy and a backup.
+POST /shots/verify queues a 'checksum-verify' job (see jobs.py) for a batch of
+shots and their two copies, and returns 202 with the job, whose progress
+(files verified out of the total) is polled at GET /jobs/<id>. For each shot
+the job stores the working copy's digest, size and algorithm on the shot row,
+with checksum_result:
+
+- passed: both copies have the same digest, and it matches the digest stored
+  for the shot by an earlier verification, if any
+- failed: the copies differ, or the file changed since it was last verified
+- missing: a copy can't be read
+
+Files are hashed on a process pool of HIVE_CHECKSUM_PROCESSES processes (one
+per CPU by default), each copy as its own task, so a card's verification
+scales with the cores and with the bandwidth of both disks. Files of at least
+HIVE_CHECKSUM_MMAP_MIN_BYTES (large RAW files) are memory-mapped and hashed in
+HIVE_CHECKSUM_CHUNK_BYTES slices without copying; smaller ones are streamed
+through one reused buffer. The digest is BLAKE2b by default, or XXH3-128 with
+HIVE_CHECKSUM_ALGORITHM=xxh3_128, which needs the `xxhash` package and is
+several times faster where the disks are faster than BLAKE2b.
+
+Only files under the directories in HIVE_CHECKSUM_ROOTS (separated by the
+OS path separator, default HIVE_MEDIA_ROOT) are read. A shot's working copy
+defaults to its image under HIVE_MEDIA_ROOT.
+"""
+
+import argparse
+import hashlib
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from sqlalchemy import select, update
+from compaction import MEDIA_ROOT, media_path
+from models import Shot
+import jobs
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+CHECKSUM_ALGORITHM = os.environ.get('HIVE_CHECKSUM_ALGORITHM', 'blake2b')
+CHECKSUM_PROCESSES = int(os.environ.get('HIVE_CHECKSUM_PROCESSES', '0')) or None
+CHECKSUM_CHUNK_BYTES = int(os.environ.get('HIVE_CHECKSUM_CHUNK_BYTES', str(4 * 1024 * 1024)))
+CHECKSUM_MMAP_MIN_BYTES = int(os.environ.get('HIVE_CHECKSUM_MMAP_MIN_BYTES', str(16 * 1024 * 1024)))
+CHECKSUM_ROOTS = [root for root in os.environ.get('HIVE_CHECKSUM_ROOTS', MEDIA_ROOT or '').split(os.pathsep) if root]
+
+# Most files one POST /shots/verify takes
+MAX_FILES = 10000
+
+# Rows updated per commit while a job stores results
+RESULT_BATCH_SIZE = 200
+
+# Longest a job goes without reporting progress, which also renews its lease (see jobs.py)
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+# Algorithm -> factory for a hashlib-style object with update() and hexdigest()
+ALGORITHMS = {'blake2b': hashlib.blake2b}
+if xxhash is not None:
+    ALGORITHMS['xxh3_128'] = xxhash.xxh3_128
+
+
+class ChecksumError(Exception):
+    """Raised for a verification request that can't be run"""
+
+
+def allowed_path(path):
+    """The real path if it is under one of CHECKSUM_ROOTS, else None"""
+    if not path:
+        return None
+    path = os.path.realpath(path)
+    for root in CHECKSUM_ROOTS:
+        root = os.path.realpath(root)
+        if path.startswith(root + os.sep):
+            return path
+    return None
+
+
+def hash_file(path, algorithm=CHECKSUM_ALGORITHM, chunk_bytes=CHECKSUM_CHUNK_BYTES,
+              mmap_min_bytes=CHECKSUM_MMAP_MIN_BYTES):
+    """(hex digest, size) of a file; (None, None) if it can't be read. Runs in the pool's processes."""
+    digest = ALGORITHMS[algorithm]()
+    try:
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size >= mmap_min_bytes:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if hasattr(mapped, 'madvise'):
+                        mapped.madvise(mmap.MADV_SEQUENTIAL)
+                    view = memoryview(mapped)
+                    try:
+                        for offset in range(0, size, chunk_bytes):
+                            digest.update(view[offset:offset + chunk_bytes])
+                    finally:
+                        view.release()
+            else:
+                buffer = bytearray(min(chunk_bytes, max(size, 1)))
+                view = memoryview(buffer)
+                while True:
+                    count = file.readinto(buffer)
+                    if not count:
+                        break
+                    digest.update(view[:count])
+    except OSError:
+        return None, None
+    return digest.hexdigest(), size
+
+
+def _pool(processes):
+    # Job workers are threads, and forking a threaded process is unsafe
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _outcome(working, backup):
+    (working_digest, size), (backup_digest, backup_size) = working, backup
+    if working_digest is None or backup_digest is None:
+        result = 'missing'
+    elif working_digest == backup_digest and size == backup_size:
+        result = 'passed'
+    else:
+        result = 'failed'
+    return {'working': working_digest, 'backup': backup_digest, 'size': size, 'result': result}
+
+
+def verify_pairs(pairs, algorithm=CHECKSUM_ALGORITHM, processes=CHECKSUM_PROCESSES, on_result=None,
+                 on_wait=None, wait_seconds=PROGRESS_INTERVAL_SECONDS):
+    """Hash every (key, working path, backup path) on a process pool; a path of None counts as unreadable.
+
+    Calls on_result(key, result) as each pair finishes, where result has the
+    working and backup digests, the size and 'passed', 'failed' or
+    'missing', and returns {key: result}. on_wait() is called every
+    wait_seconds while no pair finishes, e.g. to keep a job's lease.
+    """
+    if algorithm not in ALGORITHMS:
+        raise ChecksumError(f'Unknown or unavailable checksum algorithm: {algorithm}')
+    results = {}
+    hashes = {}
+
+    def finish(key):
+        copies = hashes.pop(key)
+        results[key] = _outcome(copies['working'], copies['backup'])
+        if on_result is not None:
+            on_result(key, results[key])
+
+    with _pool(processes) as pool:
+        futures = {}
+        for key, working, backup in pairs:
+            hashes[key] = {}
+            for copy, path in (('working', working), ('backup', backup)):
+                if path is None:
+                    hashes[key][copy] = (None, None)
+                else:
+                    futures[pool.submit(hash_file, path, algorithm)] = (key, copy)
+            if len(hashes[key]) == 2:
+                finish(key)
+        running = set(futures)
+        while running:
+            finished, running = wait(running, timeout=wait_seconds, return_when=FIRST_COMPLETED)
+            if not finished and on_wait is not None:
+                on_wait()
+            for future in finished:
+                key, copy = futures[future]
+                hashes[key][copy] = future.result()
+                if len(hashes[key]) == 2:
+                    finish(key)
+    return results
+
+
+def enqueue_verify(session, files, algorithm=CHECKSUM_ALGORITHM):
+    """Queue verifying [{shotId, workingPath?, backupPath}] in the session's transaction; returns the job"""
+    if algorithm not in ALGORITHMS:
+        raise ChecksumError(f'Unknown or unavailable checksum algorithm: {algorithm}')
+    if not files:
+        raise ChecksumError('files must not be empty')
+    if len(files) > MAX_FILES:
+        raise ChecksumError(f'At most {MAX_FILES} files can be verified in one call')
+
+    try:
+        shot_ids = [int(item['shotId']) for item in files]
+    except (KeyError, TypeError, ValueError):
+        raise ChecksumError('Every file needs a shotId')
+    # Results are keyed by shot, so each shot can only be verified once per job
+    duplicates = sorted(shot_id for shot_id, count in Counter(shot_ids).items() if count > 1)
+    if duplicates:
+        raise ChecksumError(f'Shots listed more than once: {", ".join(map(str, duplicates[:20]))}')
+    images = dict(session.execute(select(Shot.id, Shot.image).where(Shot.id.in_(shot_ids))).all())
+    missing = sorted(set(shot_ids) - set(images))
+    if missing:
+        raise ChecksumError(f'Shots not found: {", ".join(map(str, missing[:20]))}')
+
+    target = []
+    for shot_id, item in zip(shot_ids, files):
+        working = allowed_path(item['workingPath']) if item.get('workingPath') else media_path(images[shot_id])
+        backup = allowed_path(item.get('backupPath'))
+        if working is None or backup is None:
+            raise ChecksumError(f'Shot {shot_id}: both copies must be under HIVE_CHECKSUM_ROOTS')
+        target.append({'shotId': shot_id, 'working': working, 'backup': backup})
+    return jobs.queue.enqueue(session, 'checksum-verify', {'algorithm': algorithm, 'files': target})
+
+
+def _store(session_factory, algorithm, results):
+    """Write a batch of {shot id: result} to the shots, comparing with their stored digests"""
+    session = session_factory()
+    try:
+        stored = dict(session.execute(
+            select(Shot.id, Shot.checksum).where(Shot.id.in_(list(results)), Shot.checksum_algorithm == algorithm)
+        ).all())
+        now = datetime.now()
+        for shot_id, result in results.items():
+            values = {'checksum_result': result['result'], 'checksum_verified_at': now}
+            if result['result'] == 'passed':
+                if stored.get(shot_id) not in (None, result['working']):
+                    # The copies agree, but the file is no longer what was verified before; keep the old digest
+                    values['checksum_result'] = 'failed'
+                else:
+                    values.update(checksum=result['working'], checksum_algorithm=algorithm, size_bytes=result['size'])
+            session.execute(update(Shot).where(Shot.id == shot_id).values(**values))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+@jobs.queue.handler('checksum-verify')
+def _run_verify(session_factory, job):
+    algorithm, files = job.target['algorithm'], job.target['files']
+    job.report(0, len(files))
+    batch, done = {}, 0
+    reported_at = time.monotonic()
+
+    def report(force=False):
+        # Progress goes out at most every PROGRESS_INTERVAL_SECONDS; results are written in batches
+        nonlocal reported_at
+        if force or time.monotonic() - reported_at >= PROGRESS_INTERVAL_SECONDS:
+            job.report(done)
+            reported_at = time.monotonic()
+
+    def on_result(shot_id, result):
+        nonlocal batch, done
+        batch[shot_id] = result
+        done += 1
+        if len(batch) >= RESULT_BATCH_SIZE:
+            _store(session_factory, algorithm, batch)
+            batch = {}
+        report()
+
+    verify_pairs([(item['shotId'], item['working'], item['backup']) for item in files], algorithm,
+                 on_result=on_result, on_wait=lambda: report(force=True))
+    if batch:
+        _store(session_factory, algorithm, batch)
+    report(force=True)
+
+
+def _pairs(working_root, backup_root):
+    for directory, _, names in os.walk(working_root):
+        for name in sorted(names):
+            working = os.path.join(directory, name)
+            relative = os.path.relpath(working, working_root)
+            yield relative, working, os.path.join(backup_root, relative)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verify that a backup copy matches its working copy, file by file')
+    parser.add_argument('working', help='working copy directory')
+    parser.add_argument('backup', help='backup copy directory')
+    parser.add_argument('--processes', type=int, default=CHECKSUM_PROCESSES, help='hashing processes (default: one per CPU)')
+    parser.add_argument('--algorithm', default=CHECKSUM_ALGORITHM, choices=sorted(ALGORITHMS))
+    args = parser.parse_args()
+
+    pairs = list(_pairs(args.working, args.backup))
+    started = time.perf_counter()
+    results = verify_pairs(pairs, args.algorithm, args.processes)
+    seconds = time.perf_counter() - started
+
+    size = sum(result['size'] or 0 for result in results.values())
+    bad = {relative: result for relative, result in sorted(results.items()) if result['result'] != 'passed'}
+    for relative, result in bad.items():
+        print(f'{result["result"]:8s} {relative}')
+    # Both copies are read, so twice the size goes through the hasher
+    print(f'{len(results)} files, {size / 1e6:.1f} MB in {seconds:.2f}s ({2 * size / 1e6 / max(seconds, 1e-9):.0f} MB/s read), '
+          f'{len(bad)} not passed', file=sys.stderr)
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == '__main__':
+    main()
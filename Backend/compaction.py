@@ -0,0 +1,190 @@
+"""
+Background compaction of soft-deleted rows.
+
+    # Purge everything that is soft-deleted right now
+    python compaction.py
+
+A daemon thread wakes every HIVE_COMPACTION_INTERVAL_SECONDS and, once the API
+has seen no requests for HIVE_COMPACTION_IDLE_SECONDS, physically deletes
+soft-deleted shots, the shots and shot requests of soft-deleted events, and
+then the events themselves. Work is done in small batches, each in its own
+short transaction. The batch size adapts so a batch stays under
+HIVE_COMPACTION_MAX_BATCH_MS, which bounds how long ingest writers can be
+blocked. The worker yields as soon as a request comes in.
+
+With HIVE_MEDIA_ROOT set, the image file of each purged shot is removed too,
+after its batch has committed.
+
+The counters were already adjusted when the rows were soft-deleted, so
+nothing here touches stats.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from sqlalchemy import delete, or_, select
+from models import Event, Shot, Shot_Request, event_personnel, event_users
+
+logger = logging.getLogger('hive.compaction')
+
+COMPACTION_INTERVAL_SECONDS = float(os.environ.get('HIVE_COMPACTION_INTERVAL_SECONDS', '30'))
+COMPACTION_IDLE_SECONDS = float(os.environ.get('HIVE_COMPACTION_IDLE_SECONDS', '5'))
+COMPACTION_MAX_BATCH_MS = float(os.environ.get('HIVE_COMPACTION_MAX_BATCH_MS', '50'))
+COMPACTION_BATCH_SIZE = int(os.environ.get('HIVE_COMPACTION_BATCH_SIZE', '500'))
+MEDIA_ROOT = os.environ.get('HIVE_MEDIA_ROOT')
+
+MIN_BATCH_SIZE = 10
+
+_last_activity = time.monotonic()
+
+
+def compaction_enabled():
+    return COMPACTION_INTERVAL_SECONDS > 0
+
+
+def note_activity():
+    """Request hook: remember when the API was last busy"""
+    global _last_activity
+    _last_activity = time.monotonic()
+
+
+def idle_for():
+    return time.monotonic() - _last_activity
+
+
+def _deleted_events():
+    return select(Event.id).where(Event.deleted_at.isnot(None))
+
+
+def media_path(image):
+    """Resolve a shot's image to a file under MEDIA_ROOT, or None if it points elsewhere"""
+    if not MEDIA_ROOT or not image or '://' in image:
+        return None
+    root = os.path.realpath(MEDIA_ROOT)
+    path = os.path.realpath(os.path.join(root, image.lstrip('/')))
+    return path if path.startswith(root + os.sep) else None
+
+
+class Compactor:
+    def __init__(self, session_factory, batch_size=COMPACTION_BATCH_SIZE, max_batch_ms=COMPACTION_MAX_BATCH_MS):
+        self.session_factory = session_factory
+        self.max_batch_size = batch_size
+        self.batch_size = batch_size
+        self.max_batch_ms = max_batch_ms
+
+    def _purge_shots(self, connection):
+        rows = connection.execute(
+            select(Shot.id, Shot.image)
+            .where(or_(Shot.deleted_at.isnot(None), Shot.event_id.in_(_deleted_events())))
+            .limit(self.batch_size)
+        ).all()
+        if rows:
+            connection.execute(delete(Shot).where(Shot.id.in_([row.id for row in rows])))
+        return len(rows), [row.image for row in rows]
+
+    def _purge_shot_requests(self, connection):
+        ids = connection.execute(
+            select(Shot_Request.id).where(Shot_Request.event_id.in_(_deleted_events())).limit(self.batch_size)
+        ).scalars().all()
+        if ids:
+            connection.execute(delete(Shot_Request).where(Shot_Request.id.in_(ids)))
+        return len(ids), []
+
+    def _purge_events(self, connection):
+        # Only events whose shots and shot requests are already gone
+        ids = connection.execute(
+            _deleted_events()
+            .where(~Event.id.in_(select(Shot.event_id).where(Shot.event_id.isnot(None))))
+            .where(~Event.id.in_(select(Shot_Request.event_id).where(Shot_Request.event_id.isnot(None))))
+            .limit(self.batch_size)
+        ).scalars().all()
+        if ids:
+            connection.execute(delete(event_personnel).where(event_personnel.c.event_id.in_(ids)))
+            connection.execute(delete(event_users).where(event_users.c.event_id.in_(ids)))
+            connection.execute(delete(Event).where(Event.id.in_(ids)))
+        return len(ids), []
+
+    def run_batch(self):
+        """Purge one batch in its own transaction; returns the number of rows purged (0 when done)"""
+        session = self.session_factory()
+        started = time.perf_counter()
+        try:
+            connection = session.connection()
+            purged, images = 0, []
+            for step in (self._purge_shots, self._purge_shot_requests, self._purge_events):
+                purged, images = step(connection)
+                if purged:
+                    break
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._adapt(elapsed_ms)
+
+        for image in images:
+            path = media_path(image)
+            if path:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning('Could not remove %s: %s', path, e)
+        return purged
+
+    def _adapt(self, elapsed_ms):
+        """Shrink the batch when it held the lock too long, grow it back when there's headroom"""
+        if elapsed_ms > self.max_batch_ms:
+            self.batch_size = max(MIN_BATCH_SIZE, self.batch_size // 2)
+        elif elapsed_ms < self.max_batch_ms / 4:
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+
+    def run(self, should_continue=lambda: True):
+        """Purge batches until nothing is left or should_continue() says stop; returns rows purged"""
+        total = 0
+        while should_continue():
+            purged = self.run_batch()
+            if not purged:
+                break
+            total += purged
+        return total
+
+
+def _worker(compactor):
+    while True:
+        time.sleep(COMPACTION_INTERVAL_SECONDS)
+        if idle_for() < COMPACTION_IDLE_SECONDS:
+            continue
+        try:
+            purged = compactor.run(should_continue=lambda: idle_for() >= COMPACTION_IDLE_SECONDS)
+            if purged:
+                logger.info('Compaction purged %d soft-deleted rows', purged)
+        except Exception:
+            logger.exception('Compaction batch failed')
+
+
+def start_worker(session_factory):
+    """Start the idle-time compaction thread"""
+    thread = threading.Thread(target=_worker, args=(Compactor(session_factory),), name='hive-compaction', daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import database_url
+
+    engine = create_engine(database_url)
+    purged = Compactor(sessionmaker(bind=engine)).run()
+    print(f'Purged {purged} soft-deleted rows', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
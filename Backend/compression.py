@@ -0,0 +1,357 @@
+"""
+Response compression and the compressed response cache.
+
+JSON responses of at least HIVE_COMPRESSION_MIN_BYTES are compressed with the
+best encoding the client accepts (Accept-Encoding, by q-value, then zstd, br,
+gzip). gzip is always available. br needs the `brotli` package and zstd the
+`zstandard` package. Streamed lists are compressed chunk by chunk as they are
+sent. Levels come from HIVE_GZIP_LEVEL, HIVE_BROTLI_QUALITY and HIVE_ZSTD_LEVEL.
+
+GET handlers decorated with @cached keep their response bodies, already
+compressed, for HIVE_RESPONSE_CACHE_TTL_SECONDS, keyed by URL and encoding.
+A repeat hit is served from memory without running the handler or compressing
+again. Every committed write through the engine clears the cache. Cached
+bodies are bounded by HIVE_RESPONSE_CACHE_MAX_BYTES in total, least recently
+used first out. Writes made by other processes are only picked up when entries
+expire, so keep the TTL short when several processes share a database.
+With read replicas, a response read from a replica isn't stored within
+HIVE_READ_YOUR_WRITES_SECONDS of the last write, because the replica may not
+have that write yet and the stale body would be served for the whole TTL.
+
+Compression time and bytes in/out per encoding, and cache hits and misses,
+are counted in the metrics served by GET /metrics.
+"""
+
+import functools
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from flask import Response, g, request
+from sqlalchemy import event
+from instrumentation import metrics
+import dialects
+import routing
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_ENABLED = os.environ.get('HIVE_COMPRESSION', '1').lower() in ('1', 'true', 'yes')
+COMPRESSION_MIN_BYTES = int(os.environ.get('HIVE_COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('HIVE_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('HIVE_BROTLI_QUALITY', '4'))
+ZSTD_LEVEL = int(os.environ.get('HIVE_ZSTD_LEVEL', '3'))
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get('HIVE_RESPONSE_CACHE_TTL_SECONDS', '60'))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('HIVE_RESPONSE_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/plain', 'text/html', 'text/csv')
+
+# Compression latency buckets in seconds
+COMPRESSION_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+metrics.histogram('hive_compression_seconds', 'Time spent compressing response bodies by encoding',
+                  buckets=COMPRESSION_BUCKETS)
+metrics.counter('hive_compression_bytes_total', 'Response bytes before (stage="in") and after (stage="out") compression')
+metrics.counter('hive_response_cache_total', 'Response cache lookups (hit, miss, bypass) and stores')
+
+
+class _Brotli:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+# Encoding -> factory for an object with compress(bytes) and flush(), in order of preference
+COMPRESSORS = OrderedDict()
+if zstandard is not None:
+    COMPRESSORS['zstd'] = lambda: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+if brotli is not None:
+    COMPRESSORS['br'] = _Brotli
+# wbits 31: gzip header and trailer around the deflate stream
+COMPRESSORS['gzip'] = lambda: zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def compression_enabled():
+    return COMPRESSION_ENABLED
+
+
+def negotiate():
+    """The encoding to send this request's response in; 'identity' when it won't be compressed"""
+    if not COMPRESSION_ENABLED:
+        return 'identity'
+    accepted = request.accept_encodings
+    best, best_quality = 'identity', 0
+    for encoding in COMPRESSORS:
+        quality = accepted.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(encoding, data):
+    """Compress a whole body, recording the time and sizes"""
+    started = time.perf_counter()
+    compressor = COMPRESSORS[encoding]()
+    compressed = compressor.compress(data) + compressor.flush()
+    _record(encoding, time.perf_counter() - started, len(data), len(compressed))
+    return compressed
+
+
+def _record(encoding, seconds, size_in, size_out):
+    metrics.observe('hive_compression_seconds', seconds, {'encoding': encoding})
+    metrics.inc('hive_compression_bytes_total', {'encoding': encoding, 'stage': 'in'}, size_in)
+    metrics.inc('hive_compression_bytes_total', {'encoding': encoding, 'stage': 'out'}, size_out)
+
+
+class _CachedResponse:
+    __slots__ = ('body', 'mimetype', 'encoding', 'expires_at')
+
+    def __init__(self, body, mimetype, encoding, expires_at):
+        self.body = body
+        self.mimetype = mimetype
+        self.encoding = encoding
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """Size-bounded LRU map of (URL, encoding) -> response body, cleared by every committed write"""
+
+    def __init__(self, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        # Bumped on every invalidation; a response is only stored if no write committed while it was built
+        self.generation = 0
+        self.invalidated_at = float('-inf')
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def enabled(self):
+        return self.ttl_seconds > 0 and self.max_bytes > 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= now:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, generation, body, mimetype, encoding):
+        # One entry may take at most a quarter of the cache
+        if len(body) > self.max_bytes // 4:
+            return False
+        with self._lock:
+            if generation != self.generation:
+                return False
+            self._drop(key)
+            self._entries[key] = _CachedResponse(body, mimetype, encoding, time.monotonic() + self.ttl_seconds)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+            return True
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry.body)
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self.invalidated_at = time.monotonic()
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+cache = ResponseCache()
+
+
+def cached(method):
+    """Decorate a Resource.get whose response depends only on its URL and the database"""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        # Clients reading their own writes from the primary must not get a replica's cached answer
+        if not cache.enabled() or routing.pinned_to_primary():
+            metrics.inc('hive_response_cache_total', {'result': 'bypass'})
+            return method(*args, **kwargs)
+
+        key = (request.full_path, negotiate())
+        entry = cache.get(key)
+        if entry is not None:
+            metrics.inc('hive_response_cache_total', {'result': 'hit'})
+            response = Response(entry.body, mimetype=entry.mimetype)
+            response.vary.add('Accept-Encoding')
+            if entry.encoding != 'identity':
+                response.headers['Content-Encoding'] = entry.encoding
+            return response
+
+        metrics.inc('hive_response_cache_total', {'result': 'miss'})
+        # Right after a write a replica may not have it yet, and what it returns would be kept for the
+        # whole TTL; wait out the read-your-writes window before storing replica reads again
+        if not (routing.reading_replica()
+                and time.monotonic() - cache.invalidated_at < routing.READ_YOUR_WRITES_SECONDS):
+            g.hive_response_cache = (key, cache.generation)
+        return method(*args, **kwargs)
+
+    return wrapper
+
+
+def _store(slot, body, mimetype, encoding):
+    # Stored under the negotiated encoding even when the body was too small to compress
+    key, generation = slot
+    if cache.put(key, generation, body, mimetype, encoding):
+        metrics.inc('hive_response_cache_total', {'result': 'store'})
+
+
+def _compress_stream(response, encoding, slot):
+    """Compress a streamed body as it is sent; keep it for the cache if it stays small enough"""
+    chunks = response.iter_encoded()
+    mimetype = response.mimetype
+    limit = cache.max_bytes // 4
+
+    def generate():
+        compressor = COMPRESSORS[encoding]()
+        kept = [] if slot is not None else None
+        kept_size = size_in = size_out = 0
+        seconds = 0.0
+        finished = False
+        try:
+            for chunk in chunks:
+                started = time.perf_counter()
+                compressed = compressor.compress(chunk)
+                seconds += time.perf_counter() - started
+                size_in += len(chunk)
+                if compressed:
+                    size_out += len(compressed)
+                    if kept is not None:
+                        kept.append(compressed)
+                        kept_size += len(compressed)
+                        if kept_size > limit:
+                            kept = None
+                    yield compressed
+            started = time.perf_counter()
+            compressed = compressor.flush()
+            seconds += time.perf_counter() - started
+            size_out += len(compressed)
+            if kept is not None:
+                kept.append(compressed)
+            finished = True
+            yield compressed
+        finally:
+            _record(encoding, seconds, size_in, size_out)
+            if finished and kept is not None:
+                _store(slot, b''.join(kept), mimetype, encoding)
+
+    response.response = generate()
+    response.headers.pop('Content-Length', None)
+
+
+def _after_request(response):
+    slot = g.pop('hive_response_cache', None)
+    if slot is not None and (response.status_code != 200 or 'Set-Cookie' in response.headers):
+        slot = None
+
+    if (request.method == 'HEAD'
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers
+            or not 200 <= response.status_code < 300 or response.status_code == 204
+            or 'no-transform' in response.headers.get('Cache-Control', '')):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate()
+
+    if response.is_streamed:
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+            _compress_stream(response, encoding, slot)
+        return response
+
+    body = response.get_data()
+    if encoding != 'identity' and len(body) >= COMPRESSION_MIN_BYTES:
+        body = compress(encoding, body)
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        etag = response.headers.get('ETag')
+        if etag is not None and not etag.startswith('W/'):
+            # The compressed bytes are a different representation of the same version
+            response.headers['ETag'] = 'W/' + etag
+    else:
+        encoding = 'identity'
+    if slot is not None:
+        _store(slot, body, response.mimetype, encoding)
+    return response
+
+
+# The cache is cleared when a transaction that wrote commits. Clearing again when
+# the connection goes back to the pool (after the commit has landed) covers a read
+# that started between the two and could still see the old data.
+#
+# COPY in dialects.copy_rows() never reaches after_cursor_execute, so it marks the
+# connection itself. A WITH statement counts as a write when a write verb appears
+# anywhere in it (a data-modifying CTE, or WITH ... UPDATE).
+_COMMITTED = 'hive_response_cache_committed'
+_WRITE_VERBS = ('INSERT', 'UPDATE', 'DELETE', 'REPLAC')
+_WRITE_KEYWORD = re.compile(r'\b(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+
+def _is_write(statement):
+    head = statement.lstrip()[:6].upper()
+    if head in _WRITE_VERBS:
+        return True
+    return head[:4] == 'WITH' and _WRITE_KEYWORD.search(statement) is not None
+
+
+def _after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if _is_write(statement):
+        dialects.mark_written(connection)
+
+
+def _commit(connection):
+    if connection.info.pop(dialects.WROTE, False):
+        cache.invalidate()
+        connection.info[_COMMITTED] = True
+
+
+def _rollback(connection):
+    connection.info.pop(dialects.WROTE, None)
+
+
+def _checkin(dbapi_connection, connection_record):
+    if connection_record.info.pop(_COMMITTED, False):
+        cache.invalidate()
+
+
+def watch_engine(engine):
+    """Clear the response cache whenever a write through engine commits"""
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'commit', _commit)
+    event.listen(engine, 'rollback', _rollback)
+    event.listen(engine.pool, 'checkin', _checkin)
+
+
+def init_app(app):
+    """Compress responses and fill the response cache"""
+    app.after_request(_after_request)
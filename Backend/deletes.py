@@ -0,0 +1,192 @@
+"""
+Set-based deletes for projects and organizations.
+
+Deleting through the ORM loads every shot and shot request of an event into
+memory and deletes them one statement at a time. These helpers delete with
+bulk DELETE ... WHERE id IN (...) statements instead, DELETE_BATCH_SIZE rows at
+a time, and keep the dashboard counters right by applying the matching stats
+deltas for each batch. Single events and shots are soft-deleted instead (see
+soft_delete.py); rows that are already soft-deleted are purged here without
+touching the counters again.
+
+Each delete is a generator of steps; after every step the rows deleted so far
+are consistent (children go before their event, counters match the rows that
+are left). delete_now() runs all steps in the caller's transaction, while
+enqueue_delete() queues a background job (see jobs.py) that commits after
+every step and reports progress, so a huge tree never holds one long write
+transaction.
+"""
+
+import os
+from sqlalchemy import delete, func, select, update
+from models import Event, Organization, Project, Shot, Shot_Request, StatsCounter, User, event_personnel, event_users, project_key_personnel
+import jobs
+import outbox
+import scheduler
+import stats
+
+DELETE_BATCH_SIZE = int(os.environ.get('HIVE_DELETE_BATCH_SIZE', '5000'))
+
+
+def _event_scopes(event_id, project_id, organization_id):
+    return [('event', event_id), ('project', project_id), ('organization', organization_id)]
+
+
+def _counted_criteria(model):
+    """Soft-deleted rows already left the counters (see soft_delete.py)"""
+    criteria = [Event.deleted_at.is_(None)]
+    if model is Shot:
+        criteria.append(Shot.deleted_at.is_(None))
+    return criteria
+
+
+def _delete_children(session, model, event_ids, batch_size):
+    """Delete the shots or shot requests of the selected events, one batch per step"""
+    group_columns = [model.event_id] + ([model.process_point] if model is Shot_Request else [])
+    while True:
+        # The background runner commits between steps, which releases the connection
+        connection = session.connection()
+        ids = connection.execute(
+            select(model.id).where(model.event_id.in_(event_ids)).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return
+
+        counts = connection.execute(
+            select(*group_columns, Event.project_id, Event.organization_id, func.count(model.id))
+            .join(Event, Event.id == model.event_id)
+            .where(model.id.in_(ids), *_counted_criteria(model))
+            .group_by(*group_columns, Event.project_id, Event.organization_id)
+        ).all()
+        if model is Shot:
+            stats.remove_shots(session, counts)
+        else:
+            stats.remove_shot_requests(session, [
+                (event_id, project_id, organization_id, process_point, count)
+                for event_id, process_point, project_id, organization_id, count in counts
+            ])
+
+        connection.execute(delete(model).where(model.id.in_(ids)))
+        if model is Shot_Request:
+            scheduler.touch(session, shot_request_ids=ids)
+            outbox.record(session, 'shot_requests', ids)
+        yield len(ids)
+
+
+def _delete_event_rows(session, event_ids, batch_size):
+    """Delete the selected events (whose children are already gone), one batch per step"""
+    while True:
+        connection = session.connection()
+        rows = connection.execute(
+            select(Event.id, Event.project_id, Event.organization_id, Event.is_covered, Event.process_point,
+                   Event.deleted_at)
+            .where(Event.id.in_(event_ids)).limit(batch_size)
+        ).all()
+        if not rows:
+            return
+
+        ids = [row.id for row in rows]
+        # Soft-deleted events already left the counters
+        stats.remove_events(session, [
+            (row.id, row.project_id, row.organization_id, row.is_covered, row.process_point)
+            for row in rows if row.deleted_at is None
+        ])
+
+        connection.execute(delete(event_personnel).where(event_personnel.c.event_id.in_(ids)))
+        connection.execute(delete(event_users).where(event_users.c.event_id.in_(ids)))
+        connection.execute(delete(Event).where(Event.id.in_(ids)))
+        outbox.record(session, 'events', ids)
+        yield len(ids)
+
+
+def _event_tree_steps(session, event_ids, batch_size):
+    """event_ids is a SELECT of event ids; it is re-evaluated every batch"""
+    yield from _delete_children(session, Shot, event_ids, batch_size)
+    yield from _delete_children(session, Shot_Request, event_ids, batch_size)
+    yield from _delete_event_rows(session, event_ids, batch_size)
+
+
+def _event_tree_size(session, event_ids):
+    # On the connection, so soft-deleted rows are counted too
+    connection = session.connection()
+    return sum(connection.execute(select(func.count()).where(criteria)).scalar() for criteria in (
+        Shot.event_id.in_(event_ids),
+        Shot_Request.event_id.in_(event_ids),
+        Event.id.in_(event_ids)
+    ))
+
+
+def project_steps(session, project_id, batch_size=DELETE_BATCH_SIZE):
+    """Delete a project. Its events are kept and detached from it, as before."""
+    connection = session.connection()
+    connection.execute(delete(project_key_personnel).where(project_key_personnel.c.project_id == project_id))
+    outbox.record_select(session, 'events', select(Event.id).where(Event.project_id == project_id))
+    connection.execute(update(Event).where(Event.project_id == project_id).values(project_id=None, version=Event.version + 1))
+    connection.execute(delete(Project).where(Project.id == project_id))
+    outbox.record(session, 'projects', [project_id])
+    stats.clear_scopes(connection, [('project', project_id)])
+    yield 1
+
+
+def organization_steps(session, organization_id, batch_size=DELETE_BATCH_SIZE):
+    """Delete an organization together with its events and everything under them"""
+    yield from _event_tree_steps(
+        session, select(Event.id).where(Event.organization_id == organization_id), batch_size
+    )
+    connection = session.connection()
+    connection.execute(delete(Organization).where(Organization.id == organization_id))
+    stats.clear_scopes(connection, [('organization', organization_id)])
+    yield 1
+
+
+def organization_delete_blocker(session, organization_id):
+    """Why an organization can't be deleted, or None"""
+    if session.query(Project.id).filter_by(organization_id=organization_id).first() is not None:
+        return 'Cannot delete organization with existing projects'
+    if session.query(User.id).filter_by(organization_id=organization_id).first() is not None:
+        return 'Cannot delete organization with existing users'
+    return None
+
+
+STEPS = {
+    'project': project_steps,
+    'organization': organization_steps,
+}
+
+TREE_SIZES = {
+    'project': lambda session, target_id: 1,
+    'organization': lambda session, target_id: _event_tree_size(
+        session, select(Event.id).where(Event.organization_id == target_id)) + 1,
+}
+
+
+def delete_now(session, kind, target_id):
+    """Run a delete inside the session's transaction; the caller commits"""
+    for _ in STEPS[kind](session, target_id):
+        pass
+
+
+def enqueue_delete(session, kind, target_id):
+    """Queue a background job that deletes in committed batches and reports rows deleted; the caller commits"""
+    return jobs.queue.enqueue(session, f'delete-{kind}', {'type': kind, 'id': str(target_id)})
+
+
+def _run_delete(session_factory, job):
+    kind, target_id = job.target['type'], int(job.target['id'])
+    session = session_factory()
+    try:
+        job.report(0, TREE_SIZES[kind](session, target_id))
+        done = 0
+        for count in STEPS[kind](session, target_id):
+            session.commit()
+            done += count
+            job.report(done)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+for _kind in STEPS:
+    jobs.queue.handler(f'delete-{_kind}')(_run_delete)
@@ -0,0 +1,310 @@
+"""
+Shot metadata from EXIF.
+
+    # Read every shot image that hasn't been read yet, on 8 processes
+    python exif.py --processes 8
+
+Each shot stores its capture time, camera body serial, lens and pixel
+dimensions in typed columns. A client that already knows them (most upload
+tools read EXIF before sending) passes them to POST /shots. Otherwise, if the
+image is a file under HIVE_MEDIA_ROOT, creating the shot queues a
+'shot-metadata' job (see jobs.py) and a job worker reads the file. The
+request doesn't wait for the file to be read.
+
+The reader is plain Python and only reads the file's header: JPEG (the Exif
+APP1 segment and the frame header) and TIFF-based raw formats (CR2, NEF, ARW,
+DNG and TIFF itself). Other formats, and files without EXIF, leave the columns
+empty. Values a client gave are never overwritten.
+
+EXIF records the camera's local wall-clock time with no time zone, and
+captured_at is stored the same way; an offset on a time given to the API is
+ignored. metadata_read_at is set once a file has been read, found or not, so
+the backfill CLI (which runs the reader in a process pool) only reads each
+file once.
+"""
+
+import argparse
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from sqlalchemy import select, update
+from compaction import media_path
+from models import Shot
+import jobs
+
+# The header of a file is all the reader looks at
+MAX_HEADER_BYTES = 1024 * 1024
+
+BACKFILL_BATCH_SIZE = 500
+
+# Shot columns filled from EXIF; also the JSON keys POST /shots accepts
+FIELDS = ('captured_at', 'camera_serial', 'lens', 'width', 'height')
+
+# TIFF field types -> (struct format, size)
+TIFF_TYPES = {
+    1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('L', 4), 5: ('LL', 8),
+    7: ('B', 1), 9: ('l', 4), 10: ('ll', 8),
+}
+
+TAG_IMAGE_WIDTH = 0x0100
+TAG_IMAGE_LENGTH = 0x0101
+TAG_DATE_TIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATE_TIME_ORIGINAL = 0x9003
+TAG_SUBSEC_TIME_ORIGINAL = 0x9291
+TAG_PIXEL_X_DIMENSION = 0xA002
+TAG_PIXEL_Y_DIMENSION = 0xA003
+TAG_BODY_SERIAL_NUMBER = 0xA431
+TAG_LENS_MODEL = 0xA434
+TAG_CAMERA_SERIAL_NUMBER = 0xC62F  # DNG
+
+# JPEG start-of-frame markers (the ones that aren't DHT, JPG or DAC)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class ExifError(Exception):
+    """Raised for a captured_at the API can't parse"""
+
+
+def parse_captured_at(value):
+    """An ISO 8601 date-time as a naive local time; None passes through"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    try:
+        return datetime.fromisoformat(str(value).strip()).replace(tzinfo=None)
+    except ValueError:
+        raise ExifError(f'Invalid date-time: {value}')
+
+
+def _exif_datetime(value, subseconds=None):
+    # 'YYYY:MM:DD HH:MM:SS'; unset clocks write zeros or blanks, and corrupt files can store another type
+    if not isinstance(value, str):
+        return None
+    try:
+        captured_at = datetime.strptime(value.strip(), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    if isinstance(subseconds, str) and subseconds.strip().isdigit():
+        digits = subseconds.strip()[:6]
+        captured_at = captured_at.replace(microsecond=int(digits.ljust(6, '0')))
+    return captured_at
+
+
+def _read_ifd(data, offset, endian):
+    """{tag: value} of the IFD at offset, for the ASCII and integer tags"""
+    tags = {}
+    if offset + 2 > len(data):
+        return tags
+    (count,) = struct.unpack_from(endian + 'H', data, offset)
+    for position in range(offset + 2, offset + 2 + 12 * count, 12):
+        if position + 12 > len(data):
+            break
+        tag, kind, length, value_offset = struct.unpack_from(endian + 'HHL4s', data, position)
+        if kind not in TIFF_TYPES:
+            continue
+        fmt, size = TIFF_TYPES[kind]
+        total = size * length
+        if total <= 4:
+            raw = value_offset[:total]
+        else:
+            (start,) = struct.unpack(endian + 'L', value_offset)
+            if start + total > len(data):
+                continue
+            raw = data[start:start + total]
+        if kind == 2:
+            tags[tag] = raw.split(b'\0', 1)[0].decode('utf-8', 'replace').strip()
+        elif kind in (3, 4, 9) and length >= 1:
+            tags[tag] = struct.unpack_from(endian + fmt, raw)[0]
+    return tags
+
+
+# A tag is read with whatever type the file declares; only the expected one is used
+def _text(value):
+    return value if isinstance(value, str) and value else None
+
+
+def _number(value):
+    return value if isinstance(value, int) and value else None
+
+
+def _parse_tiff(data):
+    """Metadata from a TIFF structure (the payload of a JPEG's Exif segment, or a raw file)"""
+    if data[:2] == b'II':
+        endian = '<'
+    elif data[:2] == b'MM':
+        endian = '>'
+    else:
+        return {}
+    magic, ifd0_offset = struct.unpack_from(endian + 'HL', data, 2)
+    if magic != 42:
+        return {}
+
+    ifd0 = _read_ifd(data, ifd0_offset, endian)
+    exif = {}
+    if _number(ifd0.get(TAG_EXIF_IFD)):
+        exif = _read_ifd(data, ifd0[TAG_EXIF_IFD], endian)
+
+    captured_at = None
+    if exif.get(TAG_DATE_TIME_ORIGINAL):
+        captured_at = _exif_datetime(exif[TAG_DATE_TIME_ORIGINAL], exif.get(TAG_SUBSEC_TIME_ORIGINAL))
+    if captured_at is None and ifd0.get(TAG_DATE_TIME):
+        captured_at = _exif_datetime(ifd0[TAG_DATE_TIME])
+
+    return {
+        'captured_at': captured_at,
+        'camera_serial': _text(exif.get(TAG_BODY_SERIAL_NUMBER)) or _text(ifd0.get(TAG_CAMERA_SERIAL_NUMBER)),
+        'lens': _text(exif.get(TAG_LENS_MODEL)),
+        'width': _number(exif.get(TAG_PIXEL_X_DIMENSION)) or _number(ifd0.get(TAG_IMAGE_WIDTH)),
+        'height': _number(exif.get(TAG_PIXEL_Y_DIMENSION)) or _number(ifd0.get(TAG_IMAGE_LENGTH)),
+    }
+
+
+def _parse_jpeg(data):
+    metadata, frame_size = {}, None
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            break
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte
+            position += 1
+            continue
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7:
+            position += 2
+            continue
+        if marker == 0xDA:
+            # Start of scan: the headers are over
+            break
+        (length,) = struct.unpack_from('>H', data, position + 2)
+        segment = data[position + 4:position + 2 + length]
+        if marker == 0xE1 and segment.startswith(b'Exif\0\0') and not metadata:
+            metadata = _parse_tiff(segment[6:])
+        elif marker in SOF_MARKERS and frame_size is None and len(segment) >= 5:
+            height, width = struct.unpack_from('>HH', segment, 1)
+            frame_size = (width, height)
+        position += 2 + length
+
+    if frame_size is not None:
+        # The frame header is the actual image; EXIF dimensions can be stale after an edit
+        metadata['width'], metadata['height'] = frame_size
+    return metadata
+
+
+def read_metadata(path):
+    """{field: value} for FIELDS from an image file's header; {} if it has none or can't be read"""
+    try:
+        with open(path, 'rb') as file:
+            data = file.read(MAX_HEADER_BYTES)
+    except OSError:
+        return {}
+    try:
+        if data[:2] == b'\xff\xd8':
+            metadata = _parse_jpeg(data)
+        elif data[:2] in (b'II', b'MM'):
+            metadata = _parse_tiff(data)
+        else:
+            return {}
+    except (struct.error, ValueError, TypeError, AttributeError):
+        # Truncated or corrupt header
+        return {}
+    return {name: metadata[name] for name in FIELDS if metadata.get(name) is not None}
+
+
+def read_image(image):
+    """read_metadata() for a shot's image; None if it isn't a file under HIVE_MEDIA_ROOT"""
+    path = media_path(image)
+    return read_metadata(path) if path is not None else None
+
+
+def readable(image):
+    return media_path(image) is not None
+
+
+def apply(connection, shot_id, metadata):
+    """Fill in the shot's metadata columns that are still empty, and mark the file read"""
+    shot = connection.execute(select(*[getattr(Shot, name) for name in FIELDS]).where(Shot.id == shot_id)).first()
+    if shot is None:
+        return False
+    values = {name: value for name, value in (metadata or {}).items() if getattr(shot, name) is None}
+    connection.execute(update(Shot).where(Shot.id == shot_id).values(metadata_read_at=datetime.now(), **values))
+    return True
+
+
+@jobs.queue.handler('shot-metadata')
+def _run_read(session_factory, job):
+    shot_ids = job.target['ids']
+    job.report(0, len(shot_ids))
+    session = session_factory()
+    try:
+        images = dict(session.execute(select(Shot.id, Shot.image).where(Shot.id.in_(shot_ids))).all())
+        for done, shot_id in enumerate(shot_ids, 1):
+            if shot_id in images:
+                apply(session.connection(), shot_id, read_image(images[shot_id]))
+                session.commit()
+            job.report(done)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def enqueue_read(session, shot_ids):
+    """Queue reading the image files of shots, in the session's transaction"""
+    return jobs.queue.enqueue(session, 'shot-metadata', {'ids': list(shot_ids)}, priority=-1)
+
+
+def backfill(session_factory, processes=None, batch_size=BACKFILL_BATCH_SIZE):
+    """Read every unread shot image under HIVE_MEDIA_ROOT on a process pool; returns the number read"""
+    total = 0
+    last_id = 0
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        while True:
+            session = session_factory()
+            try:
+                rows = session.execute(
+                    select(Shot.id, Shot.image)
+                    .where(Shot.id > last_id, Shot.metadata_read_at.is_(None), Shot.deleted_at.is_(None))
+                    .order_by(Shot.id).limit(batch_size)
+                ).all()
+                if not rows:
+                    return total
+                last_id = rows[-1].id
+                rows = [row for row in rows if readable(row.image)]
+                if not rows:
+                    continue
+                results = pool.map(read_image, [row.image for row in rows], chunksize=max(1, len(rows) // 32))
+                for row, metadata in zip(rows, results):
+                    apply(session.connection(), row.id, metadata)
+                session.commit()
+                total += len(rows)
+                print(f'{total} images read', file=sys.stderr)
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+
+
+def main():
+    from models import database_url
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    parser = argparse.ArgumentParser(description='Read EXIF metadata for shots that have not been read yet')
+    parser.add_argument('--processes', type=int, default=None, help='reader processes (default: one per CPU)')
+    parser.add_argument('--batch-size', type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument('--database-url', default=database_url)
+    args = parser.parse_args()
+
+    session_factory = sessionmaker(bind=create_engine(args.database_url))
+    total = backfill(session_factory, args.processes, args.batch_size)
+    print(f'Read {total} shot images', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Idempotency-Key support for create endpoints.
+
+Clients on flaky venue networks retry POSTs whose response they never saw.
+When a request carries an Idempotency-Key header, the first response for that
+key is remembered for HIVE_IDEMPOTENCY_TTL_SECONDS. A retry with the same key,
+method, path and body gets that response back (with Idempotent-Replayed: true)
+and the handler doesn't run again. Reusing a key for a different body is a 422.
+A retry that arrives while the first request is still running is a 409.
+
+Server errors (5xx) are not remembered, so a failed request can be retried
+under the same key. Keys live in memory, at most HIVE_IDEMPOTENCY_MAX_KEYS of
+them, so they don't survive a restart.
+"""
+
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import request
+
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get('HIVE_IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('HIVE_IDEMPOTENCY_MAX_KEYS', '10000'))
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+_PENDING = object()
+
+
+class _Entry:
+    __slots__ = ('fingerprint', 'response', 'expires_at')
+
+    def __init__(self, fingerprint, expires_at):
+        self.fingerprint = fingerprint
+        self.response = _PENDING
+        self.expires_at = expires_at
+
+
+class IdempotencyStore:
+    """TTL-bounded map of (key, method, path) -> response; the oldest keys go first when full"""
+
+    def __init__(self, ttl_seconds=IDEMPOTENCY_TTL_SECONDS, max_keys=IDEMPOTENCY_MAX_KEYS):
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now and len(self._entries) <= self.max_keys:
+                break
+            del self._entries[key]
+
+    def begin(self, key, fingerprint):
+        """Claim a key. Returns None when the caller should run the request, else the existing entry."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry
+            self._entries[key] = _Entry(fingerprint, now + self.ttl_seconds)
+            self._expire(now)
+            return None
+
+    def finish(self, key, response):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.response = response
+
+    def release(self, key):
+        """Forget a key so the request can be retried"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+store = IdempotencyStore()
+
+
+def _normalize(result):
+    """Flask-RESTful return values as (body, status, headers)"""
+    if not isinstance(result, tuple):
+        return result, 200, {}
+    if len(result) == 2:
+        body, status = result
+        return body, status, {}
+    body, status, headers = result
+    return body, status, dict(headers or {})
+
+
+def idempotent(method):
+    """Decorate a Resource.post so it honours the Idempotency-Key header"""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return method(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return {'error': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'}, 400
+
+        scoped_key = (key, request.method, request.path)
+        fingerprint = hashlib.sha256(
+            request.query_string + b'\0' + request.get_data(cache=True)
+        ).hexdigest()
+
+        entry = store.begin(scoped_key, fingerprint)
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                return {'error': f'{HEADER} was already used for a different request'}, 422
+            if entry.response is _PENDING:
+                return {'error': f'A request with this {HEADER} is still in progress'}, 409, {'Retry-After': '1'}
+            body, status, headers = entry.response
+            return body, status, {**headers, 'Idempotent-Replayed': 'true'}
+
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            store.release(scoped_key)
+            raise
+        body, status, headers = _normalize(result)
+        if not isinstance(body, (dict, list)) or status >= 500:
+            # Streamed/raw responses can't be replayed, and server errors should be retryable
+            store.release(scoped_key)
+        else:
+            store.finish(scoped_key, (body, status, headers))
+        return result
+
+    return wrapper
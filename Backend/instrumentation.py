@@ -0,0 +1,263 @@
+"""
+Opt-in request instrumentation for the Hive API.
+
+Enable with HIVE_METRICS=1. Every request then records its latency, the number
+of SQL statements it issued, the time spent in the database and the number of
+ORM rows it loaded. Totals and latency histograms per route are served in
+Prometheus text format at /metrics, and each response carries a
+Server-Timing header. A streamed response is accounted for when its body is
+finished, and has no Server-Timing header, since its headers go out first.
+
+Sampled profiling: with HIVE_PROFILE_SAMPLE_RATE > 0 a fraction of requests
+run under cProfile, and any sampled request slower than
+HIVE_PROFILE_THRESHOLD_MS has its profile written to HIVE_PROFILE_DIR.
+"""
+
+import cProfile
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+
+METRICS_ENABLED = os.environ.get('HIVE_METRICS', '').lower() in ('1', 'true', 'yes')
+PROFILE_SAMPLE_RATE = float(os.environ.get('HIVE_PROFILE_SAMPLE_RATE', '0'))
+PROFILE_THRESHOLD_MS = float(os.environ.get('HIVE_PROFILE_THRESHOLD_MS', '500'))
+PROFILE_DIR = os.environ.get('HIVE_PROFILE_DIR', os.path.join(os.path.dirname(__file__), 'profiles'))
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms rendered in Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._types = {}
+        self._counters = {}
+        self._histograms = {}
+        self._buckets = {}
+
+    def counter(self, name, help_text):
+        self._help[name] = help_text
+        self._types[name] = 'counter'
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._help[name] = help_text
+        self._types[name] = 'histogram'
+        self._buckets[name] = buckets
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        buckets = self._buckets[name]
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+                          for key, value in self._histograms.items()}
+
+        lines = []
+        for name in sorted(self._types):
+            lines.append(f'# HELP {name} {self._help[name]}')
+            lines.append(f'# TYPE {name} {self._types[name]}')
+            if self._types[name] == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            else:
+                for (metric, labels), histogram in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(self._buckets[name], histogram['buckets']):
+                        lines.append(f'{name}_bucket{_format_labels(labels + (("le", _format_value(bound)),))} {count}')
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {histogram["count"]}')
+                    lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(histogram["sum"])}')
+                    lines.append(f'{name}_count{_format_labels(labels)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+metrics = MetricsRegistry()
+metrics.counter('hive_http_requests_total', 'HTTP requests by route, method and status')
+metrics.histogram('hive_http_request_duration_seconds', 'HTTP request latency by route and method')
+metrics.counter('hive_db_statements_total', 'SQL statements executed by route')
+metrics.histogram('hive_db_statements_per_request', 'SQL statements executed per request by route',
+                  buckets=(1, 2, 5, 10, 25, 50, 100, 250, 1000))
+metrics.counter('hive_db_time_seconds_total', 'Time spent executing SQL by route')
+metrics.counter('hive_db_rows_loaded_total', 'ORM rows loaded by route')
+metrics.counter('hive_profiles_written_total', 'cProfile dumps written for slow sampled requests')
+
+
+def metrics_enabled():
+    return METRICS_ENABLED
+
+
+def _route_label():
+    # The URL rule keeps the label set bounded (/events/<int:event_id>, not /events/42)
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _current_stats():
+    if has_request_context():
+        return g.get('hive_request_stats')
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('hive_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['hive_query_start'].pop()
+    request_stats = _current_stats()
+    if request_stats is not None:
+        request_stats['statements'] += 1
+        request_stats['db_time'] += time.perf_counter() - started
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute never runs for a failed statement
+    if exception_context.connection is not None:
+        starts = exception_context.connection.info.get('hive_query_start')
+        if starts:
+            starts.pop()
+
+
+def _loaded_as_persistent(session, instance):
+    request_stats = _current_stats()
+    if request_stats is not None:
+        request_stats['rows'] += 1
+
+
+def _before_request():
+    g.hive_request_stats = {'start': time.perf_counter(), 'statements': 0, 'db_time': 0.0, 'rows': 0}
+
+    g.hive_profiler = None
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active on this interpreter
+            return
+        g.hive_profiler = profiler
+
+
+def _after_request(response):
+    request_stats = g.get('hive_request_stats')
+    if request_stats is None:
+        return response
+
+    route = _route_label()
+    labels = {'route': route, 'method': request.method}
+    profiler = g.pop('hive_profiler', None)
+
+    if response.is_streamed:
+        # The body (and its queries) is generated after this hook returns, so the
+        # request is only accounted for once it is closed. Its headers are sent
+        # before then, so a streamed response has no Server-Timing header.
+        response.call_on_close(lambda: _finish(request_stats, labels, response.status_code, profiler))
+        return response
+
+    elapsed = _finish(request_stats, labels, response.status_code, profiler)
+    response.headers.add(
+        'Server-Timing',
+        f'db;dur={request_stats["db_time"] * 1000:.2f};desc="{request_stats["statements"]} queries, '
+        f'{request_stats["rows"]} rows", app;dur={elapsed * 1000:.2f}'
+    )
+    return response
+
+
+def _finish(request_stats, labels, status_code, profiler):
+    """Record a finished request's metrics and stop its profiler; returns its latency"""
+    elapsed = time.perf_counter() - request_stats['start']
+
+    metrics.inc('hive_http_requests_total', {**labels, 'status': str(status_code)})
+    metrics.observe('hive_http_request_duration_seconds', elapsed, labels)
+    metrics.inc('hive_db_statements_total', labels, request_stats['statements'])
+    metrics.observe('hive_db_statements_per_request', request_stats['statements'], labels)
+    metrics.inc('hive_db_time_seconds_total', labels, request_stats['db_time'])
+    metrics.inc('hive_db_rows_loaded_total', labels, request_stats['rows'])
+
+    if profiler is not None:
+        profiler.disable()
+        if elapsed * 1000 >= PROFILE_THRESHOLD_MS:
+            _dump_profile(profiler, labels['route'], labels['method'], elapsed)
+    return elapsed
+
+
+def _dump_profile(profiler, route, method, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = ''.join(c if c.isalnum() else '_' for c in route).strip('_') or 'root'
+    timestamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    path = os.path.join(PROFILE_DIR, f'{timestamp}-{method}-{slug}-{elapsed * 1000:.0f}ms.prof')
+    profiler.dump_stats(path)
+    metrics.inc('hive_profiles_written_total', {'route': route})
+
+
+def _teardown_request(exc):
+    # A request that raised skips after_request, so make sure its profiler stops
+    profiler = g.pop('hive_profiler', None)
+    if profiler is not None:
+        profiler.disable()
+
+
+def metrics_view():
+    """Serve the collected metrics in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def watch_engine(engine):
+    """Count the statements and database time of an engine's queries"""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+def init_app(app):
+    """Attach request hooks and the /metrics route; engines are watched separately (watch_engine)"""
+    event.listen(OrmSession, 'loaded_as_persistent', _loaded_as_persistent)
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,306 @@
+"""
+Durable background jobs.
+
+    # Run queued jobs on 4 threads in each of 2 processes
+    python jobs.py --threads 4 --processes 2
+
+    # Run everything that is queued now, then exit
+    python jobs.py --once
+
+Heavy work (such as deleting a very large event tree) is queued as a row in the
+jobs table, usually in the same transaction as the request that asks for it,
+and the request returns 202 straight away. Clients poll GET /jobs/<id> for the
+status and progress. Jobs survive restarts because they live in the database.
+No outside services are needed.
+
+A worker claims a job with a single UPDATE ... RETURNING. On PostgreSQL the row
+is picked by a SELECT ... FOR UPDATE SKIP LOCKED subquery, so concurrent
+workers never wait on each other. SQLite serializes writers, so the UPDATE is
+atomic there anyway. Jobs run highest priority first, then oldest first. A job
+that raises is retried after an exponential backoff (capped at
+HIVE_JOB_MAX_BACKOFF_SECONDS) until it has failed max_attempts times.
+
+Progress reports also renew the job's lease. A job whose worker has died stops
+reporting, and once its lease is HIVE_JOB_LEASE_SECONDS old another worker
+takes it over. Handlers must therefore be safe to run again, for example by
+committing their work in chunks, as the deletes do.
+
+The API process runs HIVE_JOB_WORKERS worker threads itself. Set it to 0 to
+leave the jobs to `python jobs.py`. Finished jobs are deleted after
+HIVE_JOB_RETENTION_HOURS.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import and_, delete, func, or_, select, update
+from models import Job
+
+logger = logging.getLogger('hive.jobs')
+
+JOB_WORKERS = int(os.environ.get('HIVE_JOB_WORKERS', '1'))
+JOB_POLL_SECONDS = float(os.environ.get('HIVE_JOB_POLL_SECONDS', '1'))
+JOB_LEASE_SECONDS = float(os.environ.get('HIVE_JOB_LEASE_SECONDS', '300'))
+JOB_MAX_BACKOFF_SECONDS = float(os.environ.get('HIVE_JOB_MAX_BACKOFF_SECONDS', '300'))
+JOB_RETENTION_HOURS = float(os.environ.get('HIVE_JOB_RETENTION_HOURS', '168'))
+
+DEFAULT_MAX_ATTEMPTS = 3
+BASE_BACKOFF_SECONDS = 5
+
+# How often an idle worker deletes expired finished jobs
+PURGE_INTERVAL_SECONDS = 600
+
+# Handler modules a standalone worker imports, so their queue.handler() registrations exist
+HANDLER_MODULES = ('checksums', 'deletes', 'exif')
+
+
+def backoff_seconds(attempts):
+    """Exponential backoff with jitter: ~5s, 10s, 20s, ... capped at JOB_MAX_BACKOFF_SECONDS"""
+    delay = min(JOB_MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def to_dict(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'target': job.target,
+        'status': job.status,
+        'priority': job.priority,
+        'attempts': job.attempts,
+        'progress': {
+            'done': job.done,
+            'total': job.total,
+            'percent': round(100 * job.done / job.total, 1) if job.total else None
+        },
+        'error': job.error,
+        'createdAt': job.created_at.isoformat(),
+        'startedAt': job.started_at.isoformat() if job.started_at else None,
+        'finishedAt': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+class RunningJob:
+    """What a handler gets: the claimed job's arguments and a way to report progress"""
+
+    def __init__(self, queue, session_factory, worker_id, row):
+        self.queue = queue
+        self.session_factory = session_factory
+        self.worker_id = worker_id
+        self.id = row.id
+        self.kind = row.kind
+        self.target = row.target
+        self.attempts = row.attempts
+
+    def report(self, done, total=None):
+        """Record progress (and renew the lease); called by the handler"""
+        values = {'done': done, 'locked_at': datetime.now()}
+        if total is not None:
+            values['total'] = total
+        self.queue._update(self.session_factory, self.id, self.worker_id, **values)
+
+
+class JobQueue:
+    def __init__(self):
+        self.handlers = {}
+
+    def handler(self, kind):
+        """Register fn(session_factory, job) as the handler of a job kind"""
+        def register(fn):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    def enqueue(self, session, kind, target=None, priority=0, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """Queue a job in the session's transaction; it becomes visible to workers when the caller commits"""
+        if kind not in self.handlers:
+            raise ValueError(f'No handler for job kind {kind}')
+        job = Job(id=uuid.uuid4().hex, kind=kind, target=target, status='queued', priority=priority,
+                  attempts=0, max_attempts=max_attempts, done=0, created_at=datetime.now())
+        session.add(job)
+        session.flush()
+        return job
+
+    def get(self, session, job_id):
+        return session.get(Job, job_id)
+
+    def claim(self, session_factory, worker_id):
+        """Take the most urgent runnable job, or a job whose worker's lease ran out; None if there is none"""
+        now = datetime.now()
+        runnable = or_(
+            and_(Job.status == 'queued', or_(Job.available_at.is_(None), Job.available_at <= now)),
+            and_(Job.status == 'running', Job.locked_at < now - timedelta(seconds=JOB_LEASE_SECONDS))
+        )
+        next_job = (
+            select(Job.id).where(runnable)
+            .order_by(Job.priority.desc(), Job.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        session = session_factory()
+        try:
+            row = session.connection().execute(
+                update(Job).where(Job.id == next_job, runnable)
+                .values(status='running', locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1,
+                        started_at=func.coalesce(Job.started_at, now))
+                .returning(Job.id, Job.kind, Job.target, Job.attempts, Job.max_attempts)
+            ).first()
+            session.commit()
+            return row
+        finally:
+            session.close()
+
+    def _update(self, session_factory, job_id, worker_id, **values):
+        # Only while this worker still holds the job, so a worker that lost its lease can't overwrite the new one
+        session = session_factory()
+        try:
+            session.connection().execute(
+                update(Job).where(Job.id == job_id, Job.locked_by == worker_id).values(**values)
+            )
+            session.commit()
+        finally:
+            session.close()
+
+    def run_one(self, session_factory, worker_id):
+        """Claim and run one job; returns False when there was nothing to run"""
+        row = self.claim(session_factory, worker_id)
+        if row is None:
+            return False
+
+        if row.attempts > row.max_attempts:
+            # Taken over from a dead worker after its last attempt
+            self._update(session_factory, row.id, worker_id, status='failed', finished_at=datetime.now(), locked_by=None,
+                         error='The worker running the job stopped')
+            return True
+
+        handler = self.handlers.get(row.kind)
+        try:
+            if handler is None:
+                raise ValueError(f'No handler for job kind {row.kind}')
+            handler(session_factory, RunningJob(self, session_factory, worker_id, row))
+        except Exception as e:
+            logger.exception('Job %s (%s) failed on attempt %d', row.id, row.kind, row.attempts)
+            if row.attempts < row.max_attempts and handler is not None:
+                self._update(session_factory, row.id, worker_id, status='queued', locked_by=None, error=str(e),
+                             available_at=datetime.now() + timedelta(seconds=backoff_seconds(row.attempts)))
+            else:
+                self._update(session_factory, row.id, worker_id, status='failed', locked_by=None, error=str(e),
+                             finished_at=datetime.now())
+            return True
+
+        self._update(session_factory, row.id, worker_id, status='succeeded', locked_by=None, error=None, finished_at=datetime.now())
+        return True
+
+    def purge_finished(self, session_factory):
+        """Delete finished jobs older than JOB_RETENTION_HOURS"""
+        session = session_factory()
+        try:
+            session.connection().execute(
+                delete(Job).where(Job.status.in_(('succeeded', 'failed')),
+                                  Job.finished_at < datetime.now() - timedelta(hours=JOB_RETENTION_HOURS))
+            )
+            session.commit()
+        finally:
+            session.close()
+
+
+queue = JobQueue()
+
+
+def _worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+
+
+def _worker(session_factory, stop, once=False):
+    worker_id = _worker_id()
+    last_purge = 0.0
+    while not stop.is_set():
+        try:
+            if queue.run_one(session_factory, worker_id):
+                continue
+            if once:
+                return
+            if time.monotonic() - last_purge > PURGE_INTERVAL_SECONDS:
+                queue.purge_finished(session_factory)
+                last_purge = time.monotonic()
+        except Exception:
+            logger.exception('Job worker failed')
+        stop.wait(JOB_POLL_SECONDS)
+
+
+def start_workers(session_factory, count=JOB_WORKERS, once=False):
+    """Start count job worker threads; returns (threads, stop event)"""
+    stop = threading.Event()
+    threads = []
+    for i in range(count):
+        thread = threading.Thread(target=_worker, args=(session_factory, stop, once), name=f'hive-jobs-{i}', daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads, stop
+
+
+def _serve(database_url, threads, once):
+    """One worker process: its own engine and `threads` worker threads"""
+    import importlib
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    for module in HANDLER_MODULES:
+        importlib.import_module(module)
+    workers, stop = start_workers(sessionmaker(bind=create_engine(database_url)), threads, once=once)
+    try:
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(1)
+    except KeyboardInterrupt:
+        stop.set()
+
+
+def main():
+    from models import Base, database_url, migrate_database
+    from sqlalchemy import create_engine
+
+    parser = argparse.ArgumentParser(description='Run queued Hive background jobs')
+    parser.add_argument('--threads', type=int, default=max(1, JOB_WORKERS), help='worker threads per process')
+    parser.add_argument('--processes', type=int, default=1, help='worker processes')
+    parser.add_argument('--once', action='store_true', help='exit once no job is runnable')
+    parser.add_argument('--database-url', default=database_url)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    Base.metadata.create_all(engine)
+    migrate_database(engine)
+    engine.dispose()
+
+    if args.processes <= 1:
+        _serve(args.database_url, args.threads, args.once)
+        return
+    processes = [
+        multiprocessing.Process(target=_serve, args=(args.database_url, args.threads, args.once), name=f'hive-jobs-{i}')
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+    print('Job workers stopped', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    # Run through the importable module, so handlers register on the same queue the workers use
+    import jobs
+    jobs.main()
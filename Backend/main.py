@@ -1,33 +1,105 @@
 
-from flask import Flask, request
+from flask import Flask, Response, request, stream_with_context
 from flask_restful import Api, Resource
 from flask_cors import CORS
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from models import Base, User, Event, Personnel, Shot, Project, Organization, Shot_Request
+from sqlalchemy import create_engine, func, or_, select, text, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, selectinload
+from models import Base, User, Event, Personnel, Shot, Project, Organization, Shot_Request, Role, event_personnel, project_key_personnel
+from models import create_database, seed_database, deadline_sort
+from projection import Field, Relation, FieldSet, ProjectionError
+from collections import defaultdict
 from datetime import datetime
+import gzip
+import json
+import math
 import os
+import threading
+import admission
+import checksums
+import compaction
+import compression
+import deletes
+import dialects
+import exif
+import idempotency
+import instrumentation
+import jobs
+import matching
+import org_transfer
+import outbox
+import patching
+from patching import PatchField
+import routing
+import scheduler
+import search
+import slow_queries
+import soft_delete
+import stats
+
+# The app is built by create_app(); the engine is created and the database
+# prepared by get_engine(), on the first request. Importing this module touches
+# neither, so a new instance starts listening quickly.
+database_url = os.environ.get('DATABASE_URL', 'sqlite:///hive.db')
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)
+engine = None
+_engine_lock = threading.Lock()
 
-# Database configuration
-database_url = os.environ.get('DATABASE_URL', 'sqlite:///hive.db')
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+# Safe GETs may read from a replica (see routing.py); without replicas this is a plain Session.
+# get_engine() binds it to the primary.
+Session = sessionmaker(class_=routing.RoutingSession)
+
+
+def get_engine():
+    """The primary engine, created on first use together with the database setup and background workers"""
+    global engine
+    if engine is not None:
+        return engine
+    with _engine_lock:
+        if engine is None:
+            new_engine = create_engine(database_url)
+
+            # Create database and tables if they don't exist
+            create_database(new_engine)
+
+            # Create full-text search indexes and their sync triggers
+            search.create_search_index(new_engine)
+
+            # Build dashboard counters for databases created before they existed
+            stats.backfill_stats(new_engine)
+
+            # Keep open shot requests in a deadline heap for /shot-requests/next and /shot-requests/at-risk
+            scheduler.init_scheduler(new_engine)
+
+            # Committed writes clear the response cache
+            compression.watch_engine(new_engine)
+
+            if instrumentation.metrics_enabled():
+                instrumentation.watch_engine(new_engine)
+            if slow_queries.slow_query_log_enabled():
+                slow_queries.init_engine(new_engine)
+
+            Session.configure(bind=new_engine)
+            engine = new_engine
+
+            # Purge soft-deleted rows in small batches while the API is idle
+            if compaction.compaction_enabled():
+                compaction.start_worker(Session)
 
-# Initialize SQLAlchemy engine and session
-engine = create_engine(database_url)
-Session = sessionmaker(bind=engine)
+            # Run queued background jobs (HIVE_JOB_WORKERS threads; 0 leaves them to `python jobs.py`)
+            if jobs.JOB_WORKERS > 0:
+                jobs.start_workers(Session)
 
-# Import database initialization functions
-from models import create_database, seed_database
+            # Mirror events, shot requests and projects to Firestore from the outbox (HIVE_FIRESTORE_MIRROR=1)
+            if outbox.mirror_enabled():
+                firestore = outbox.firestore_client()
+                if firestore is not None:
+                    outbox.start_worker(Session, firestore)
+    return engine
 
-# Create database and tables if they don't exist
-create_database()
 
-# Initialize Flask-RESTful
-api = Api(app)
+def _prepare_database():
+    get_engine()
 
 # Helper function to convert date strings
 def parse_date(date_string):
@@ -37,25 +109,69 @@ def parse_date(date_string):
         return datetime(year, month, day).date()
     return date_string
 
+# Helper for the list endpoints that return every row of a table
+def stream_list(session, selection, query, key=None):
+    """Stream the serialized rows as a JSON array, or as {key: [...]} when key is given.
+
+    Rows are read and serialized dialects.STREAM_BATCH_SIZE at a time (on a
+    server-side cursor on PostgreSQL), so the whole table is never in memory.
+    The session has to outlive the handler, so the generator closes it.
+    """
+    result = session.scalars(dialects.stream(query.statement))
+
+    def generate():
+        try:
+            yield f'{{"{key}": [' if key else '['
+            separator = ''
+            for partition in result.partitions():
+                items = selection.serialize_all(session, partition)
+                if items:
+                    yield separator + ', '.join(json.dumps(item) for item in items)
+                    separator = ', '
+            yield ']}\n' if key else ']\n'
+        finally:
+            session.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+# Helper for the set-based delete endpoints (see deletes.py)
+def delete_response(session, kind, target_id, message):
+    """Delete now, or with ?background=true start a job and return 202 with its location"""
+    if request.args.get('background', '').lower() in ('1', 'true', 'yes'):
+        job = deletes.enqueue_delete(session, kind, target_id)
+        session.commit()
+        return {'job': jobs.to_dict(job), 'message': f'{kind.capitalize()} deletion queued'}, 202, \
+            {'Location': f'/jobs/{job.id}'}
+
+    deletes.delete_now(session, kind, target_id)
+    session.commit()
+    return {'message': message}, 200
+
 
 
 # ==================== USER RESOURCES ====================
 
+USER_FIELDS = FieldSet(User, {
+    'id': Field([User.id], lambda user: user.id),
+    'email': Field([User.email], lambda user: user.email)
+})
+
 class UserListResource(Resource):
     def get(self):
         """Get all users"""
         session = Session()
         try:
-            users = session.query(User).all()
-            return [{
-                'id': user.id,
-                'email': user.email
-            } for user in users], 200
+            selection = USER_FIELDS.select(request.args)
+            users = selection.apply(session.query(User)).all()
+            return selection.serialize_all(session, users), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
             session.close()
 
+    @idempotency.idempotent
     def post(self):
         """Create a new user"""
         session = Session()
@@ -93,14 +209,14 @@ class UserResource(Resource):
         """Get a specific user"""
         session = Session()
         try:
-            user = session.query(User).filter_by(id=user_id).first()
+            selection = USER_FIELDS.select(request.args)
+            user = selection.apply(session.query(User)).filter_by(id=user_id).first()
             if not user:
                 return {'error': 'User not found'}, 404
             
-            return {
-                'id': user.id,
-                'email': user.email
-            }, 200
+            return selection.serialize(user), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
@@ -159,58 +275,106 @@ class UserResource(Resource):
 
 # ==================== EVENT RESOURCES ====================
 
+# Fields shared by every event representation
+EVENT_BASE_FIELDS = {
+    'id': Field([Event.id], lambda event: str(event.id)),
+    'name': Field([Event.name], lambda event: event.name),
+    'date': Field([Event.date], lambda event: str(event.date)),
+    'startTime': Field([Event.start_time], lambda event: event.start_time or ''),
+    'endTime': Field([Event.end_time], lambda event: event.end_time or ''),
+    'location': Field([Event.location], lambda event: event.location or ''),
+    'status': Field([Event.status], lambda event: event.status or 'Upcoming'),
+    'description': Field([Event.description], lambda event: event.description or ''),
+    'isQuickTurnaround': Field([Event.is_quick_turnaround], lambda event: event.is_quick_turnaround or False),
+    'standardShotPackage': Field([Event.standard_shot_package], lambda event: event.standard_shot_package),
+    'deadline': Field([Event.deadline], lambda event: event.deadline),
+    'discipline': Field([Event.discipline], lambda event: event.discipline or 'Photography'),
+    'isCovered': Field([Event.is_covered], lambda event: event.is_covered if event.is_covered is not None else True),
+    'version': Field([Event.version], lambda event: event.version)
+}
+
+EVENT_RELATIONS = {
+    'personnel': Relation(
+        'assignedPersonnelIds',
+        lambda event, _: [str(p.id) for p in event.personnel],
+        options=[selectinload(Event.personnel).load_only(Personnel.id)]
+    ),
+    'shots': Relation(
+        'shots',
+        lambda event, _: [{
+            'id': str(shot.id),
+            'eventId': str(shot.event_id),
+            'description': shot.filename,
+            'priority': 'Medium',
+            'status': 'Completed'
+        } for shot in event.shots],
+        options=[selectinload(Event.shots).load_only(Shot.id, Shot.event_id, Shot.filename)]
+    )
+}
+
+# Shape returned by GET /events
+EVENT_LIST_FIELDS = FieldSet(Event, {
+    **EVENT_BASE_FIELDS,
+    'organizationId': Field([Event.organization_id], lambda event: str(event.organization_id)),
+    'processPoint': Field([Event.process_point], lambda event: event.process_point or 'idle'),
+    'personnelActivity': Field([], lambda event: {}),  # Default empty object
+    'projectId': Field([Event.project_id], lambda event: str(event.project_id) if event.project_id else None)
+}, EVENT_RELATIONS)
+
+# Shape returned by GET /events/<id>; relations only on request
+EVENT_FIELDS = FieldSet(Event, {
+    **EVENT_BASE_FIELDS,
+    'projectId': Field([Event.project_id], lambda event: event.project_id or 'default_project'),
+    'organizationId': Field([Event.organization_id], lambda event: event.organization_id or ''),
+    'processPoint': Field([Event.process_point], lambda event: event.process_point or 'idle')
+}, EVENT_RELATIONS, default_include=[])
+
+# Shape returned by GET /projects/<id>/events
+PROJECT_EVENT_FIELDS = FieldSet(Event, {
+    **EVENT_BASE_FIELDS,
+    'projectId': Field([Event.project_id], lambda event: str(event.project_id) if event.project_id else None),
+    'organizationId': Field([Event.organization_id], lambda event: event.organization_id or ''),
+    'process_point': Field([Event.process_point], lambda event: event.process_point or 'idle'),
+    'personnelActivity': Field([], lambda event: {})
+}, EVENT_RELATIONS)
+
+# JSON keys accepted by PATCH /events/<id>
+EVENT_PATCH_FIELDS = {
+    'name': PatchField('name'),
+    'date': PatchField('date', patching.parse_date),
+    'startTime': PatchField('start_time'),
+    'endTime': PatchField('end_time'),
+    'location': PatchField('location'),
+    'status': PatchField('status'),
+    'description': PatchField('description'),
+    'projectId': PatchField('project_id'),
+    'organizationId': PatchField('organization_id'),
+    'discipline': PatchField('discipline'),
+    'standardShotPackage': PatchField('standard_shot_package'),
+    'isQuickTurnaround': PatchField('is_quick_turnaround'),
+    'isCovered': PatchField('is_covered'),
+    'deadline': PatchField('deadline'),
+    'processPoint': PatchField('process_point')
+}
+
 class EventListResource(Resource):
+    @compression.cached
     def get(self):
         """Get all events"""
         session = Session()
         try:
-            events = session.query(Event).all()
-            events_data = []
-            
-            for event in events:
-                # Get personnel for this event
-                personnel = event.personnel
-                assigned_personnel_ids = [str(p.id) for p in personnel]
-                
-                # Get shots for this event
-                shots = event.shots
-                
-                event_data = {
-                    'id': str(event.id),
-                    'name': event.name,
-                    'date': str(event.date),
-                    'startTime': event.start_time or '',
-                    'endTime': event.end_time or '',
-                    'location': event.location or '',
-                    'status': event.status or 'Upcoming',
-                    'description': event.description or '',
-                    'assignedPersonnelIds': assigned_personnel_ids,
-                    'isQuickTurnaround': event.is_quick_turnaround or False,
-                    'standardShotPackage': event.standard_shot_package,
-                    'deadline': event.deadline,
-                    'organizationId': str(event.organization_id),
-                    'discipline': event.discipline or 'Photography',
-                    'isCovered': event.is_covered if event.is_covered is not None else True,
-                    'processPoint': event.process_point or 'idle',
-                    'personnelActivity': {},  # Default empty object
-                    'projectId': str(event.project_id) if event.project_id else None,
-                    'shots': [{
-                        'id': str(shot.id),
-                        'eventId': str(shot.event_id),
-                        'description': shot.filename,
-                        'priority': 'Medium',
-                        'status': 'Completed'
-                    } for shot in shots]
-                }
-                events_data.append(event_data)
+            selection = EVENT_LIST_FIELDS.select(request.args)
             
             # Return in the format frontend expects
-            return {'events': events_data}, 200
+            return stream_list(session, selection, selection.apply(session.query(Event)), key='events')
+        except ProjectionError as e:
+            session.close()
+            return {'error': str(e)}, 400
         except Exception as e:
-            return {'error': str(e)}, 500
-        finally:
             session.close()
+            return {'error': str(e)}, 500
 
+    @idempotency.idempotent
     def post(self):
         """Create a new event"""
         session = Session()
@@ -277,32 +441,19 @@ class EventListResource(Resource):
             session.close()
 
 class EventResource(Resource):
+    @compression.cached
     def get(self, event_id):
         """Get a specific event"""
         session = Session()
         try:
-            event = session.query(Event).filter_by(id=event_id).first()
+            selection = EVENT_FIELDS.select(request.args)
+            event = selection.apply(session.query(Event)).filter_by(id=event_id).first()
             if not event:
                 return {'error': 'Event not found'}, 404
             
-            return {
-                'id': str(event.id),
-                'name': event.name,
-                'date': str(event.date),
-                'startTime': event.start_time or '',
-                'endTime': event.end_time or '',
-                'location': event.location or '',
-                'status': event.status or 'Upcoming',
-                'description': event.description or '',
-                'projectId': event.project_id or 'default_project',
-                'organizationId': event.organization_id or '',
-                'discipline': event.discipline or 'Photography',
-                'standardShotPackage': event.standard_shot_package,
-                'isQuickTurnaround': event.is_quick_turnaround or False,
-                'isCovered': event.is_covered if event.is_covered is not None else True,
-                'deadline': event.deadline,
-                'processPoint': event.process_point or 'idle'
-            }, 200
+            return selection.serialize(event), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
@@ -376,15 +527,48 @@ class EventResource(Resource):
         finally:
             session.close()
 
+    def patch(self, event_id):
+        """Update only the given fields of an event, if it is still at the expected version"""
+        session = Session()
+        try:
+            data = request.get_json(silent=True)
+            values = patching.parse_patch(data, Event, EVENT_PATCH_FIELDS)
+            version = patching.expected_version(request.headers, data)
+            
+            # Counter-relevant changes need the old values; everything else is a single UPDATE
+            old = None
+            if any(column in values for column in stats.EVENT_STATS_COLUMNS):
+                old = patching.read_old_values(session, Event, event_id, version, stats.EVENT_STATS_COLUMNS)
+            
+            event = patching.apply_patch(session, Event, event_id, version, values)
+            if old is not None:
+                stats.apply_event_change(session, event_id, old, {
+                    column: getattr(event, column) for column in stats.EVENT_STATS_COLUMNS
+                })
+            if 'is_quick_turnaround' in values:
+                scheduler.touch(session, event_ids=[event_id])
+            session.commit()
+            
+            return EVENT_FIELDS.select({}).serialize(event), 200, {'ETag': f'"{event.version}"'}
+        except patching.NotFound:
+            session.rollback()
+            return {'error': 'Event not found'}, 404
+        except patching.PATCH_ERRORS as e:
+            session.rollback()
+            return patching.error_response(e)
+        except Exception as e:
+            session.rollback()
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
     def delete(self, event_id):
         """Delete an event"""
         session = Session()
         try:
-            event = session.query(Event).filter_by(id=event_id).first()
-            if not event:
+            # Soft delete; compaction purges the event and its shots later
+            if not soft_delete.soft_delete_event(session, event_id):
                 return {'error': 'Event not found'}, 404
-            
-            session.delete(event)
             session.commit()
             
             return {'message': 'Event deleted successfully'}, 200
@@ -396,66 +580,68 @@ class EventResource(Resource):
 
 # ==================== PERSONNEL RESOURCES ====================
 
+# Shape returned by the personnel list endpoints
+PERSONNEL_LIST_FIELDS = FieldSet(Personnel, {
+    'id': Field([Personnel.id], lambda person: str(person.id)),
+    'personnelId': Field([Personnel.id], lambda person: str(person.id)),  # Frontend expects both id and personnelId
+    'name': Field([Personnel.name], lambda person: person.name),
+    'role': Field([Personnel.role], lambda person: person.role),
+    'status': Field([], lambda person: 'Available'),  # Default status
+    'avatar': Field([], lambda person: None),  # Default avatar
+    'cameraSerials': Field([], lambda person: []),  # Default empty array
+    'contact': Field([Personnel.email], lambda person: person.email),  # Use email as contact
+    'phone': Field([Personnel.phone], lambda person: person.phone),
+    'email': Field([Personnel.email], lambda person: person.email)
+})
+
+# Shape returned for a single personnel member and for event personnel
+PERSONNEL_FIELDS = FieldSet(Personnel, {
+    'id': Field([Personnel.id], lambda person: person.id),
+    'name': Field([Personnel.name], lambda person: person.name),
+    'role': Field([Personnel.role], lambda person: person.role),
+    'phone': Field([Personnel.phone], lambda person: person.phone),
+    'email': Field([Personnel.email], lambda person: person.email)
+})
+
+ROLE_FIELDS = FieldSet(Role, {
+    'id': Field([Role.id], lambda role: str(role.id)),
+    'name': Field([Role.name], lambda role: role.name),
+    'isPhotographer': Field([Role.flags], lambda role: role.is_photographer)
+})
+
 class PersonnelListResource(Resource):
+    @compression.cached
     def get(self):
         """Get all personnel"""
         session = Session()
         try:
-            personnel = session.query(Personnel).all()
-            personnel_data = []
-            
-            for person in personnel:
-                person_data = {
-                    'id': str(person.id),
-                    'personnelId': str(person.id),  # Frontend expects both id and personnelId
-                    'name': person.name,
-                    'role': person.role,
-                    'status': 'Available',  # Default status
-                    'avatar': None,  # Default avatar
-                    'cameraSerials': [],  # Default empty array
-                    'contact': person.email,  # Use email as contact
-                    'phone': person.phone,
-                    'email': person.email
-                }
-                personnel_data.append(person_data)
-            
-            return personnel_data, 200
+            selection = PERSONNEL_LIST_FIELDS.select(request.args)
+            personnel = selection.apply(session.query(Personnel)).all()
+            return selection.serialize_all(session, personnel), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
             session.close()
 
 class PhotographersResource(Resource):
+    @compression.cached
     def get(self):
         """Get all personnel with photographer roles"""
         session = Session()
         try:
-            photographers = session.query(Personnel).filter(
-                Personnel.role.ilike('%photographer%')
-            ).all()
-            photographers_data = []
-            
-            for person in photographers:
-                person_data = {
-                    'id': str(person.id),
-                    'personnelId': str(person.id),  # Frontend expects both id and personnelId
-                    'name': person.name,
-                    'role': person.role,
-                    'status': 'Available',  # Default status
-                    'avatar': None,  # Default avatar
-                    'cameraSerials': [],  # Default empty array
-                    'contact': person.email,  # Use email as contact
-                    'phone': person.phone,
-                    'email': person.email
-                }
-                photographers_data.append(person_data)
-            
-            return photographers_data, 200
+            selection = PERSONNEL_LIST_FIELDS.select(request.args)
+            photographers = selection.apply(session.query(Personnel)).filter_by(has_photographer_role=True).all()
+            return selection.serialize_all(session, photographers), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
             session.close()
 
+    @idempotency.idempotent
     def post(self):
         """Create new personnel"""
         session = Session()
@@ -467,10 +653,10 @@ class PhotographersResource(Resource):
             
             personnel = Personnel(
                 name=data['name'],
-                role=data['role'],
                 phone=data['phone'],
                 email=data['email']
             )
+            personnel.set_role(session, data['role'])
             
             session.add(personnel)
             session.commit()
@@ -489,22 +675,36 @@ class PhotographersResource(Resource):
         finally:
             session.close()
 
+class RoleListResource(Resource):
+    @compression.cached
+    def get(self):
+        """Get all normalized personnel roles"""
+        session = Session()
+        try:
+            selection = ROLE_FIELDS.select(request.args)
+            roles = selection.apply(session.query(Role)).order_by(Role.name).all()
+            return selection.serialize_all(session, roles), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
 class PersonnelResource(Resource):
+    @compression.cached
     def get(self, personnel_id):
         """Get a specific personnel member"""
         session = Session()
         try:
-            personnel = session.query(Personnel).filter_by(id=personnel_id).first()
+            selection = PERSONNEL_FIELDS.select(request.args)
+            personnel = selection.apply(session.query(Personnel)).filter_by(id=personnel_id).first()
             if not personnel:
                 return {'error': 'Personnel not found'}, 404
             
-            return {
-                'id': personnel.id,
-                'name': personnel.name,
-                'role': personnel.role,
-                'phone': personnel.phone,
-                'email': personnel.email
-            }, 200
+            return selection.serialize(personnel), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
@@ -523,7 +723,7 @@ class PersonnelResource(Resource):
             if 'name' in data:
                 personnel.name = data['name']
             if 'role' in data:
-                personnel.role = data['role']
+                personnel.set_role(session, data['role'])
             if 'phone' in data:
                 personnel.phone = data['phone']
             if 'email' in data:
@@ -565,26 +765,76 @@ class PersonnelResource(Resource):
 
 # ==================== SHOT RESOURCES ====================
 
+SHOT_FIELDS = FieldSet(Shot, {
+    'id': Field([Shot.id], lambda shot: shot.id),
+    'image': Field([Shot.image], lambda shot: shot.image),
+    'date_created': Field([Shot.date_created], lambda shot: str(shot.date_created)),
+    'camera': Field([Shot.camera], lambda shot: shot.camera),
+    'filename': Field([Shot.filename], lambda shot: shot.filename),
+    'event_id': Field([Shot.event_id], lambda shot: shot.event_id),
+    'photographer_id': Field([Shot.photographer_id], lambda shot: shot.photographer_id),
+    'captured_at': Field([Shot.captured_at], lambda shot: shot.captured_at.isoformat() if shot.captured_at else None),
+    'camera_serial': Field([Shot.camera_serial], lambda shot: shot.camera_serial),
+    'lens': Field([Shot.lens], lambda shot: shot.lens),
+    'width': Field([Shot.width], lambda shot: shot.width),
+    'height': Field([Shot.height], lambda shot: shot.height),
+    'checksum': Field([Shot.checksum], lambda shot: shot.checksum),
+    'checksum_algorithm': Field([Shot.checksum_algorithm], lambda shot: shot.checksum_algorithm),
+    'size_bytes': Field([Shot.size_bytes], lambda shot: shot.size_bytes),
+    'checksum_result': Field([Shot.checksum_result], lambda shot: shot.checksum_result),
+    'checksum_verified_at': Field([Shot.checksum_verified_at],
+                                  lambda shot: shot.checksum_verified_at.isoformat() if shot.checksum_verified_at else None)
+})
+
+def shot_metadata(data):
+    """The EXIF fields (see exif.py) a shot request body sets"""
+    metadata = {name: data[name] for name in exif.FIELDS if name in data}
+    if 'captured_at' in metadata:
+        metadata['captured_at'] = exif.parse_captured_at(metadata['captured_at'])
+    return metadata
+
+def shot_response(shot, message):
+    return {
+        'id': shot.id,
+        'image': shot.image,
+        'date_created': str(shot.date_created),
+        'camera': shot.camera,
+        'filename': shot.filename,
+        'event_id': shot.event_id,
+        'photographer_id': shot.photographer_id,
+        'captured_at': shot.captured_at.isoformat() if shot.captured_at else None,
+        'camera_serial': shot.camera_serial,
+        'lens': shot.lens,
+        'width': shot.width,
+        'height': shot.height,
+        'checksum': shot.checksum,
+        'checksum_algorithm': shot.checksum_algorithm,
+        'size_bytes': shot.size_bytes,
+        'checksum_result': shot.checksum_result,
+        'checksum_verified_at': shot.checksum_verified_at.isoformat() if shot.checksum_verified_at else None,
+        'message': message
+    }
+
+# GET /events/<id>/shots leaves out the event_id unless it is asked for
+EVENT_SHOT_FIELDS = FieldSet(Shot, SHOT_FIELDS.fields,
+                             default_fields=[name for name in SHOT_FIELDS.fields if name != 'event_id'])
+
 class ShotListResource(Resource):
+    @compression.cached
     def get(self):
         """Get all shots"""
         session = Session()
         try:
-            shots = session.query(Shot).all()
-            return [{
-                'id': shot.id,
-                'image': shot.image,
-                'date_created': str(shot.date_created),
-                'camera': shot.camera,
-                'filename': shot.filename,
-                'event_id': shot.event_id,
-                'photographer_id': shot.photographer_id
-            } for shot in shots], 200
+            selection = SHOT_FIELDS.select(request.args)
+            return stream_list(session, selection, selection.apply(session.query(Shot)))
+        except ProjectionError as e:
+            session.close()
+            return {'error': str(e)}, 400
         except Exception as e:
-            return {'error': str(e)}, 500
-        finally:
             session.close()
+            return {'error': str(e)}, 500
 
+    @idempotency.idempotent
     def post(self):
         """Create a new shot"""
         session = Session()
@@ -602,36 +852,47 @@ class ShotListResource(Resource):
             if not event:
                 return {'error': 'Event not found'}, 404
             
-            photographer = session.query(Personnel).filter_by(id=data['photographer_id']).first()
-            if not photographer:
+            is_photographer = session.query(Personnel.has_photographer_role).filter_by(id=data['photographer_id']).scalar()
+            if is_photographer is None:
                 return {'error': 'Photographer not found'}, 404
             
             # Verify the personnel has a photographer role
-            if not photographer.is_photographer():
+            if not is_photographer:
                 return {'error': 'Personnel must have a photographer role to be assigned as photographer'}, 400
             
+            metadata = shot_metadata(data)
             shot = Shot(
                 image=data['image'],
                 date_created=parse_date(data['date_created']),
                 camera=data['camera'],
                 filename=data['filename'],
                 event_id=data['event_id'],
-                photographer_id=data['photographer_id']
+                photographer_id=data['photographer_id'],
+                **metadata
             )
             
             session.add(shot)
-            session.commit()
-            
-            return {
-                'id': shot.id,
-                'image': shot.image,
-                'date_created': str(shot.date_created),
-                'camera': shot.camera,
-                'filename': shot.filename,
-                'event_id': shot.event_id,
-                'photographer_id': shot.photographer_id,
-                'message': 'Shot created successfully'
-            }, 201
+            try:
+                session.flush()
+                # Anything the client didn't send is read from the image file by a job worker
+                if set(metadata) != set(exif.FIELDS) and exif.readable(shot.image):
+                    exif.enqueue_read(session, [shot.id])
+                session.commit()
+                status, message = 201, 'Shot created successfully'
+            except IntegrityError:
+                # A re-upload of a shot the event already has (unique event_id, filename, camera)
+                session.rollback()
+                shot = session.query(Shot).filter_by(
+                    event_id=data['event_id'], filename=data['filename'], camera=data['camera']
+                ).first()
+                if shot is None:
+                    raise
+                status, message = 200, 'Shot already exists'
+            
+            return shot_response(shot, message), status
+        except exif.ExifError as e:
+            session.rollback()
+            return {'error': str(e)}, 400
         except Exception as e:
             session.rollback()
             return {'error': str(e)}, 500
@@ -639,23 +900,19 @@ class ShotListResource(Resource):
             session.close()
 
 class ShotResource(Resource):
+    @compression.cached
     def get(self, shot_id):
         """Get a specific shot"""
         session = Session()
         try:
-            shot = session.query(Shot).filter_by(id=shot_id).first()
+            selection = SHOT_FIELDS.select(request.args)
+            shot = selection.apply(session.query(Shot)).filter_by(id=shot_id).first()
             if not shot:
                 return {'error': 'Shot not found'}, 404
             
-            return {
-                'id': shot.id,
-                'image': shot.image,
-                'date_created': str(shot.date_created),
-                'camera': shot.camera,
-                'filename': shot.filename,
-                'event_id': shot.event_id,
-                'photographer_id': shot.photographer_id
-            }, 200
+            return selection.serialize(shot), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
@@ -687,25 +944,21 @@ class ShotResource(Resource):
                 shot.event_id = data['event_id']
             if 'photographer_id' in data:
                 # Verify photographer exists and has photographer role
-                photographer = session.query(Personnel).filter_by(id=data['photographer_id']).first()
-                if not photographer:
+                is_photographer = session.query(Personnel.has_photographer_role).filter_by(id=data['photographer_id']).scalar()
+                if is_photographer is None:
                     return {'error': 'Photographer not found'}, 404
-                if not photographer.is_photographer():
+                if not is_photographer:
                     return {'error': 'Personnel must have a photographer role to be assigned as photographer'}, 400
                 shot.photographer_id = data['photographer_id']
+            for name, value in shot_metadata(data).items():
+                setattr(shot, name, value)
             
             session.commit()
             
-            return {
-                'id': shot.id,
-                'image': shot.image,
-                'date_created': str(shot.date_created),
-                'camera': shot.camera,
-                'filename': shot.filename,
-                'event_id': shot.event_id,
-                'photographer_id': shot.photographer_id,
-                'message': 'Shot updated successfully'
-            }, 200
+            return shot_response(shot, 'Shot updated successfully'), 200
+        except exif.ExifError as e:
+            session.rollback()
+            return {'error': str(e)}, 400
         except Exception as e:
             session.rollback()
             return {'error': str(e)}, 500
@@ -716,11 +969,9 @@ class ShotResource(Resource):
         """Delete a shot"""
         session = Session()
         try:
-            shot = session.query(Shot).filter_by(id=shot_id).first()
-            if not shot:
+            # Soft delete; compaction purges the row and its image file later
+            if not soft_delete.soft_delete_shot(session, shot_id):
                 return {'error': 'Shot not found'}, 404
-            
-            session.delete(shot)
             session.commit()
             
             return {'message': 'Shot deleted successfully'}, 200
@@ -730,31 +981,84 @@ class ShotResource(Resource):
         finally:
             session.close()
 
+class ShotMatchResource(Resource):
+    def post(self):
+        """Match a batch of files (camera serial + capture time) to the events they were shot at"""
+        session = Session()
+        try:
+            data = request.get_json()
+            if not data or not isinstance(data.get('files'), list):
+                return {'error': 'files is required and must be a list'}, 400
+            
+            organization_id = data.get('organizationId')
+            if organization_id not in (None, ''):
+                if session.query(Organization.id).filter_by(id=organization_id).first() is None:
+                    return {'error': 'Organization not found'}, 404
+                organization_id = int(organization_id)
+            else:
+                organization_id = None
+            
+            matches = matching.match_files(session, data['files'], organization_id)
+            matched = sum(1 for match in matches if match['eventId'] is not None)
+            return {
+                'matches': matches,
+                'filesMatchedToEvents': matched,
+                'filesUnmatched': len(matches) - matched
+            }, 200
+        except matching.MatchError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
+class ShotVerifyResource(Resource):
+    def post(self):
+        """Queue checksum verification of shots' working and backup copies; progress is at /jobs/<id>"""
+        session = Session()
+        try:
+            data = request.get_json()
+            if not data or not isinstance(data.get('files'), list):
+                return {'error': 'files is required and must be a list'}, 400
+            
+            job = checksums.enqueue_verify(session, data['files'], data.get('algorithm') or checksums.CHECKSUM_ALGORITHM)
+            session.commit()
+            return {'job': jobs.to_dict(job), 'message': 'Checksum verification queued'}, 202, \
+                {'Location': f'/jobs/{job.id}'}
+        except checksums.ChecksumError as e:
+            session.rollback()
+            return {'error': str(e)}, 400
+        except Exception as e:
+            session.rollback()
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
 # ==================== RELATIONSHIP RESOURCES ====================
 
 class EventPersonnelResource(Resource):
+    @compression.cached
     def get(self, event_id):
         """Get all personnel for an event"""
         session = Session()
         try:
-            event = session.query(Event).filter_by(id=event_id).first()
-            if not event:
+            selection = PERSONNEL_FIELDS.select(request.args)
+            if session.query(Event.id).filter_by(id=event_id).first() is None:
                 return {'error': 'Event not found'}, 404
             
-            personnel = event.personnel
-            return [{
-                'id': person.id,
-                'name': person.name,
-                'role': person.role,
-                'phone': person.phone,
-                'email': person.email
-            } for person in personnel], 200
+            personnel = selection.apply(session.query(Personnel)).join(
+                event_personnel, event_personnel.c.personnel_id == Personnel.id
+            ).filter(event_personnel.c.event_id == event_id).all()
+            return selection.serialize_all(session, personnel), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
             session.close()
 
 class EventPersonnelAssignmentResource(Resource):
+    @idempotency.idempotent
     def post(self, event_id, personnel_id):
         """Add personnel to an event"""
         session = Session()
@@ -780,24 +1084,131 @@ class EventPersonnelAssignmentResource(Resource):
         finally:
             session.close()
 
+# Rows per multi-row INSERT/DELETE statement; keeps us well under SQLite's bound parameter limit
+BULK_CHUNK_SIZE = 500
+
+def parse_assignment_pairs(items):
+    """Normalize a list of assignments into (event_id, personnel_id) tuples.
+
+    Each item may be an object ({'eventId': 1, 'personnelId': 2}) or a two element list ([1, 2]).
+    """
+    pairs = []
+    for item in items or []:
+        if isinstance(item, dict):
+            event_id, personnel_id = item.get('eventId'), item.get('personnelId')
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            event_id, personnel_id = item
+        else:
+            raise ValueError(f'Invalid assignment: {item}')
+        if event_id is None or personnel_id is None:
+            raise ValueError(f'Invalid assignment: {item}')
+        pairs.append((int(event_id), int(personnel_id)))
+    # Drop duplicates but keep request order
+    return list(dict.fromkeys(pairs))
+
+class EventPersonnelBulkResource(Resource):
+    @idempotency.idempotent
+    def post(self):
+        """Assign and remove personnel across many events in a single transaction"""
+        session = Session()
+        try:
+            data = request.get_json()
+
+            if not data or ('assign' not in data and 'remove' not in data):
+                return {'error': 'assign or remove is required'}, 400
+
+            try:
+                to_assign = parse_assignment_pairs(data.get('assign'))
+                to_remove = parse_assignment_pairs(data.get('remove'))
+            except (TypeError, ValueError) as e:
+                return {'error': str(e)}, 400
+
+            conflicting = set(to_assign) & set(to_remove)
+            if conflicting:
+                return {'error': 'Assignments cannot be both added and removed',
+                        'conflicts': [{'eventId': str(e), 'personnelId': str(p)} for e, p in sorted(conflicting)]}, 400
+
+            all_pairs = to_assign + to_remove
+            event_ids = {event_id for event_id, _ in all_pairs}
+            personnel_ids = {personnel_id for _, personnel_id in all_pairs}
+
+            # Validate every referenced ID with one query per table
+            found_events = {row[0] for row in session.query(Event.id).filter(Event.id.in_(event_ids))}
+            found_personnel = {row[0] for row in session.query(Personnel.id).filter(Personnel.id.in_(personnel_ids))}
+            missing_events = sorted(event_ids - found_events)
+            missing_personnel = sorted(personnel_ids - found_personnel)
+            if missing_events or missing_personnel:
+                return {
+                    'error': 'Events or personnel not found',
+                    'missingEventIds': [str(i) for i in missing_events],
+                    'missingPersonnelIds': [str(i) for i in missing_personnel]
+                }, 404
+
+            # Load the current assignments for the touched events in one pass
+            existing = {tuple(row) for row in session.execute(
+                select(event_personnel.c.event_id, event_personnel.c.personnel_id)
+                .where(event_personnel.c.event_id.in_(event_ids))
+            )}
+
+            added = [pair for pair in to_assign if pair not in existing]
+            removed = [pair for pair in to_remove if pair in existing]
+
+            for i in range(0, len(added), BULK_CHUNK_SIZE):
+                chunk = added[i:i + BULK_CHUNK_SIZE]
+                # A concurrent request may have assigned the same pair since it was read
+                session.execute(dialects.insert(session.get_bind(), event_personnel).values(
+                    [{'event_id': e, 'personnel_id': p} for e, p in chunk]
+                ).on_conflict_do_nothing())
+
+            for i in range(0, len(removed), BULK_CHUNK_SIZE):
+                chunk = removed[i:i + BULK_CHUNK_SIZE]
+                session.execute(event_personnel.delete().where(
+                    tuple_(event_personnel.c.event_id, event_personnel.c.personnel_id).in_(chunk)
+                ))
+
+            session.commit()
+
+            def serialize(pairs):
+                return [{'eventId': str(e), 'personnelId': str(p)} for e, p in pairs]
+
+            return {
+                'added': serialize(added),
+                'removed': serialize(removed),
+                'alreadyAssigned': serialize([pair for pair in to_assign if pair in existing]),
+                'notAssigned': serialize([pair for pair in to_remove if pair not in existing]),
+                'message': 'Personnel assignments updated successfully'
+            }, 200
+        except Exception as e:
+            session.rollback()
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
 class EventShotsResource(Resource):
+    @compression.cached
     def get(self, event_id):
-        """Get all shots for an event"""
+        """Get all shots for an event, or with ?from=&to= those captured in [from, to), in capture order"""
         session = Session()
         try:
-            event = session.query(Event).filter_by(id=event_id).first()
-            if not event:
+            selection = EVENT_SHOT_FIELDS.select(request.args)
+            captured_from = exif.parse_captured_at(request.args.get('from'))
+            captured_to = exif.parse_captured_at(request.args.get('to'))
+            if session.query(Event.id).filter_by(id=event_id).first() is None:
                 return {'error': 'Event not found'}, 404
             
-            shots = event.shots
-            return [{
-                'id': shot.id,
-                'image': shot.image,
-                'date_created': str(shot.date_created),
-                'camera': shot.camera,
-                'filename': shot.filename,
-                'photographer_id': shot.photographer_id
-            } for shot in shots], 200
+            query = selection.apply(session.query(Shot)).filter_by(event_id=event_id)
+            if captured_from is not None or captured_to is not None:
+                # One range of ix_shots_event_captured_at; shots with no capture time are left out
+                query = query.filter(Shot.captured_at.isnot(None))
+                if captured_from is not None:
+                    query = query.filter(Shot.captured_at >= captured_from)
+                if captured_to is not None:
+                    query = query.filter(Shot.captured_at < captured_to)
+                query = query.order_by(Shot.captured_at, Shot.id)
+            shots = query.all()
+            return selection.serialize_all(session, shots), 200
+        except (ProjectionError, exif.ExifError) as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
@@ -805,36 +1216,51 @@ class EventShotsResource(Resource):
 
 # ==================== SHOT REQUEST RESOURCES ====================
 
+SHOT_REQUEST_FIELDS = FieldSet(Shot_Request, {
+    'id': Field([Shot_Request.id], lambda shot_request: str(shot_request.id)),
+    'shotDescription': Field([Shot_Request.shot_description], lambda shot_request: shot_request.shot_description),
+    'startTime': Field([Shot_Request.start_time], lambda shot_request: shot_request.start_time),
+    'endTime': Field([Shot_Request.end_time], lambda shot_request: shot_request.end_time),
+    'stakeholder': Field([Shot_Request.stakeholder], lambda shot_request: shot_request.stakeholder),
+    'quickTurn': Field([Shot_Request.quick_turn], lambda shot_request: shot_request.quick_turn),
+    'deadline': Field([Shot_Request.deadline], lambda shot_request: shot_request.deadline),
+    'keySponsor': Field([Shot_Request.key_sponsor], lambda shot_request: shot_request.key_sponsor),
+    'status': Field([Shot_Request.status], lambda shot_request: shot_request.status),
+    'processPoint': Field([Shot_Request.process_point], lambda shot_request: shot_request.process_point or 'idle'),
+    'eventId': Field([Shot_Request.event_id], lambda shot_request: shot_request.event_id),
+    'version': Field([Shot_Request.version], lambda shot_request: shot_request.version)
+})
+
+# JSON keys accepted by PATCH /shot-requests/<id>
+SHOT_REQUEST_PATCH_FIELDS = {
+    'shotDescription': PatchField('shot_description'),
+    'startTime': PatchField('start_time'),
+    'endTime': PatchField('end_time'),
+    'stakeholder': PatchField('stakeholder'),
+    'quickTurn': PatchField('quick_turn'),
+    'deadline': PatchField('deadline'),
+    'keySponsor': PatchField('key_sponsor'),
+    'status': PatchField('status'),
+    'eventId': PatchField('event_id'),
+    'processPoint': PatchField('process_point')
+}
+
 class ShotRequestListResource(Resource):
+    @compression.cached
     def get(self):
         """Get all shot requests"""
         session = Session()
         try:
-            shot_requests = session.query(Shot_Request).all()
-            shot_requests_data = []
-            
-            for shot_request in shot_requests:
-                shot_request_data = {
-                    'id': str(shot_request.id),
-                    'shotDescription': shot_request.shot_description,
-                    'startTime': shot_request.start_time,
-                    'endTime': shot_request.end_time,
-                    'stakeholder': shot_request.stakeholder,
-                    'quickTurn': shot_request.quick_turn,
-                    'deadline': shot_request.deadline,
-                    'keySponsor': shot_request.key_sponsor,
-                    'status': shot_request.status,
-                    'processPoint': shot_request.process_point or 'idle',
-                    'eventId': shot_request.event_id
-                }
-                shot_requests_data.append(shot_request_data)
-            
-            return shot_requests_data, 200
+            selection = SHOT_REQUEST_FIELDS.select(request.args)
+            return stream_list(session, selection, selection.apply(session.query(Shot_Request)))
+        except ProjectionError as e:
+            session.close()
+            return {'error': str(e)}, 400
         except Exception as e:
-            return {'error': str(e)}, 500
-        finally:
             session.close()
+            return {'error': str(e)}, 500
 
+    @idempotency.idempotent
     def post(self):
         """Create a new shot request"""
         session = Session()
@@ -878,28 +1304,174 @@ class ShotRequestListResource(Resource):
         finally:
             session.close()
 
+# Workflow order of the board columns; other process points follow alphabetically
+BOARD_COLUMN_ORDER = ['idle', 'ingest', 'cull', 'color', 'editing', 'review', 'delivered']
+BOARD_DEFAULT_LIMIT = 25
+BOARD_MAX_LIMIT = 100
+
+def board_column_key(process_point):
+    name = process_point.lower()
+    if name in BOARD_COLUMN_ORDER:
+        return (0, BOARD_COLUMN_ORDER.index(name), process_point)
+    return (1, 0, name)
+
+def process_point_criteria(process_point):
+    """Requests without a process point are shown as idle"""
+    if process_point == 'idle':
+        return or_(Shot_Request.process_point == 'idle', Shot_Request.process_point.is_(None))
+    return Shot_Request.process_point == process_point
+
+class ShotRequestBoardResource(Resource):
+    @compression.cached
+    def get(self):
+        """Get shot requests for an event or project grouped into process point columns"""
+        session = Session()
+        try:
+            selection = SHOT_REQUEST_FIELDS.select(request.args)
+            
+            try:
+                limit = min(int(request.args.get('limit', BOARD_DEFAULT_LIMIT)), BOARD_MAX_LIMIT)
+                offset = int(request.args.get('offset', 0))
+            except ValueError:
+                return {'error': 'limit and offset must be integers'}, 400
+            if limit < 1 or offset < 0:
+                return {'error': 'limit must be positive and offset must not be negative'}, 400
+            
+            if request.args.get('eventId'):
+                if session.query(Event.id).filter_by(id=request.args['eventId']).first() is None:
+                    return {'error': 'Event not found'}, 404
+                scope = Shot_Request.event_id == request.args['eventId']
+            elif request.args.get('projectId'):
+                if session.query(Project.id).filter_by(id=request.args['projectId']).first() is None:
+                    return {'error': 'Project not found'}, 404
+                scope = Shot_Request.event_id.in_(select(Event.id).where(Event.project_id == request.args['projectId']))
+            else:
+                return {'error': 'eventId or projectId is required'}, 400
+            
+            # Column sizes come straight from the board index
+            totals = defaultdict(int)
+            for process_point, count in session.execute(
+                select(Shot_Request.process_point, func.count()).where(scope).group_by(Shot_Request.process_point)
+            ):
+                totals[process_point or 'idle'] += count
+            
+            if request.args.get('columns'):
+                columns = [name.strip() for name in request.args['columns'].split(',') if name.strip()]
+            else:
+                columns = sorted(totals, key=board_column_key)
+            
+            board = []
+            for process_point in columns:
+                items = []
+                if totals[process_point] > offset:
+                    # Soonest deadline first (requests without one last), quick turns first on the same
+                    # deadline: the board index order, so the page is read without sorting
+                    items = selection.apply(session.query(Shot_Request)).filter(
+                        scope, process_point_criteria(process_point)
+                    ).order_by(
+                        Shot_Request.deadline_sort,
+                        Shot_Request.quick_turn.desc(),
+                        Shot_Request.id
+                    ).offset(offset).limit(limit).all()
+                has_more = totals[process_point] > offset + len(items)
+                board.append({
+                    'processPoint': process_point,
+                    'total': totals[process_point],
+                    'shotRequests': selection.serialize_all(session, items),
+                    'hasMore': has_more,
+                    'nextOffset': offset + limit if has_more else None
+                })
+            
+            return {'columns': board, 'limit': limit, 'offset': offset}, 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
+SCHEDULER_DEFAULT_COUNT = 10
+SCHEDULER_MAX_COUNT = 100
+# A year ahead covers any real deadline and keeps now + hours a valid datetime
+AT_RISK_MAX_HOURS = 24 * 366
+
+def scheduled_shot_requests(session, selection, scheduled):
+    """Load [(id, deadline), ...] from the scheduler in its order, with an overdue flag"""
+    rows = selection.apply(session.query(Shot_Request)).filter(
+        Shot_Request.id.in_([shot_request_id for shot_request_id, _ in scheduled])
+    ).all()
+    serialized = dict(zip((row.id for row in rows), selection.serialize_all(session, rows)))
+    now = datetime.now()
+    items = []
+    for shot_request_id, deadline in scheduled:
+        # A row can vanish between reading the heap and loading it
+        if shot_request_id in serialized:
+            items.append({**serialized[shot_request_id], 'overdue': deadline is not None and deadline < now})
+    return items
+
+class ShotRequestNextResource(Resource):
+    def get(self):
+        """Get the most urgent open shot requests: soonest deadline first, quick turns first on ties"""
+        session = Session()
+        try:
+            selection = SHOT_REQUEST_FIELDS.select(request.args)
+            try:
+                n = int(request.args.get('n', SCHEDULER_DEFAULT_COUNT))
+            except ValueError:
+                return {'error': 'n must be an integer'}, 400
+            if not 1 <= n <= SCHEDULER_MAX_COUNT:
+                return {'error': f'n must be between 1 and {SCHEDULER_MAX_COUNT}'}, 400
+            
+            return {'shotRequests': scheduled_shot_requests(session, selection, scheduler.queue.next(n))}, 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
+class ShotRequestAtRiskResource(Resource):
+    def get(self):
+        """Get open shot requests that are overdue or due within the next `hours`"""
+        session = Session()
+        try:
+            selection = SHOT_REQUEST_FIELDS.select(request.args)
+            try:
+                hours = float(request.args.get('hours', scheduler.AT_RISK_HOURS))
+                limit = min(int(request.args.get('limit', SCHEDULER_MAX_COUNT)), SCHEDULER_MAX_COUNT)
+            except ValueError:
+                return {'error': 'hours must be a number and limit an integer'}, 400
+            if not math.isfinite(hours) or not 0 <= hours <= AT_RISK_MAX_HOURS:
+                return {'error': f'hours must be a number from 0 to {AT_RISK_MAX_HOURS}'}, 400
+            if limit < 1:
+                return {'error': 'limit must be positive'}, 400
+            
+            scheduled = scheduler.queue.at_risk(hours=hours, limit=limit)
+            return {
+                'shotRequests': scheduled_shot_requests(session, selection, scheduled),
+                'hours': hours
+            }, 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
+        except Exception as e:
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
 class ShotRequestResource(Resource):
+    @compression.cached
     def get(self, shot_request_id):
         """Get a specific shot request"""
         session = Session()
         try:
-            shot_request = session.query(Shot_Request).filter_by(id=shot_request_id).first()
+            selection = SHOT_REQUEST_FIELDS.select(request.args)
+            shot_request = selection.apply(session.query(Shot_Request)).filter_by(id=shot_request_id).first()
             if not shot_request:
                 return {'error': 'Shot request not found'}, 404
             
-            return {
-                'id': str(shot_request.id),
-                'shotDescription': shot_request.shot_description,
-                'startTime': shot_request.start_time,
-                'endTime': shot_request.end_time,
-                'stakeholder': shot_request.stakeholder,
-                'quickTurn': shot_request.quick_turn,
-                'deadline': shot_request.deadline,
-                'keySponsor': shot_request.key_sponsor,
-                'processPoint': shot_request.process_point or 'idle',
-                'eventId': shot_request.event_id,
-                'status': shot_request.status
-            }, 200
+            return selection.serialize(shot_request), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
@@ -955,6 +1527,43 @@ class ShotRequestResource(Resource):
         finally:
             session.close()
 
+    def patch(self, shot_request_id):
+        """Update only the given fields of a shot request, if it is still at the expected version"""
+        session = Session()
+        try:
+            data = request.get_json(silent=True)
+            values = patching.parse_patch(data, Shot_Request, SHOT_REQUEST_PATCH_FIELDS)
+            version = patching.expected_version(request.headers, data)
+            if 'deadline' in values:
+                values['deadline_sort'] = deadline_sort(values['deadline'])
+            
+            old = None
+            if any(column in values for column in stats.SHOT_REQUEST_STATS_COLUMNS):
+                old = patching.read_old_values(
+                    session, Shot_Request, shot_request_id, version, stats.SHOT_REQUEST_STATS_COLUMNS
+                )
+            
+            shot_request = patching.apply_patch(session, Shot_Request, shot_request_id, version, values)
+            if old is not None:
+                stats.apply_shot_request_change(session, old, {
+                    column: getattr(shot_request, column) for column in stats.SHOT_REQUEST_STATS_COLUMNS
+                })
+            scheduler.touch(session, shot_request_ids=[shot_request_id])
+            session.commit()
+            
+            return SHOT_REQUEST_FIELDS.select({}).serialize(shot_request), 200, {'ETag': f'"{shot_request.version}"'}
+        except patching.NotFound:
+            session.rollback()
+            return {'error': 'Shot request not found'}, 404
+        except patching.PATCH_ERRORS as e:
+            session.rollback()
+            return patching.error_response(e)
+        except Exception as e:
+            session.rollback()
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
     def delete(self, shot_request_id):
         """Delete a shot request"""
         session = Session()
@@ -975,52 +1584,89 @@ class ShotRequestResource(Resource):
 
 # ==================== PROJECT RESOURCES ====================
 
+def prefetch_key_personnel(session, projects):
+    """Load key personnel and their project roles for many projects in one query"""
+    key_personnel = defaultdict(list)
+    project_ids = [project.id for project in projects]
+    if not project_ids:
+        return key_personnel
+    
+    rows = session.execute(
+        select(project_key_personnel.c.project_id, project_key_personnel.c.role,
+               Personnel.id, Personnel.name, Personnel.role.label('personnel_role'))
+        .join(Personnel, Personnel.id == project_key_personnel.c.personnel_id)
+        .where(project_key_personnel.c.project_id.in_(project_ids))
+    )
+    for row in rows:
+        key_personnel[row.project_id].append({
+            'personnelId': str(row.id),
+            'name': row.name,
+            'role': row.personnel_role,
+            'projectRole': row.role
+        })
+    return key_personnel
+
+PROJECT_BASE_FIELDS = {
+    'id': Field([Project.id], lambda project: str(project.id)),
+    'name': Field([Project.name], lambda project: project.name),
+    'client': Field([Project.client], lambda project: project.client or ''),
+    'organizationId': Field([Project.organization_id], lambda project: str(project.organization_id)),
+    'description': Field([Project.description], lambda project: project.description or ''),
+    'startDate': Field([Project.start_date], lambda project: project.start_date.isoformat() if project.start_date else ''),
+    'endDate': Field([Project.end_date], lambda project: project.end_date.isoformat() if project.end_date else ''),
+    'location': Field([Project.location], lambda project: project.location or ''),
+    'version': Field([Project.version], lambda project: project.version)
+}
+
+PROJECT_RELATIONS = {
+    'keyPersonnel': Relation(
+        'keyPersonnel',
+        lambda project, key_personnel: key_personnel.get(project.id, []),
+        prefetch=prefetch_key_personnel
+    )
+}
+
+# Shape returned by GET /projects
+PROJECT_LIST_FIELDS = FieldSet(Project, {
+    **PROJECT_BASE_FIELDS,
+    'status': Field([Project.status], lambda project: project.status or 'In Planning')
+}, PROJECT_RELATIONS)
+
+# Shape returned by GET /projects/<id>
+PROJECT_FIELDS = FieldSet(Project, {
+    **PROJECT_BASE_FIELDS,
+    'status': Field([Project.status], lambda project: project.status or 'Planning')
+}, PROJECT_RELATIONS)
+
+# JSON keys accepted by PATCH /projects/<id> (keyPersonnel is handled separately)
+PROJECT_PATCH_FIELDS = {
+    'name': PatchField('name'),
+    'client': PatchField('client'),
+    'organizationId': PatchField('organization_id'),
+    'status': PatchField('status'),
+    'description': PatchField('description'),
+    'startDate': PatchField('start_date', patching.parse_date),
+    'endDate': PatchField('end_date', patching.parse_date),
+    'location': PatchField('location')
+}
+
 class ProjectListResource(Resource):
+    @compression.cached
     def get(self):
         """Get all projects"""
         session = Session()
         try:
-            projects = session.query(Project).all()
-            projects_data = []
-            
-            for project in projects:
-                # Get key personnel with their roles from the association table
-                key_personnel_data = []
-                for personnel in project.key_personnel:
-                    # Get the role from the association table
-                    role_query = session.execute(
-                        text("SELECT role FROM project_key_personnel WHERE project_id = :project_id AND personnel_id = :personnel_id"),
-                        {"project_id": project.id, "personnel_id": personnel.id}
-                    ).fetchone()
-                    role = role_query[0] if role_query else personnel.role
-                    
-                    key_personnel_data.append({
-                        'personnelId': str(personnel.id),
-                        'name': personnel.name,
-                        'role': personnel.role,
-                        'projectRole': role
-                    })
-                
-                project_data = {
-                    'id': str(project.id),
-                    'name': project.name,
-                    'client': project.client or '',
-                    'organizationId': str(project.organization_id),
-                    'status': project.status or 'In Planning',
-                    'description': project.description or '',
-                    'startDate': project.start_date.isoformat() if project.start_date else '',
-                    'endDate': project.end_date.isoformat() if project.end_date else '',
-                    'location': project.location or '',
-                    'keyPersonnel': key_personnel_data
-                }
-                projects_data.append(project_data)
-            
-            return projects_data, 200
+            selection = PROJECT_LIST_FIELDS.select(request.args)
+            projects = selection.apply(session.query(Project)).all()
+            return selection.serialize_all(session, projects), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
             session.close()
 
+    @idempotency.idempotent
     def post(self):
         """Create a new project"""
         session = Session()
@@ -1049,20 +1695,15 @@ class ProjectListResource(Resource):
             session.add(project)
             session.flush()  # Get the project ID
             
-            # Add key personnel if provided
+            # Add key personnel if provided; unknown personnel are skipped
             if 'keyPersonnel' in data and data['keyPersonnel']:
-                for personnel_data in data['keyPersonnel']:
-                    personnel_id = personnel_data.get('personnelId')
-                    project_role = personnel_data.get('projectRole', 'Team Member')
-                    
-                    if personnel_id:
-                        personnel = session.query(Personnel).filter_by(id=personnel_id).first()
-                        if personnel:
-                            # Insert directly into association table with role
-                            session.execute(
-                                text("INSERT INTO project_key_personnel (project_id, personnel_id, role) VALUES (:project_id, :personnel_id, :role)"),
-                                {"project_id": project.id, "personnel_id": personnel.id, "role": project_role}
-                            )
+                key_personnel = {
+                    int(personnel_data['personnelId']): personnel_data.get('projectRole', 'Team Member')
+                    for personnel_data in data['keyPersonnel'] if personnel_data.get('personnelId')
+                }
+                for personnel_id in patching.unknown_personnel(session, list(key_personnel)):
+                    del key_personnel[personnel_id]
+                patching.sync_key_personnel(session, project.id, key_personnel)
             
             session.commit()
             
@@ -1102,43 +1743,19 @@ class ProjectListResource(Resource):
             session.close()
 
 class ProjectResource(Resource):
+    @compression.cached
     def get(self, project_id):
         """Get a specific project"""
         session = Session()
         try:
-            project = session.query(Project).filter_by(id=project_id).first()
+            selection = PROJECT_FIELDS.select(request.args)
+            project = selection.apply(session.query(Project)).filter_by(id=project_id).first()
             if not project:
                 return {'error': 'Project not found'}, 404
             
-            # Get key personnel with their roles from the association table
-            key_personnel_data = []
-            for personnel in project.key_personnel:
-                # Get the role from the association table
-                role_query = session.execute(
-                    text("SELECT role FROM project_key_personnel WHERE project_id = :project_id AND personnel_id = :personnel_id"),
-                    {"project_id": project.id, "personnel_id": personnel.id}
-                ).fetchone()
-                role = role_query[0] if role_query else personnel.role
-                
-                key_personnel_data.append({
-                    'personnelId': str(personnel.id),
-                    'name': personnel.name,
-                    'role': personnel.role,
-                    'projectRole': role
-                })
-            
-            return {
-                'id': str(project.id),
-                'name': project.name,
-                'client': project.client or '',
-                'organizationId': str(project.organization_id),
-                'status': project.status or 'Planning',
-                'description': project.description or '',
-                'startDate': project.start_date.isoformat() if project.start_date else '',
-                'endDate': project.end_date.isoformat() if project.end_date else '',
-                'location': project.location or '',
-                'keyPersonnel': key_personnel_data
-            }, 200
+            return selection.serialize_all(session, [project])[0], 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
@@ -1173,25 +1790,14 @@ class ProjectResource(Resource):
             if 'location' in data:
                 project.location = data['location']
             if 'keyPersonnel' in data:
-                # Clear existing key personnel - need to delete from association table directly
-                session.execute(
-                    text("DELETE FROM project_key_personnel WHERE project_id = :project_id"),
-                    {"project_id": project.id}
-                )
-                
-                # Add new key personnel with roles - insert directly into association table
-                for personnel_data in data['keyPersonnel']:
-                    personnel_id = personnel_data.get('personnelId')
-                    project_role = personnel_data.get('projectRole', 'Team Member')
-                    
-                    if personnel_id:
-                        personnel = session.query(Personnel).filter_by(id=personnel_id).first()
-                        if personnel:
-                            # Insert directly into association table with role
-                            session.execute(
-                                text("INSERT INTO project_key_personnel (project_id, personnel_id, role) VALUES (:project_id, :personnel_id, :role)"),
-                                {"project_id": project.id, "personnel_id": personnel.id, "role": project_role}
-                            )
+                # Only rows that differ are deleted, inserted or updated; unknown personnel are skipped
+                key_personnel = {
+                    int(personnel_data['personnelId']): personnel_data.get('projectRole', 'Team Member')
+                    for personnel_data in data['keyPersonnel'] if personnel_data.get('personnelId')
+                }
+                for personnel_id in patching.unknown_personnel(session, list(key_personnel)):
+                    del key_personnel[personnel_id]
+                patching.sync_key_personnel(session, project.id, key_personnel)
             
             session.commit()
             
@@ -1230,18 +1836,49 @@ class ProjectResource(Resource):
         finally:
             session.close()
 
+    def patch(self, project_id):
+        """Update only the given fields of a project, if it is still at the expected version"""
+        session = Session()
+        try:
+            data = request.get_json(silent=True)
+            values = patching.parse_patch(data, Project, PROJECT_PATCH_FIELDS, extra_keys=['keyPersonnel'])
+            version = patching.expected_version(request.headers, data)
+            
+            key_personnel = None
+            if 'keyPersonnel' in data:
+                key_personnel = patching.parse_key_personnel(data['keyPersonnel'])
+                unknown = patching.unknown_personnel(session, list(key_personnel))
+                if unknown:
+                    return {'error': f'Personnel not found: {", ".join(str(i) for i in unknown)}'}, 404
+            
+            # Always bumps the version, even when only key personnel change
+            project = patching.apply_patch(session, Project, project_id, version, values)
+            if key_personnel is not None:
+                patching.sync_key_personnel(session, project_id, key_personnel)
+            session.commit()
+            
+            return PROJECT_FIELDS.select({}).serialize_all(session, [project])[0], 200, {'ETag': f'"{project.version}"'}
+        except patching.NotFound:
+            session.rollback()
+            return {'error': 'Project not found'}, 404
+        except patching.PATCH_ERRORS as e:
+            session.rollback()
+            return patching.error_response(e)
+        except Exception as e:
+            session.rollback()
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
     def delete(self, project_id):
         """Delete a project"""
         session = Session()
         try:
-            project = session.query(Project).filter_by(id=project_id).first()
-            if not project:
+            if session.query(Project.id).filter_by(id=project_id).first() is None:
                 return {'error': 'Project not found'}, 404
             
-            session.delete(project)
-            session.commit()
-            
-            return {'message': 'Project deleted successfully'}, 200
+            # Events are kept and detached from the project
+            return delete_response(session, 'project', project_id, 'Project deleted successfully')
         except Exception as e:
             session.rollback()
             return {'error': str(e)}, 500
@@ -1249,49 +1886,19 @@ class ProjectResource(Resource):
             session.close()
 
 class ProjectEventsResource(Resource):
+    @compression.cached
     def get(self, project_id):
         """Get all events for a specific project"""
         session = Session()
         try:
-            project = session.query(Project).filter_by(id=project_id).first()
-            if not project:
+            selection = PROJECT_EVENT_FIELDS.select(request.args)
+            if session.query(Project.id).filter_by(id=project_id).first() is None:
                 return {'error': 'Project not found'}, 404
             
-            events = session.query(Event).filter_by(project_id=project_id).all()
-            events_data = []
-            
-            for event in events:
-                event_data = {
-                    'id': str(event.id),
-                    'name': event.name,
-                    'date': str(event.date),
-                    'startTime': event.start_time or '',
-                    'endTime': event.end_time or '',
-                    'location': event.location or '',
-                    'status': event.status or 'Upcoming',
-                    'description': event.description or '',
-                    'projectId': str(event.project_id) if event.project_id else None,
-                    'organizationId': event.organization_id or '',
-                    'discipline': event.discipline or 'Photography',
-                    'standardShotPackage': event.standard_shot_package,
-                    'isQuickTurnaround': event.is_quick_turnaround or False,
-                    'isCovered': event.is_covered if event.is_covered is not None else True,
-                    'process_point': event.process_point or 'idle',
-                    'deadline': event.deadline,
-                    'assignedPersonnelIds': [str(p.id) for p in event.personnel],
-                    'personnelActivity': {},
-                    'shots': [{
-                        'id': str(shot.id),
-                        'eventId': str(shot.event_id),
-                        'description': shot.filename,
-                        'priority': shot.priority,
-                        'status': shot.status,
-                        'is_favorite': shot.is_favorite
-                    } for shot in event.shots]
-                }
-                events_data.append(event_data)
-            
-            return {'events': events_data}, 200
+            events = selection.apply(session.query(Event)).filter_by(project_id=project_id).all()
+            return {'events': selection.serialize_all(session, events)}, 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
@@ -1299,28 +1906,29 @@ class ProjectEventsResource(Resource):
 
 # ==================== ORGANIZATION RESOURCES ====================
 
+ORGANIZATION_FIELDS = FieldSet(Organization, {
+    'id': Field([Organization.id], lambda org: str(org.id)),
+    'name': Field([Organization.name], lambda org: org.name),
+    'description': Field([Organization.description], lambda org: org.description or '')
+})
+
 class OrganizationListResource(Resource):
+    @compression.cached
     def get(self):
         """Get all organizations"""
         session = Session()
         try:
-            organizations = session.query(Organization).all()
-            organizations_data = []
-            
-            for org in organizations:
-                org_data = {
-                    'id': str(org.id),
-                    'name': org.name,
-                    'description': org.description or ''
-                }
-                organizations_data.append(org_data)
-            
-            return organizations_data, 200
+            selection = ORGANIZATION_FIELDS.select(request.args)
+            organizations = selection.apply(session.query(Organization)).all()
+            return selection.serialize_all(session, organizations), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
             session.close()
 
+    @idempotency.idempotent
     def post(self):
         """Create a new organization"""
         session = Session()
@@ -1361,19 +1969,19 @@ class OrganizationListResource(Resource):
             session.close()
 
 class OrganizationResource(Resource):
+    @compression.cached
     def get(self, organization_id):
         """Get a specific organization"""
         session = Session()
         try:
-            organization = session.query(Organization).filter_by(id=organization_id).first()
+            selection = ORGANIZATION_FIELDS.select(request.args)
+            organization = selection.apply(session.query(Organization)).filter_by(id=organization_id).first()
             if not organization:
                 return {'error': 'Organization not found'}, 404
             
-            return {
-                'id': str(organization.id),
-                'name': organization.name,
-                'description': organization.description or ''
-            }, 200
+            return selection.serialize(organization), 200
+        except ProjectionError as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
         finally:
@@ -1412,18 +2020,67 @@ class OrganizationResource(Resource):
         """Delete an organization"""
         session = Session()
         try:
-            organization = session.query(Organization).filter_by(id=organization_id).first()
-            if not organization:
+            if session.query(Organization.id).filter_by(id=organization_id).first() is None:
                 return {'error': 'Organization not found'}, 404
             
-            # Check if organization has projects
-            if organization.projects:
-                return {'error': 'Cannot delete organization with existing projects'}, 400
+            # Check if organization has projects or users
+            blocker = deletes.organization_delete_blocker(session, organization_id)
+            if blocker:
+                return {'error': blocker}, 400
             
-            session.delete(organization)
+            # Its remaining events (with their shots and shot requests) go with it
+            return delete_response(session, 'organization', organization_id, 'Organization deleted successfully')
+        except Exception as e:
+            session.rollback()
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
+class OrganizationExportResource(Resource):
+    def get(self, organization_id):
+        """Stream an organization's full data graph as NDJSON (see org_transfer.py)"""
+        session = Session()
+        try:
+            if session.get(Organization, organization_id) is None:
+                session.close()
+                return {'error': 'Organization not found'}, 404
+        except Exception as e:
+            session.close()
+            return {'error': str(e)}, 500
+
+        def generate():
+            # The session has to outlive the handler, so the generator closes it
+            try:
+                yield from org_transfer.export_organization(session, organization_id)
+            finally:
+                session.close()
+
+        response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        response.headers['Content-Disposition'] = f'attachment; filename=organization-{organization_id}.ndjson'
+        return response
+
+class OrganizationImportResource(Resource):
+    def post(self):
+        """Load an organization dump (NDJSON, optionally gzip-encoded) as a new organization"""
+        session = Session()
+        try:
+            body = request.stream
+            if request.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.GzipFile(fileobj=body)
+
+            organization_id, counts = org_transfer.import_organization(
+                session, body, signup_code=request.args.get('signupCode')
+            )
             session.commit()
-            
-            return {'message': 'Organization deleted successfully'}, 200
+
+            return {
+                'id': str(organization_id),
+                'rows': counts,
+                'message': 'Organization imported successfully'
+            }, 201
+        except org_transfer.TransferError as e:
+            session.rollback()
+            return {'error': str(e)}, 400
         except Exception as e:
             session.rollback()
             return {'error': str(e)}, 500
@@ -1467,6 +2124,7 @@ class AuthLoginResource(Resource):
             session.close()
 
 class AuthSignupResource(Resource):
+    @idempotency.idempotent
     def post(self):
         """User signup with organization code"""
         session = Session()
@@ -1545,51 +2203,228 @@ class AuthVerifyCodeResource(Resource):
         finally:
             session.close()
 
+# ==================== STATS RESOURCES ====================
 
+STATS_SCOPE_MODELS = {
+    'organizations': ('organization', Organization),
+    'projects': ('project', Project),
+    'events': ('event', Event)
+}
 
-# ==================== API ROUTES ====================
+class StatsResource(Resource):
+    @compression.cached
+    def get(self, scope, scope_id):
+        """Get dashboard counters for an organization, project or event"""
+        session = Session()
+        try:
+            scope_name, model = STATS_SCOPE_MODELS[scope]
+            if session.get(model, scope_id) is None:
+                return {'error': f'{model.__name__} not found'}, 404
+
+            return {
+                'scope': scope_name,
+                'id': str(scope_id),
+                **stats.get_stats(session, scope_name, scope_id)
+            }, 200
+        except Exception as e:
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
+# ==================== SEARCH RESOURCES ====================
+
+class SearchResource(Resource):
+    @compression.cached
+    def get(self):
+        """Ranked, prefix-matching full-text search across events, shot requests, personnel and projects"""
+        if not search.search_available(get_engine()):
+            return {'error': 'Search is not supported on this database backend'}, 501
+
+        session = Session()
+        try:
+            q = request.args.get('q', '').strip()
+            if not q:
+                return {'error': 'Query parameter q is required'}, 400
+
+            types = [t for t in request.args.get('type', '').split(',') if t]
+            unknown = [t for t in types if t not in search.SEARCH_TYPES]
+            if unknown:
+                return {'error': f'Unknown search type(s): {", ".join(unknown)}'}, 400
+
+            try:
+                limit = min(int(request.args.get('limit', search.DEFAULT_LIMIT)), search.MAX_LIMIT)
+                offset = int(request.args.get('offset', 0))
+            except ValueError:
+                return {'error': 'limit and offset must be integers'}, 400
+            if limit < 1 or offset < 0:
+                return {'error': 'limit must be positive and offset must not be negative'}, 400
+
+            results, has_more = search.search(session, q, types=types, limit=limit, offset=offset)
+
+            return {
+                'results': results,
+                'limit': limit,
+                'offset': offset,
+                'hasMore': has_more
+            }, 200
+        except Exception as e:
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
+
+
+# ==================== JOB RESOURCES ====================
+
+class JobResource(Resource):
+    def get(self, job_id):
+        """Get the status and progress of a background job"""
+        session = Session()
+        try:
+            job = jobs.queue.get(session, job_id)
+            if job is None:
+                return {'error': 'Job not found'}, 404
+            return jobs.to_dict(job), 200
+        except Exception as e:
+            return {'error': str(e)}, 500
+        finally:
+            session.close()
 
-# User routes
-api.add_resource(UserListResource, '/users')
-api.add_resource(UserResource, '/users/<int:user_id>')
 
-# Authentication routes
-api.add_resource(AuthLoginResource, '/auth/login')
-api.add_resource(AuthSignupResource, '/auth/signup')
-api.add_resource(AuthVerifyCodeResource, '/auth/verify-code')
+# ==================== ADMIN RESOURCES ====================
 
-# Organization routes
-api.add_resource(OrganizationListResource, '/organizations')
-api.add_resource(OrganizationResource, '/organizations/<int:organization_id>')
+SLOW_QUERY_DEFAULT_LIMIT = 20
+SLOW_QUERY_MAX_LIMIT = 100
 
-# Event routes
-api.add_resource(EventListResource, '/events')
-api.add_resource(EventResource, '/events/<int:event_id>')
+class SlowQueryListResource(Resource):
+    def get(self):
+        """Get the slowest statements, aggregated by SQL fingerprint"""
+        try:
+            sort = request.args.get('sort', 'total')
+            if sort not in slow_queries.SORT_KEYS:
+                return {'error': f'sort must be one of: {", ".join(slow_queries.SORT_KEYS)}'}, 400
+            
+            try:
+                limit = min(int(request.args.get('limit', SLOW_QUERY_DEFAULT_LIMIT)), SLOW_QUERY_MAX_LIMIT)
+            except ValueError:
+                return {'error': 'limit must be an integer'}, 400
+            if limit < 1:
+                return {'error': 'limit must be positive'}, 400
+            
+            return {
+                'thresholdMs': slow_queries.slow_query_log.threshold_ms,
+                'queries': slow_queries.slow_query_log.top(limit=limit, sort=sort)
+            }, 200
+        except Exception as e:
+            return {'error': str(e)}, 500
 
-# Personnel routes
-api.add_resource(PersonnelListResource, '/personnel')
-api.add_resource(PersonnelResource, '/personnel/<int:personnel_id>')
-api.add_resource(PhotographersResource, '/photographers')
+    def delete(self):
+        """Clear the slow query log"""
+        slow_queries.slow_query_log.reset()
+        return {'message': 'Slow query log cleared'}, 200
 
-# Project routes
-api.add_resource(ProjectListResource, '/projects')
-api.add_resource(ProjectResource, '/projects/<int:project_id>')
-api.add_resource(ProjectEventsResource, '/projects/<int:project_id>/events')
 
-# Shot routes
-api.add_resource(ShotListResource, '/shots')
-api.add_resource(ShotResource, '/shots/<int:shot_id>')
+# ==================== API ROUTES ====================
 
-api.add_resource(ShotRequestListResource, '/shot-requests')
-api.add_resource(ShotRequestResource, '/shot-requests/<int:shot_request_id>')
+def create_app():
+    """Build the Flask app. The database is set up on the first request (see get_engine)."""
+    app = Flask(__name__)
+    CORS(app)
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+    app.before_request(_prepare_database)
+
+    # Initialize Flask-RESTful
+    api = Api(app)
+
+    # User routes
+    api.add_resource(UserListResource, '/users')
+    api.add_resource(UserResource, '/users/<int:user_id>')
+
+    # Authentication routes
+    api.add_resource(AuthLoginResource, '/auth/login')
+    api.add_resource(AuthSignupResource, '/auth/signup')
+    api.add_resource(AuthVerifyCodeResource, '/auth/verify-code')
+
+    # Organization routes
+    api.add_resource(OrganizationListResource, '/organizations')
+    api.add_resource(OrganizationResource, '/organizations/<int:organization_id>')
+    api.add_resource(OrganizationExportResource, '/organizations/<int:organization_id>/export')
+    api.add_resource(OrganizationImportResource, '/organizations/import')
+
+    # Event routes
+    api.add_resource(EventListResource, '/events')
+    api.add_resource(EventResource, '/events/<int:event_id>')
+
+    # Personnel routes
+    api.add_resource(PersonnelListResource, '/personnel')
+    api.add_resource(PersonnelResource, '/personnel/<int:personnel_id>')
+    api.add_resource(PhotographersResource, '/photographers')
+    api.add_resource(RoleListResource, '/roles')
+
+    # Project routes
+    api.add_resource(ProjectListResource, '/projects')
+    api.add_resource(ProjectResource, '/projects/<int:project_id>')
+    api.add_resource(ProjectEventsResource, '/projects/<int:project_id>/events')
+
+    # Shot routes
+    api.add_resource(ShotListResource, '/shots')
+    api.add_resource(ShotResource, '/shots/<int:shot_id>')
+    api.add_resource(ShotMatchResource, '/shots/match')
+    api.add_resource(ShotVerifyResource, '/shots/verify')
+
+    api.add_resource(ShotRequestListResource, '/shot-requests')
+    api.add_resource(ShotRequestBoardResource, '/shot-requests/board')
+    api.add_resource(ShotRequestNextResource, '/shot-requests/next')
+    api.add_resource(ShotRequestAtRiskResource, '/shot-requests/at-risk')
+    api.add_resource(ShotRequestResource, '/shot-requests/<int:shot_request_id>')
+
+    # Relationship routes
+    api.add_resource(EventPersonnelResource, '/events/<int:event_id>/personnel')
+    api.add_resource(EventPersonnelAssignmentResource, '/events/<int:event_id>/personnel/<int:personnel_id>')
+    api.add_resource(EventPersonnelBulkResource, '/events/personnel/bulk')
+    api.add_resource(EventShotsResource, '/events/<int:event_id>/shots')
+
+    # Stats routes
+    api.add_resource(StatsResource, '/stats/<any(organizations,projects,events):scope>/<int:scope_id>')
+
+    # Search routes
+    api.add_resource(SearchResource, '/search')
+
+    # Job routes
+    api.add_resource(JobResource, '/jobs/<string:job_id>')
+
+    # Admin routes
+    if slow_queries.slow_query_log_enabled():
+        api.add_resource(SlowQueryListResource, '/admin/slow-queries')
+
+    # Database management routes
+    app.add_url_rule('/init-db', 'init_db', initialize_database, methods=['POST'])
+
+    # Opt-in request metrics, Server-Timing headers and sampled profiling (HIVE_METRICS=1)
+    if instrumentation.metrics_enabled():
+        instrumentation.init_app(app)
+
+    # Route safe reads to read replicas (HIVE_READ_REPLICA_URLS)
+    if routing.replicas_configured():
+        for replica in routing.init_app(app):
+            if instrumentation.metrics_enabled():
+                instrumentation.watch_engine(replica)
+            if slow_queries.slow_query_log_enabled():
+                slow_queries.init_engine(replica)
+
+    # Per-lane, per-route and per-organization concurrency caps and client rate limits (HIVE_ADMISSION=1)
+    if admission.admission_enabled():
+        admission.init_app(app)
+
+    # Compress responses (Accept-Encoding) and keep cacheable GET responses compressed in memory
+    compression.init_app(app)
+
+    # Compaction waits for a quiet spell between requests
+    if compaction.compaction_enabled():
+        app.before_request(compaction.note_activity)
+
+    return app
 
-# Relationship routes
-api.add_resource(EventPersonnelResource, '/events/<int:event_id>/personnel')
-api.add_resource(EventPersonnelAssignmentResource, '/events/<int:event_id>/personnel/<int:personnel_id>')
-api.add_resource(EventShotsResource, '/events/<int:event_id>/shots')
 
-# Database management routes
-@app.route('/init-db', methods=['POST'])
 def initialize_database():
     """Initialize database with sample data"""
     try:
@@ -1599,5 +2434,4 @@ def initialize_database():
         return {'error': str(e)}, 500
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
-
+    create_app().run(debug=True, port=5001)
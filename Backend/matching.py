@@ -0,0 +1,265 @@
+"""
+Shot-to-event matching for ingest.
+
+POST /shots/match takes a batch of files, each a camera serial and a capture
+time (camera local time, as EXIF records it; see exif.py), and says which
+event each one was shot at. The whole batch costs a fixed number of queries
+however many files it has:
+
+1. Camera serials are resolved to photographers from the shots already
+   stored: a serial belongs to whoever took the latest shot with it. A file
+   may also name its photographer directly.
+2. The events those photographers are crewed on (event_personnel) over the
+   batch's date range are loaded in one query and built into an interval
+   index per photographer: a centered interval tree of the events'
+   [date + start_time, date + end_time) intervals.
+3. Each file is looked up in its photographer's index. The tree finds the k
+   events within the slack of the capture time in O(log n + k), however much
+   the events overlap, and sorting them best first adds O(k log k).
+
+Photographers shoot a little before and after the schedule, so a capture
+within HIVE_MATCH_SLACK_MINUTES of an event counts, but an event that
+contains the capture time wins over one that is only near it, and of
+overlapping events the one that started last (the more specific one) wins.
+An event whose end time is before its start time runs past midnight, and an
+event without times covers its whole day.
+
+With an organizationId, files whose photographer is unknown or has no event
+at that time are matched against all of the organization's events instead,
+but only when exactly one event fits, so a guess is never made.
+"""
+
+import os
+from datetime import datetime, time, timedelta
+from sqlalchemy import func, select
+from models import Event, Shot, event_personnel
+import exif
+
+MATCH_SLACK_MINUTES = float(os.environ.get('HIVE_MATCH_SLACK_MINUTES', '30'))
+MATCH_MAX_FILES = int(os.environ.get('HIVE_MATCH_MAX_FILES', '50000'))
+
+# Times are compared as seconds since this (naive, local) instant
+EPOCH = datetime(1970, 1, 1)
+
+CLOCK_FORMATS = ('%H:%M', '%H:%M:%S', '%I:%M %p', '%I:%M%p', '%I %p')
+
+
+class MatchError(Exception):
+    """Raised for a batch the matcher can't take"""
+
+
+def _seconds(instant):
+    return (instant - EPOCH).total_seconds()
+
+
+def _parse_clock(value):
+    """A time of day from an event's start_time/end_time; None if it is empty or unreadable"""
+    value = (value or '').strip().upper()
+    for fmt in CLOCK_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).time()
+        except ValueError:
+            continue
+    return None
+
+
+def event_interval(date, start_time, end_time):
+    """(start, end) seconds of an event's scheduled time"""
+    start, end = _parse_clock(start_time), _parse_clock(end_time)
+    if start is None or end is None:
+        day = datetime.combine(date, time())
+        return _seconds(day), _seconds(day + timedelta(days=1))
+    start_at = datetime.combine(date, start)
+    end_at = datetime.combine(date, end)
+    if end_at <= start_at:
+        # Runs past midnight
+        end_at += timedelta(days=1)
+    return _seconds(start_at), _seconds(end_at)
+
+
+class _Node:
+    """A tree node: the intervals containing center, sorted by start and by end (latest first)"""
+
+    __slots__ = ('center', 'by_start', 'by_end', 'left', 'right')
+
+    def __init__(self, center, here, left, right):
+        self.center = center
+        self.by_start = sorted(here)
+        self.by_end = sorted(here, key=lambda interval: interval[1], reverse=True)
+        self.left = left
+        self.right = right
+
+
+def _build(intervals):
+    if not intervals:
+        return None
+    # The median start is inside its own interval, so every node keeps at least one and each side gets at most half
+    center = sorted(start for start, _, _ in intervals)[len(intervals) // 2]
+    here, left, right = [], [], []
+    for interval in intervals:
+        start, end, _ = interval
+        if end <= center:
+            left.append(interval)
+        elif start > center:
+            right.append(interval)
+        else:
+            here.append(interval)
+    return _Node(center, here, _build(left), _build(right))
+
+
+class IntervalIndex:
+    """Event intervals in a centered interval tree, searchable by instant"""
+
+    def __init__(self, intervals):
+        self.root = _build(list(intervals))
+
+    def _overlapping(self, low, high):
+        """The intervals [start, end) with start <= high and end > low"""
+        found = []
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            if node is None:
+                continue
+            if high < node.center:
+                # Every interval here ends after center > high; the right subtree starts after it
+                for interval in node.by_start:
+                    if interval[0] > high:
+                        break
+                    found.append(interval)
+                nodes.append(node.left)
+            elif low >= node.center:
+                # Every interval here starts at or before center <= low; the left subtree ends by it
+                for interval in node.by_end:
+                    if interval[1] <= low:
+                        break
+                    found.append(interval)
+                nodes.append(node.right)
+            else:
+                # center is in (low, high], which every interval here contains
+                found.extend(node.by_start)
+                nodes.append(node.left)
+                nodes.append(node.right)
+        return found
+
+    def candidates(self, instant, slack):
+        """(outside, distance, -start, event_id) of the intervals within slack seconds of instant, best first.
+
+        outside is 0 for an interval containing instant and 1 for one only within slack of it.
+        """
+        found = []
+        for start, end, event_id in self._overlapping(instant - slack, instant + slack):
+            if start <= instant < end:
+                found.append((0, 0.0, -start, event_id))
+            else:
+                distance = start - instant if instant < start else instant - end
+                found.append((1, distance, -start, event_id))
+        found.sort()
+        return found
+
+
+def _photographers_by_serial(session, serials):
+    """{camera serial: personnel id} from the latest stored shot taken with each camera"""
+    if not serials:
+        return {}
+    latest = {}
+    rows = session.execute(
+        select(Shot.camera_serial, Shot.photographer_id, func.max(Shot.id))
+        .where(Shot.camera_serial.in_(serials))
+        .group_by(Shot.camera_serial, Shot.photographer_id)
+    ).all()
+    for serial, photographer_id, last_shot_id in rows:
+        if serial not in latest or last_shot_id > latest[serial][1]:
+            latest[serial] = (photographer_id, last_shot_id)
+    return {serial: photographer_id for serial, (photographer_id, _) in latest.items()}
+
+
+def _parse_files(files):
+    parsed = []
+    for position, item in enumerate(files):
+        if not isinstance(item, dict):
+            raise MatchError(f'files[{position}] must be an object')
+        try:
+            captured_at = exif.parse_captured_at(item.get('capturedAt'))
+        except exif.ExifError as e:
+            raise MatchError(f'files[{position}]: {e}')
+        photographer_id = item.get('photographerId')
+        try:
+            photographer_id = int(photographer_id) if photographer_id not in (None, '') else None
+        except (TypeError, ValueError):
+            raise MatchError(f'files[{position}]: invalid photographerId')
+        serial = item.get('cameraSerial')
+        parsed.append((str(serial) if serial not in (None, '') else None, captured_at, photographer_id))
+    return parsed
+
+
+def match_files(session, files, organization_id=None, slack_minutes=MATCH_SLACK_MINUTES):
+    """One result dict per file, in order: eventId, photographerId, matchedBy and, when unmatched, reason"""
+    if len(files) > MATCH_MAX_FILES:
+        raise MatchError(f'At most {MATCH_MAX_FILES} files can be matched in one call')
+    parsed = _parse_files(files)
+    slack = slack_minutes * 60
+
+    by_serial = _photographers_by_serial(session, {serial for serial, _, photographer_id in parsed
+                                                   if serial is not None and photographer_id is None})
+    photographers = [photographer_id if photographer_id is not None else by_serial.get(serial)
+                     for serial, _, photographer_id in parsed]
+
+    dates = [captured_at.date() for _, captured_at, _ in parsed if captured_at is not None]
+    indexes, organization_index = {}, None
+    if dates:
+        # Events from the day before can run past midnight into the batch
+        first, last = min(dates) - timedelta(days=1), max(dates) + timedelta(days=1)
+        in_range = [Event.date >= first, Event.date <= last]
+        if organization_id is not None:
+            in_range.append(Event.organization_id == organization_id)
+
+        crewed = {p for p in photographers if p is not None}
+        intervals = {}
+        if crewed:
+            rows = session.execute(
+                select(event_personnel.c.personnel_id, Event.id, Event.date, Event.start_time, Event.end_time)
+                .join(event_personnel, event_personnel.c.event_id == Event.id)
+                .where(event_personnel.c.personnel_id.in_(crewed), *in_range)
+            ).all()
+            for personnel_id, event_id, date, start_time, end_time in rows:
+                intervals.setdefault(personnel_id, []).append((*event_interval(date, start_time, end_time), event_id))
+        indexes = {personnel_id: IntervalIndex(rows) for personnel_id, rows in intervals.items()}
+
+        if organization_id is not None:
+            rows = session.execute(select(Event.id, Event.date, Event.start_time, Event.end_time).where(*in_range)).all()
+            organization_index = IntervalIndex(
+                [(*event_interval(date, start_time, end_time), event_id) for event_id, date, start_time, end_time in rows]
+            )
+
+    results = []
+    for (serial, captured_at, _), photographer_id in zip(parsed, photographers):
+        result = {'eventId': None, 'photographerId': str(photographer_id) if photographer_id is not None else None,
+                  'matchedBy': None}
+        results.append(result)
+        if captured_at is None:
+            result['reason'] = 'no capture time'
+            continue
+        instant = _seconds(captured_at)
+
+        index = indexes.get(photographer_id)
+        found = index.candidates(instant, slack) if index is not None else []
+        if found:
+            result['eventId'], result['matchedBy'] = str(found[0][3]), 'photographer'
+            continue
+
+        if organization_index is not None:
+            found = organization_index.candidates(instant, slack)
+            # Only an unambiguous fit: one event, or one that contains the time while the others are only near it
+            if len(found) == 1 or (len(found) > 1 and found[0][0] == 0 and found[1][0] == 1):
+                result['eventId'], result['matchedBy'] = str(found[0][3]), 'organization'
+                continue
+            if len(found) > 1:
+                result['reason'] = 'several events at that time'
+                continue
+
+        if photographer_id is None:
+            result['reason'] = 'unknown camera' if serial is not None else 'no camera serial or photographer'
+        else:
+            result['reason'] = 'no event at that time'
+    return results
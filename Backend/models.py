@@ -1,9 +1,10 @@
 
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import Column, Integer, String, Boolean, Float, Date, JSON, ForeignKey, Table, create_engine
+from sqlalchemy import BigInteger, Column, Integer, String, Boolean, Float, Date, DateTime, JSON, ForeignKey, Index, Table, bindparam, create_engine, false, inspect, select, text, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy_serializer import SerializerMixin
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import relationship, sessionmaker, validates
 from datetime import datetime
 import os
 
@@ -14,7 +15,9 @@ database_url = os.environ.get('DATABASE_URL', 'sqlite:///hive.db')
 # Association tables for many-to-many relationships
 event_personnel = Table('event_personnel', Base.metadata,
     Column('event_id', Integer, ForeignKey('events.id'), primary_key=True),
-    Column('personnel_id', Integer, ForeignKey('personnel.id'), primary_key=True)
+    Column('personnel_id', Integer, ForeignKey('personnel.id'), primary_key=True),
+    # The primary key only covers lookups by event; shot matching (matching.py) goes by photographer
+    Index('ix_event_personnel_personnel_id', 'personnel_id', 'event_id')
 )
 
 event_users = Table('event_users', Base.metadata,
@@ -49,6 +52,14 @@ class Event(Base, SerializerMixin):
     is_covered = Column(Boolean, default=False)
     deadline = Column(String)
     process_point = Column(String)
+    deleted_at = Column(DateTime, nullable=True, index=True)  # Set by soft delete (see soft_delete.py)
+    version = Column(Integer, nullable=False, default=1, server_default=text('1'))  # Optimistic concurrency (see patching.py)
+
+    __mapper_args__ = {'version_id_col': version}
+    __table_args__ = (
+        # Backs matching shots against an organization's events by date (see matching.py)
+        Index('ix_events_organization_date', 'organization_id', 'date'),
+    )
     
     # Many-to-many relationships
     personnel = relationship('Personnel', secondary=event_personnel, back_populates='events')
@@ -63,6 +74,36 @@ class Event(Base, SerializerMixin):
     # Many-to-one relationship with organization
     organization = relationship('Organization')
 
+# Role flag bits stored in Role.flags
+ROLE_FLAG_PHOTOGRAPHER = 1
+
+class Role(Base, SerializerMixin):
+    __tablename__ = 'roles'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    slug = Column(String(100), nullable=False, unique=True)  # Normalized name used for lookups
+    flags = Column(Integer, nullable=False, default=0, server_default=text('0'))  # Bitmask of ROLE_FLAG_* values
+
+    personnel = relationship('Personnel', back_populates='role_ref')
+
+    @staticmethod
+    def slugify(name):
+        """Normalize a free-text role name ("  Lead  Photographer" -> "lead photographer")"""
+        return ' '.join(name.lower().split())
+
+    @staticmethod
+    def flags_for(name):
+        """Derive role flags from a free-text role name"""
+        flags = 0
+        if 'photographer' in name.lower():
+            flags |= ROLE_FLAG_PHOTOGRAPHER
+        return flags
+
+    @property
+    def is_photographer(self):
+        return bool(self.flags & ROLE_FLAG_PHOTOGRAPHER)
+
 class Personnel(Base, SerializerMixin):
     __tablename__ = 'personnel'
 
@@ -71,6 +112,11 @@ class Personnel(Base, SerializerMixin):
     role = Column(String, nullable=False)
     phone = Column(String, nullable=False)
     email = Column(String, nullable=False)
+    role_id = Column(Integer, ForeignKey('roles.id'), nullable=True, index=True)
+    # Denormalized from Role.flags so photographer checks are an indexed equality match
+    has_photographer_role = Column(Boolean, nullable=False, default=False, server_default=false(), index=True)
+
+    role_ref = relationship('Role', back_populates='personnel')
 
     # Many-to-many relationships
     events = relationship('Event', secondary=event_personnel, back_populates='personnel')
@@ -81,7 +127,14 @@ class Personnel(Base, SerializerMixin):
     
     def is_photographer(self):
         """Check if this personnel member has a photographer role"""
-        return 'photographer' in self.role.lower()
+        return bool(self.has_photographer_role)
+
+    def set_role(self, session, role_name):
+        """Set the free-text role and link it to its normalized Role row"""
+        role = get_or_create_role(session, role_name)
+        self.role = role_name
+        self.role_ref = role
+        self.has_photographer_role = role.is_photographer
 
 class User(Base, SerializerMixin):
     __tablename__='users'
@@ -114,6 +167,22 @@ class Shot(Base, SerializerMixin):
     camera = Column(String, nullable=False)
     filename = Column(String, nullable=False)
     photographer = Column(String)
+    deleted_at = Column(DateTime, nullable=True, index=True)  # Set by soft delete (see soft_delete.py)
+
+    # From the image's EXIF (see exif.py) or the client; captured_at is the camera's local time
+    captured_at = Column(DateTime, nullable=True)
+    camera_serial = Column(String(64), nullable=True, index=True)
+    lens = Column(String(128), nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    metadata_read_at = Column(DateTime, nullable=True)  # When the image file was last read, found or not
+
+    # Last checksum verification of the ingest copies (see checksums.py); checksum is only stored when they agreed
+    checksum = Column(String(128), nullable=True)
+    checksum_algorithm = Column(String(16), nullable=True)
+    size_bytes = Column(BigInteger, nullable=True)
+    checksum_result = Column(String(16), nullable=True)
+    checksum_verified_at = Column(DateTime, nullable=True)
     
     # Foreign keys
     event_id = Column(Integer, ForeignKey('events.id'), nullable=False)
@@ -123,6 +192,37 @@ class Shot(Base, SerializerMixin):
     event = relationship('Event', back_populates='shots')
     photographer = relationship('Personnel', back_populates='shots')
 
+    __table_args__ = (
+        # Re-uploading a file dedupes at the database; soft-deleted shots don't count
+        Index('uq_shots_event_filename_camera', 'event_id', 'filename', 'camera', unique=True,
+              sqlite_where=text('deleted_at IS NULL'), postgresql_where=text('deleted_at IS NULL')),
+        # Backs GET /events/<id>/shots?from=&to=: one index range per event, already in capture order
+        Index('ix_shots_event_captured_at', 'event_id', 'captured_at'),
+    )
+
+# deadline_sort of requests without a readable deadline, so they sort last
+NO_DEADLINE = datetime(9999, 12, 31)
+
+def parse_deadline(value):
+    """Deadlines are free-text ISO dates or datetimes; anything else counts as no deadline.
+
+    A deadline with an offset is converted to naive local time, so every
+    deadline compares with every other and with datetime.now().
+    """
+    if not value:
+        return None
+    try:
+        deadline = datetime.fromisoformat(value.strip())
+    except (AttributeError, ValueError):
+        return None
+    if deadline.tzinfo is not None:
+        deadline = deadline.astimezone().replace(tzinfo=None)
+    return deadline
+
+def deadline_sort(value):
+    """Shot_Request.deadline_sort for a deadline"""
+    return parse_deadline(value) or NO_DEADLINE
+
 class Shot_Request(Base, SerializerMixin):
     __tablename__='shot_requests'
 
@@ -133,13 +233,26 @@ class Shot_Request(Base, SerializerMixin):
     stakeholder = Column(String)
     quick_turn = Column(Boolean, nullable=False)
     deadline = Column(String)
+    deadline_sort = Column(DateTime)  # parse_deadline(deadline) or NO_DEADLINE; Core writers of deadline set it too
     key_sponsor = Column(String)
     status = Column(String)
     process_point = Column(String, default='idle')
     event_id = Column(Integer, ForeignKey('events.id'), nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default=text('1'))  # Optimistic concurrency (see patching.py)
+
+    __mapper_args__ = {'version_id_col': version}
+    __table_args__ = (
+        # Backs the shot request board: each column is one index range per event, already in board order
+        Index('ix_shot_requests_board', 'event_id', 'process_point', 'deadline_sort', text('quick_turn DESC'), 'id'),
+    )
 
     event = relationship('Event', back_populates='shot_requests')
 
+    @validates('deadline')
+    def _set_deadline_sort(self, key, value):
+        self.deadline_sort = deadline_sort(value)
+        return value
+
 
 class Organization(Base, SerializerMixin):
     __tablename__ = 'organizations'
@@ -166,6 +279,9 @@ class Project(Base, SerializerMixin):
     start_date = Column(Date, nullable=True)
     end_date = Column(Date, nullable=True)
     location = Column(String(255), nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default=text('1'))  # Optimistic concurrency (see patching.py)
+
+    __mapper_args__ = {'version_id_col': version}
     
     # Many-to-one relationship with organization
     organization = relationship('Organization', back_populates='projects')
@@ -174,13 +290,155 @@ class Project(Base, SerializerMixin):
     # Many-to-many relationship with key personnel (with role)
     key_personnel = relationship('Personnel', secondary=project_key_personnel, back_populates='projects')
 
+class StatsCounter(Base):
+    """Incrementally maintained dashboard counter (see stats.py)"""
+    __tablename__ = 'stats_counters'
+
+    scope = Column(String(20), primary_key=True)  # 'organization', 'project' or 'event'
+    scope_id = Column(Integer, primary_key=True)
+    metric = Column(String(100), primary_key=True)  # e.g. 'shots', 'shotRequests.idle'
+    value = Column(Integer, nullable=False, default=0)
+
+class OutboxEntry(Base):
+    """A change waiting to be mirrored to Firestore (see outbox.py)"""
+    __tablename__ = 'outbox'
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String(50), nullable=False)  # Source table: 'events', 'shot_requests' or 'projects'
+    entity_id = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+    attempts = Column(Integer, nullable=False, default=0, server_default=text('0'))
+    available_at = Column(DateTime, nullable=True, index=True)  # Not retried before this; NULL means now
+    last_error = Column(String, nullable=True)
+    locked_by = Column(String(100), nullable=True)  # Relay mirroring the entry
+    locked_at = Column(DateTime, nullable=True)  # A claim older than the lease is taken over
+
+class Job(Base):
+    """A durable background job (see jobs.py)"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        # Workers claim the most urgent queued job: WHERE status = 'queued' ORDER BY priority DESC, created_at
+        Index('ix_jobs_claim', 'status', 'priority', 'created_at'),
+    )
+
+    id = Column(String(32), primary_key=True)
+    kind = Column(String(50), nullable=False)  # Handler name, e.g. 'delete-organization'
+    target = Column(JSON, nullable=True)  # Arguments for the handler
+    status = Column(String(20), nullable=False, default='queued')  # queued, running, succeeded or failed
+    priority = Column(Integer, nullable=False, default=0)  # Higher runs first
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    available_at = Column(DateTime, nullable=True)  # Not started before this (retry backoff); NULL means now
+    locked_by = Column(String(100), nullable=True)  # Worker running the job
+    locked_at = Column(DateTime, nullable=True)  # Refreshed by progress reports; a stale lock is taken over
+    done = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+# ==================== ROLE HELPERS ====================
+
+def get_or_create_role(session, role_name):
+    """Look up the Role for a free-text role name, creating it if needed"""
+    slug = Role.slugify(role_name)
+    role = session.query(Role).filter_by(slug=slug).first()
+    if not role:
+        role = Role(name=' '.join(role_name.split()), slug=slug, flags=Role.flags_for(role_name))
+        session.add(role)
+        session.flush()
+    return role
+
+def backfill_roles(session):
+    """Link personnel that only have a free-text role to a Role row"""
+    role_names = [row[0] for row in session.query(Personnel.role).filter(Personnel.role_id.is_(None)).distinct()]
+    for role_name in role_names:
+        role = get_or_create_role(session, role_name)
+        session.query(Personnel).filter(
+            Personnel.role_id.is_(None), Personnel.role == role_name
+        ).update({
+            Personnel.role_id: role.id,
+            Personnel.has_photographer_role: role.is_photographer
+        }, synchronize_session=False)
+    return len(role_names)
+
+def backfill_deadline_sort(session):
+    """Fill Shot_Request.deadline_sort on rows written before it existed"""
+    table = Shot_Request.__table__
+    rows = session.execute(select(table.c.id, table.c.deadline).where(table.c.deadline_sort.is_(None))).all()
+    if rows:
+        session.execute(
+            update(table).where(table.c.id == bindparam('row_id')).values(deadline_sort=bindparam('sort')),
+            [{'row_id': row.id, 'sort': deadline_sort(row.deadline)} for row in rows]
+        )
+    return len(rows)
 
 # ==================== DATABASE CREATION AND SEEDING ====================
 
-def create_database():
+def add_missing_columns(engine):
+    """Add columns and indexes declared on the models but missing from existing tables.
+
+    create_all() only creates missing tables, so databases created by an older
+    version of the models need their new columns added here.
+    """
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}'
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    # Expressions such as false() compile per dialect (0 on SQLite, false on PostgreSQL)
+                    ddl += f" DEFAULT {repr(default) if isinstance(default, str) else default.compile(dialect=conn.dialect)}"
+                    if not column.nullable:
+                        ddl += ' NOT NULL'
+                for foreign_key in column.foreign_keys:
+                    ddl += f' REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})'
+                conn.execute(text(ddl))
+
+            for index in table.indexes:
+                try:
+                    # In a savepoint, so a failed unique index doesn't abort the migration
+                    with conn.begin_nested():
+                        index.create(conn, checkfirst=True)
+                except IntegrityError:
+                    print(f"Skipped unique index {index.name}: existing {table.name} rows have duplicates. "
+                          "Remove them and restart to add it.")
+
+# Indexes older versions of the models created that have since been replaced
+DROPPED_INDEXES = ('ix_shot_requests_event_process_point_deadline',)
+
+def migrate_database(engine):
+    """Bring an existing database up to date with the current models"""
+    add_missing_columns(engine)
+    with engine.begin() as conn:
+        for name in DROPPED_INDEXES:
+            conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    try:
+        backfill_roles(session)
+        backfill_deadline_sort(session)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def create_database(engine=None):
     """Create the database and all tables"""
-    engine = create_engine(database_url)
+    engine = engine or create_engine(database_url)
     Base.metadata.create_all(engine)
+    migrate_database(engine)
     print("Database and tables created successfully!")
 
 def seed_database():
@@ -0,0 +1,369 @@
+"""
+Import and export of a whole organization's data.
+
+    # Dump organization 1 (gzip-compressed because of the .gz suffix)
+    python org_transfer.py export 1 hive-org-1.ndjson.gz
+
+    # Load it into another database as a new organization
+    DATABASE_URL=sqlite:///staging.db python org_transfer.py import hive-org-1.ndjson.gz --signup-code STAGE2024
+
+The dump is NDJSON. The first line is a header:
+
+    {"format": "hive-organization", "version": 1, "organizationId": 1, "exportedAt": "..."}
+
+Every following line is a columnar chunk of up to CHUNK_SIZE rows from one table:
+
+    {"table": "events", "columns": ["id", "name", ...], "rows": [[1, "Gala", ...], ...]}
+
+Tables are written parents first (see TABLES), so a dump can be loaded in a
+single pass. Users are not exported because they carry password hashes.
+
+Loading uses Core executemany inserts inside one transaction; on PostgreSQL
+the leaf tables (shots, shot requests, assignments) are loaded with COPY.
+Every row gets a fresh primary key from the target database and foreign keys
+are rewritten through the old -> new id maps, so a dump can be loaded next to
+existing data or loaded twice. Roles are matched by slug instead of being
+duplicated.
+"""
+
+import argparse
+import gzip
+import json
+import sys
+from datetime import date, datetime
+from sqlalchemy import Date, DateTime, insert, select, text, union
+from sqlalchemy.orm import Session as OrmSession
+from models import Event, Organization, Personnel, Project, Role, Shot, Shot_Request, deadline_sort, event_personnel, project_key_personnel
+import dialects
+import outbox
+import scheduler
+import stats
+
+FORMAT = 'hive-organization'
+VERSION = 1
+CHUNK_SIZE = 5000
+
+# Export/import order: every table comes after the tables it references
+TABLES = [
+    Role.__table__,
+    Organization.__table__,
+    Personnel.__table__,
+    Project.__table__,
+    project_key_personnel,
+    Event.__table__,
+    event_personnel,
+    Shot.__table__,
+    Shot_Request.__table__,
+]
+TABLES_BY_NAME = {table.name: table for table in TABLES}
+
+# Tables no other exported table points at: their new ids never need to be read back
+LEAF_TABLES = {table.name for table in TABLES} - {
+    foreign_key.column.table.name for table in TABLES for foreign_key in table.foreign_keys
+}
+
+
+class TransferError(ValueError):
+    """Raised for malformed dumps and for imports that would clash with existing data"""
+
+
+def _org_queries(organization_id):
+    """SELECT for each exported table, restricted to one organization's graph"""
+    # Soft-deleted events and shots are left out
+    org_events = select(Event.id).where(Event.organization_id == organization_id, Event.deleted_at.is_(None))
+    org_projects = select(Project.id).where(Project.organization_id == organization_id)
+    # Personnel don't belong to an organization directly; export everyone the organization uses
+    org_personnel = union(
+        select(event_personnel.c.personnel_id).where(event_personnel.c.event_id.in_(org_events)),
+        select(project_key_personnel.c.personnel_id).where(project_key_personnel.c.project_id.in_(org_projects)),
+        select(Shot.photographer_id).where(Shot.event_id.in_(org_events), Shot.deleted_at.is_(None))
+    )
+    personnel = Personnel.__table__
+    return {
+        'roles': select(Role.__table__).where(
+            Role.id.in_(select(personnel.c.role_id).where(personnel.c.id.in_(org_personnel)))),
+        'organizations': select(Organization.__table__).where(Organization.id == organization_id),
+        'personnel': select(personnel).where(personnel.c.id.in_(org_personnel)),
+        'projects': select(Project.__table__).where(Project.organization_id == organization_id),
+        'project_key_personnel': select(project_key_personnel).where(
+            project_key_personnel.c.project_id.in_(org_projects)),
+        'events': select(Event.__table__).where(Event.id.in_(org_events)),
+        'event_personnel': select(event_personnel).where(event_personnel.c.event_id.in_(org_events)),
+        'shots': select(Shot.__table__).where(Shot.event_id.in_(org_events), Shot.deleted_at.is_(None)),
+        'shot_requests': select(Shot_Request.__table__).where(Shot_Request.event_id.in_(org_events)),
+    }
+
+
+def _json_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def export_organization(session, organization_id):
+    """Yield the NDJSON lines of an organization dump.
+
+    Rows are streamed from the database in CHUNK_SIZE partitions, so memory use
+    doesn't grow with the size of the organization.
+    """
+    if session.get(Organization, organization_id) is None:
+        raise TransferError(f'Organization {organization_id} not found')
+
+    yield json.dumps({
+        'format': FORMAT,
+        'version': VERSION,
+        'organizationId': organization_id,
+        'exportedAt': datetime.now().isoformat()
+    }) + '\n'
+
+    queries = _org_queries(organization_id)
+    for table in TABLES:
+        columns = [column.name for column in table.columns]
+        result = session.execute(queries[table.name].execution_options(yield_per=CHUNK_SIZE))
+        for partition in result.partitions():
+            yield json.dumps({
+                'table': table.name,
+                'columns': columns,
+                'rows': [[_json_value(value) for value in row] for row in partition]
+            }, separators=(',', ':')) + '\n'
+
+
+class _Importer:
+    def __init__(self, session, signup_code=None):
+        self.session = session
+        self.connection = session.connection()
+        self.signup_code = signup_code
+        self.id_maps = {table.name: {} for table in TABLES}
+        self.counts = {table.name: 0 for table in TABLES}
+        self.organization_id = None
+        # Only load columns the target schema has, so dumps from older/newer versions still load
+        self.date_columns = {
+            table.name: {column.name for column in table.columns if isinstance(column.type, Date)}
+            for table in TABLES
+        }
+        self.datetime_columns = {
+            table.name: {column.name for column in table.columns if isinstance(column.type, DateTime)}
+            for table in TABLES
+        }
+
+    def _remap(self, table, row):
+        for column in table.columns:
+            if column.name not in row or row[column.name] is None:
+                continue
+            for foreign_key in column.foreign_keys:
+                target = foreign_key.column.table.name
+                new_id = self.id_maps.get(target, {}).get(row[column.name])
+                if new_id is None:
+                    if not column.nullable or column.primary_key:
+                        raise TransferError(
+                            f'{table.name}.{column.name} references {target} {row[column.name]}, which is not in the dump'
+                        )
+                row[column.name] = new_id
+
+    def _prepare_roles(self, rows):
+        """Map roles onto existing rows with the same slug; only unknown roles are inserted"""
+        if any(not isinstance(row.get('slug'), str) for row in rows):
+            raise TransferError('Every role in a dump needs a slug')
+        slugs = [row['slug'] for row in rows]
+        existing = dict(self.connection.execute(
+            select(Role.slug, Role.id).where(Role.slug.in_(slugs))
+        ).all())
+        new_rows = []
+        for row in rows:
+            if row['slug'] in existing:
+                self.id_maps['roles'][row['id']] = existing[row['slug']]
+            else:
+                new_rows.append(row)
+        return new_rows
+
+    def _prepare_organization(self, rows):
+        if len(rows) != 1 or self.organization_id is not None:
+            raise TransferError('A dump must contain exactly one organization')
+        row = rows[0]
+        if self.signup_code:
+            row['signup_code'] = self.signup_code
+        if not row.get('signup_code'):
+            raise TransferError('The organization in the dump has no signup code; import with one')
+        taken = self.connection.execute(
+            select(Organization.id).where(Organization.signup_code == row['signup_code'])
+        ).first()
+        if taken is not None:
+            raise TransferError(
+                f'Signup code {row["signup_code"]} is already used by organization {taken[0]}; '
+                'import with a different signup code'
+            )
+        return rows
+
+    def _parse_rows(self, table, chunk, line_number):
+        """The chunk's rows as dicts of the table's known columns, with dates parsed"""
+        columns, values_list = chunk.get('columns'), chunk.get('rows')
+        if not isinstance(columns, list) or not all(isinstance(name, str) for name in columns):
+            raise TransferError(f'Line {line_number}: "columns" must be a list of column names')
+        if not isinstance(values_list, list):
+            raise TransferError(f'Line {line_number}: "rows" must be a list')
+        if 'id' in table.c and 'id' not in columns:
+            raise TransferError(f'Line {line_number}: {table.name} rows need an id column')
+
+        known = [name for name in columns if name in table.c]
+        # Ids and foreign keys are looked up in the id maps, so they have to be integers
+        key_columns = [name for name in known if table.c[name].primary_key or table.c[name].foreign_keys]
+        positions = [columns.index(name) for name in known]
+        date_columns = self.date_columns[table.name]
+        datetime_columns = self.datetime_columns[table.name]
+        rows = []
+        for values in values_list:
+            if not isinstance(values, list) or len(values) != len(columns):
+                raise TransferError(f'Line {line_number}: each row must be a list of {len(columns)} values')
+            row = {name: values[position] for name, position in zip(known, positions)}
+            for name in key_columns:
+                if row[name] is not None and (not isinstance(row[name], int) or isinstance(row[name], bool)):
+                    raise TransferError(f'Line {line_number}: {table.name}.{name} must be an integer, not {row[name]!r}')
+            try:
+                for name in date_columns:
+                    if row.get(name) is not None:
+                        row[name] = date.fromisoformat(row[name][:10])
+                for name in datetime_columns:
+                    if row.get(name) is not None:
+                        row[name] = datetime.fromisoformat(row[name])
+            except (TypeError, ValueError) as e:
+                raise TransferError(f'Line {line_number}: invalid date in {table.name}.{name}: {e}')
+            rows.append(row)
+        return rows
+
+    def load_chunk(self, chunk, line_number):
+        if not isinstance(chunk, dict):
+            raise TransferError(f'Line {line_number}: expected a JSON object')
+        table = TABLES_BY_NAME.get(chunk.get('table'))
+        if table is None:
+            raise TransferError(f'Unknown table in dump: {chunk.get("table")}')
+
+        rows = self._parse_rows(table, chunk, line_number)
+
+        if table.name == 'roles':
+            rows = self._prepare_roles(rows)
+        elif table.name == 'organizations':
+            rows = self._prepare_organization(rows)
+        elif table.name == 'shot_requests':
+            # Dumps from before deadline_sort existed don't carry it; COPY skips model hooks
+            for row in rows:
+                row['deadline_sort'] = deadline_sort(row.get('deadline'))
+
+        for row in rows:
+            self._remap(table, row)
+
+        if not rows:
+            return
+
+        if table.name in LEAF_TABLES:
+            # The bulk of a dump (shots, shot requests, assignments); COPY on PostgreSQL
+            for row in rows:
+                row.pop('id', None)
+            dialects.copy_rows(self.connection, table, rows)
+        elif 'id' in table.c:
+            # The target database assigns ids; RETURNING hands them back in input order
+            old_ids = [row.pop('id') for row in rows]
+            stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+            new_ids = self.connection.execute(stmt, rows).scalars().all()
+            self.id_maps[table.name].update(zip(old_ids, new_ids))
+            if table.name == 'organizations':
+                self.organization_id = new_ids[0]
+        else:
+            self.connection.execute(insert(table), rows)
+        self.counts[table.name] += len(rows)
+
+    def finish(self):
+        if self.organization_id is None:
+            raise TransferError('The dump contains no organization')
+        stats.rebuild_stats(self.session, organization_id=self.organization_id)
+        scheduler.touch(self.session, event_ids=self.id_maps['events'].values())
+        outbox.record(self.session, 'events', self.id_maps['events'].values())
+        outbox.record(self.session, 'projects', self.id_maps['projects'].values())
+        # Shot request ids aren't read back (see LEAF_TABLES)
+        outbox.record_select(self.session, 'shot_requests',
+                             select(Shot_Request.id).where(Shot_Request.event_id.in_(self.id_maps['events'].values())))
+
+
+def import_organization(session, lines, signup_code=None):
+    """Load an organization dump (an iterable of NDJSON lines) as a new organization.
+
+    Everything is written on the session's connection; the caller commits or
+    rolls back. Returns (new organization id, {table: rows inserted}).
+    """
+    lines = iter(lines)
+    try:
+        header = json.loads(next(lines))
+    except StopIteration:
+        raise TransferError('The dump is empty')
+    except ValueError as e:
+        # JSONDecodeError, or UnicodeDecodeError for a line that isn't UTF-8
+        raise TransferError(f'Invalid dump header: {e}')
+    if not isinstance(header, dict) or header.get('format') != FORMAT:
+        raise TransferError(f'Not a {FORMAT} dump')
+    if header.get('version') != VERSION:
+        raise TransferError(f'Unsupported dump version {header.get("version")} (expected {VERSION})')
+
+    importer = _Importer(session, signup_code=signup_code)
+    if importer.connection.dialect.name == 'sqlite':
+        # Check foreign keys once at commit instead of row by row
+        importer.connection.execute(text('PRAGMA defer_foreign_keys = ON'))
+
+    for line_number, line in enumerate(lines, start=2):
+        if not line.strip():
+            continue
+        try:
+            chunk = json.loads(line)
+        except ValueError as e:
+            raise TransferError(f'Invalid JSON on line {line_number}: {e}')
+        importer.load_chunk(chunk, line_number)
+
+    importer.finish()
+    return importer.organization_id, importer.counts
+
+
+def _open(path, mode):
+    if path == '-':
+        return sys.stdout if 'w' in mode else sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def main():
+    from sqlalchemy import create_engine
+    from models import Base, database_url, migrate_database
+
+    parser = argparse.ArgumentParser(description='Import or export a Hive organization')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export', help='write an organization dump')
+    export_parser.add_argument('organization_id', type=int)
+    export_parser.add_argument('path', help='output file (.gz to compress, - for stdout)')
+    import_parser = subparsers.add_parser('import', help='load a dump as a new organization')
+    import_parser.add_argument('path', help='dump file (.gz if compressed, - for stdin)')
+    import_parser.add_argument('--signup-code', help='signup code for the imported organization')
+    parser.add_argument('--database-url', default=database_url)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    session = OrmSession(bind=engine)
+    try:
+        if args.command == 'export':
+            with _open(args.path, 'w') as f:
+                for line in export_organization(session, args.organization_id):
+                    f.write(line)
+        else:
+            Base.metadata.create_all(engine)
+            migrate_database(engine)
+            with _open(args.path, 'r') as f:
+                organization_id, counts = import_organization(session, f, signup_code=args.signup_code)
+            session.commit()
+            print(f'Imported organization {organization_id}: '
+                  + ', '.join(f'{count} {table}' for table, count in counts.items()), file=sys.stderr)
+    except TransferError as e:
+        session.rollback()
+        sys.exit(f'Error: {e}')
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    main()
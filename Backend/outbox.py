@@ -0,0 +1,335 @@
+"""
+Firestore mirror fed by a transactional outbox.
+
+With HIVE_FIRESTORE_MIRROR=1, every change to an event, shot request or project
+also inserts an outbox row (entity, entity_id) in the same transaction. So a
+change is queued for mirroring exactly when it commits, and API requests never
+wait on Firestore. ORM changes are picked up by a flush hook. Code that
+changes those tables with Core SQL calls record() or record_select().
+
+A relay thread drains the outbox. It claims up to HIVE_OUTBOX_BATCH_SIZE entries
+(at most 500, Firestore's batch limit), collapses repeated entries for the same
+row, reads the rows' current state and writes them in one Firestore batch:
+set() for live rows, delete() for rows that are gone or soft-deleted. Entries
+are removed once the batch commits. When it fails, they are retried with
+exponential backoff up to HIVE_OUTBOX_MAX_BACKOFF_SECONDS.
+
+Several relays (one per app process) can drain the same outbox. A claim sets
+locked_by/locked_at in one UPDATE ... RETURNING, and skips entries for any row
+another relay has claimed, so only one relay at a time writes a given row and
+an older snapshot can't land after a newer one. On PostgreSQL claims take a
+transaction-level advisory lock, since concurrent claims can't see each other's
+uncommitted rows. A claim older than HIVE_OUTBOX_LEASE_SECONDS (a relay that
+died mid-batch) is taken over.
+
+Documents live in collections named after the tables (events, shot_requests,
+projects), keyed by id, with the row's columns as fields.
+
+    # Drain the outbox once into an in-memory fake (or the emulator via FIRESTORE_EMULATOR_HOST)
+    python outbox.py --fake
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from sqlalchemy import and_, delete, event, exists, func, insert, literal, or_, select, update
+from sqlalchemy.orm import Session as OrmSession, aliased
+from models import Event, OutboxEntry, Project, Shot_Request
+import dialects
+import soft_delete
+
+logger = logging.getLogger('hive.outbox')
+
+MIRROR_ENABLED = os.environ.get('HIVE_FIRESTORE_MIRROR', '').lower() in ('1', 'true', 'yes')
+OUTBOX_BATCH_SIZE = min(int(os.environ.get('HIVE_OUTBOX_BATCH_SIZE', '500')), 500)
+OUTBOX_POLL_SECONDS = float(os.environ.get('HIVE_OUTBOX_POLL_SECONDS', '1'))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.environ.get('HIVE_OUTBOX_MAX_BACKOFF_SECONDS', '300'))
+OUTBOX_LEASE_SECONDS = float(os.environ.get('HIVE_OUTBOX_LEASE_SECONDS', '60'))
+
+BASE_BACKOFF_SECONDS = 1
+
+# pg_advisory_xact_lock key that serializes outbox claims on PostgreSQL
+CLAIM_LOCK_KEY = 0x68697665
+
+# Mirrored tables -> models
+MODELS = {model.__tablename__: model for model in (Event, Shot_Request, Project)}
+
+
+def mirror_enabled():
+    return MIRROR_ENABLED
+
+
+def record(session, entity, entity_ids):
+    """Queue rows of a mirrored table, in the session's transaction"""
+    if not MIRROR_ENABLED:
+        return
+    rows = [{'entity': entity, 'entity_id': entity_id} for entity_id in set(entity_ids)]
+    if rows:
+        session.connection().execute(insert(OutboxEntry), rows)
+
+
+def record_select(session, entity, id_select):
+    """Queue every row id_select (a SELECT of ids) returns, without loading them"""
+    if not MIRROR_ENABLED:
+        return
+    subquery = id_select.subquery()
+    session.connection().execute(
+        insert(OutboxEntry).from_select(
+            ['entity', 'entity_id', 'created_at', 'attempts'],
+            select(literal(entity), subquery.c[0], literal(datetime.now()), literal(0))
+        )
+    )
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def _record_flushed(session, flush_context):
+    if not MIRROR_ENABLED:
+        return
+    ids = {entity: set() for entity in MODELS}
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        entity = getattr(obj, '__tablename__', None)
+        if entity in ids and obj.id is not None:
+            ids[entity].add(obj.id)
+    for entity, entity_ids in ids.items():
+        record(session, entity, entity_ids)
+
+
+def _document(row):
+    return {key: value.isoformat() if isinstance(value, (date, datetime)) else value
+            for key, value in row._mapping.items()}
+
+
+def backoff_seconds(attempts):
+    """Exponential backoff with jitter: ~1s, 2s, 4s, ... capped at OUTBOX_MAX_BACKOFF_SECONDS"""
+    delay = min(OUTBOX_MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class Relay:
+    def __init__(self, session_factory, client, batch_size=OUTBOX_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.client = client
+        self.batch_size = batch_size
+        self.relay_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    def _load(self, connection, entity, ids):
+        """Current state of the given rows; ids missing from the result are to be deleted"""
+        model = MODELS[entity]
+        rows = connection.execute(
+            select(model.__table__).where(model.id.in_(ids), soft_delete.visible(model))
+        )
+        return {row.id: _document(row) for row in rows}
+
+    def claim(self):
+        """Lock up to batch_size due entries for this relay; returns them, oldest first"""
+        now = datetime.now()
+        stale = now - timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        other = aliased(OutboxEntry)
+        claimable = and_(
+            or_(OutboxEntry.available_at.is_(None), OutboxEntry.available_at <= now),
+            or_(OutboxEntry.locked_by.is_(None), OutboxEntry.locked_at < stale),
+            # A row another relay is still writing waits for it, so its older snapshot can't land last
+            ~exists().where(
+                other.entity == OutboxEntry.entity, other.entity_id == OutboxEntry.entity_id,
+                other.locked_by.is_not(None), other.locked_by != self.relay_id, other.locked_at >= stale
+            )
+        )
+        due = (
+            select(OutboxEntry.id).where(claimable)
+            .order_by(OutboxEntry.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        session = self.session_factory()
+        try:
+            connection = session.connection()
+            if dialects.is_postgresql(connection):
+                connection.execute(select(func.pg_advisory_xact_lock(CLAIM_LOCK_KEY)))
+            entries = connection.execute(
+                update(OutboxEntry).where(OutboxEntry.id.in_(due.scalar_subquery()), claimable)
+                .values(locked_by=self.relay_id, locked_at=now)
+                .returning(OutboxEntry.id, OutboxEntry.entity, OutboxEntry.entity_id, OutboxEntry.attempts)
+            ).all()
+            session.commit()
+            return sorted(entries, key=lambda entry: entry.id)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def run_batch(self):
+        """Mirror one batch; returns the number of outbox entries handled (0 when there is nothing due)"""
+        entries = self.claim()
+        if not entries:
+            return 0
+
+        session = self.session_factory()
+        try:
+            connection = session.connection()
+
+            # Several changes to one row need only one write of its latest state
+            wanted = {}
+            for entry in entries:
+                wanted.setdefault(entry.entity, set()).add(entry.entity_id)
+
+            batch = self.client.batch()
+            for entity, ids in wanted.items():
+                documents = self._load(connection, entity, ids)
+                collection = self.client.collection(entity)
+                for entity_id in sorted(ids):
+                    reference = collection.document(str(entity_id))
+                    if entity_id in documents:
+                        batch.set(reference, documents[entity_id])
+                    else:
+                        batch.delete(reference)
+            # Don't hold the snapshot's transaction open across the Firestore round trip
+            session.commit()
+
+            entry_ids = [entry.id for entry in entries]
+            mine = and_(OutboxEntry.id.in_(entry_ids), OutboxEntry.locked_by == self.relay_id)
+            try:
+                batch.commit()
+            except Exception as e:
+                attempts = max(entry.attempts for entry in entries) + 1
+                logger.warning('Firestore batch of %d entries failed (attempt %d): %s', len(entries), attempts, e)
+                connection = session.connection()
+                connection.execute(
+                    update(OutboxEntry).where(mine).values(
+                        attempts=OutboxEntry.attempts + 1,
+                        available_at=datetime.now() + timedelta(seconds=backoff_seconds(attempts)),
+                        last_error=str(e)[:1000],
+                        locked_by=None,
+                        locked_at=None
+                    )
+                )
+                session.commit()
+                return 0
+
+            session.connection().execute(delete(OutboxEntry).where(mine))
+            session.commit()
+            return len(entries)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def run(self):
+        """Mirror batches until nothing is due; returns the number of entries handled"""
+        total = 0
+        while True:
+            handled = self.run_batch()
+            if not handled:
+                return total
+            total += handled
+
+
+def _worker(relay):
+    while True:
+        try:
+            relay.run()
+        except Exception:
+            logger.exception('Outbox relay failed')
+        time.sleep(OUTBOX_POLL_SECONDS)
+
+
+def firestore_client():
+    """The Firestore client from firebase_admin_init (None if it isn't configured).
+
+    The client talks to the emulator instead when FIRESTORE_EMULATOR_HOST is set.
+    """
+    import firebase_admin_init
+    return firebase_admin_init.get_db()
+
+
+def start_worker(session_factory, client):
+    """Start the relay thread"""
+    thread = threading.Thread(target=_worker, args=(Relay(session_factory, client),), name='hive-outbox', daemon=True)
+    thread.start()
+    return thread
+
+
+class FakeFirestore:
+    """In-memory stand-in for a Firestore client: {collection: {document id: fields}}"""
+
+    def __init__(self, fail_commits=0):
+        self.collections = {}
+        self.commits = []
+        self.fail_commits = fail_commits
+
+    def collection(self, name):
+        return _FakeCollection(self, name)
+
+    def batch(self):
+        return _FakeBatch(self)
+
+
+class _FakeCollection:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def document(self, document_id):
+        return (self.name, document_id)
+
+
+class _FakeBatch:
+    def __init__(self, client):
+        self.client = client
+        self.operations = []
+
+    def set(self, reference, fields):
+        self.operations.append(('set', reference, fields))
+
+    def delete(self, reference):
+        self.operations.append(('delete', reference, None))
+
+    def commit(self):
+        if len(self.operations) > 500:
+            raise ValueError('A batch can contain at most 500 operations')
+        if self.client.fail_commits:
+            self.client.fail_commits -= 1
+            raise ConnectionError('Simulated Firestore outage')
+        for operation, (collection, document_id), fields in self.operations:
+            documents = self.client.collections.setdefault(collection, {})
+            if operation == 'set':
+                documents[document_id] = dict(fields)
+            else:
+                documents.pop(document_id, None)
+        self.client.commits.append(len(self.operations))
+
+
+def main():
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import database_url
+
+    parser = argparse.ArgumentParser(description='Drain the Firestore outbox once')
+    parser.add_argument('--fake', action='store_true', help='write to an in-memory fake instead of Firestore')
+    parser.add_argument('--database-url', default=database_url)
+    args = parser.parse_args()
+
+    if args.fake:
+        client = FakeFirestore()
+    else:
+        client = firestore_client()
+        if client is None:
+            sys.exit('Error: Firestore is not configured')
+    handled = Relay(sessionmaker(bind=create_engine(args.database_url)), client).run()
+    print(f'Mirrored {handled} outbox entries', file=sys.stderr)
+    if args.fake:
+        for name, documents in client.collections.items():
+            print(f'{name}: {len(documents)} documents', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+PATCH support with optimistic concurrency.
+
+Events, shot requests and projects carry a version column that is bumped on
+every update (the ORM does it through version_id_col). A PATCH names the
+version it was based on, in an If-Match header or a "version" field. It is
+applied as one statement:
+
+    UPDATE events SET <changed columns>, version = version + 1
+    WHERE id = ? AND version = ? RETURNING *
+
+When no row matches, the row either doesn't exist (404) or someone else
+changed it first (409 with the current version). So a lost update is
+detected without reading the row beforehand. The one exception is a change to
+a column the dashboard counters depend on (see stats.EVENT_STATS_COLUMNS).
+Then the old values of just those columns are read first, in the same
+transaction.
+"""
+
+from datetime import datetime
+from sqlalchemy import delete, select, update
+from models import Personnel, project_key_personnel
+import dialects
+import outbox
+import soft_delete
+
+
+class PatchError(ValueError):
+    """Raised for malformed PATCH bodies"""
+
+
+class PreconditionRequired(Exception):
+    """Raised when a PATCH doesn't say which version it is based on"""
+
+
+class NotFound(Exception):
+    pass
+
+
+class VersionConflict(Exception):
+    def __init__(self, current_version):
+        super().__init__(f'Version conflict: the current version is {current_version}')
+        self.current_version = current_version
+
+
+# Client errors handled by error_response()
+PATCH_ERRORS = (PatchError, PreconditionRequired, VersionConflict)
+
+
+class PatchField:
+    def __init__(self, column, parse=None):
+        """column: model attribute name; parse: optional parser for the JSON value"""
+        self.column = column
+        self.parse = parse
+
+
+def parse_date(value):
+    """YYYY-MM-DD to a date; empty values clear the date"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise PatchError(f'Invalid date: {value} (expected YYYY-MM-DD)')
+
+
+def expected_version(headers, data):
+    """The version a PATCH is based on, from If-Match or the body"""
+    value = headers.get('If-Match')
+    if value is not None:
+        value = value.strip()
+        if value.startswith('W/'):
+            value = value[2:]
+        value = value.strip('"')
+    elif 'version' in data:
+        value = data['version']
+    else:
+        raise PreconditionRequired('Send the version being updated in an If-Match header or a "version" field')
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise PatchError(f'Invalid version: {value}')
+
+
+def parse_patch(data, model, fields, extra_keys=()):
+    """Map a camelCase PATCH body to {column: value}, rejecting unknown keys"""
+    if not isinstance(data, dict):
+        raise PatchError('Request body must be a JSON object')
+
+    values = {}
+    for key, value in data.items():
+        if key in ('id', 'version') or key in extra_keys:
+            continue
+        field = fields.get(key)
+        if field is None:
+            raise PatchError(f'Unknown field: {key}. Valid fields: {", ".join(list(fields) + list(extra_keys))}')
+        value = field.parse(value) if field.parse else value
+        if value is None and not model.__table__.c[field.column].nullable:
+            raise PatchError(f'{key} cannot be null')
+        values[field.column] = value
+    return values
+
+
+def error_response(error):
+    """Response for PatchError, PreconditionRequired and VersionConflict"""
+    if isinstance(error, VersionConflict):
+        return {'error': str(error), 'currentVersion': error.current_version}, 409
+    if isinstance(error, PreconditionRequired):
+        return {'error': str(error)}, 428
+    return {'error': str(error)}, 400
+
+
+def _missing_or_conflict(connection, model, row_id):
+    current = connection.execute(
+        select(model.version).where(model.id == row_id, soft_delete.visible(model))
+    ).scalar()
+    if current is None:
+        raise NotFound()
+    raise VersionConflict(current)
+
+
+def read_old_values(session, model, row_id, version, columns):
+    """Read the current values of columns, checking the version at the same time"""
+    connection = session.connection()
+    row = connection.execute(
+        select(*(getattr(model, column) for column in columns))
+        .where(model.id == row_id, model.version == version, soft_delete.visible(model))
+    ).first()
+    if row is None:
+        _missing_or_conflict(connection, model, row_id)
+    return dict(row._mapping)
+
+
+def apply_patch(session, model, row_id, version, values):
+    """Apply values with a single version-checked UPDATE and return the updated row.
+
+    Raises NotFound or VersionConflict when no row matched. The caller commits.
+    """
+    connection = session.connection()
+    row = connection.execute(
+        update(model)
+        .where(model.id == row_id, model.version == version, soft_delete.visible(model))
+        .values(**values, version=model.version + 1)
+        .returning(*model.__table__.columns)
+    ).first()
+    if row is None:
+        _missing_or_conflict(connection, model, row_id)
+    outbox.record(session, model.__tablename__, [row_id])
+    return row
+
+
+def parse_key_personnel(items):
+    """[{personnelId, projectRole}, ...] -> {personnel_id: role}"""
+    if not isinstance(items, list):
+        raise PatchError('keyPersonnel must be a list')
+    desired = {}
+    for item in items:
+        if not isinstance(item, dict) or not item.get('personnelId'):
+            raise PatchError('Each keyPersonnel entry needs a personnelId')
+        try:
+            desired[int(item['personnelId'])] = item.get('projectRole', 'Team Member')
+        except (TypeError, ValueError):
+            raise PatchError(f'Invalid personnelId: {item["personnelId"]}')
+    return desired
+
+
+def unknown_personnel(session, personnel_ids):
+    if not personnel_ids:
+        return []
+    known = set(session.execute(select(Personnel.id).where(Personnel.id.in_(personnel_ids))).scalars())
+    return sorted(set(personnel_ids) - known)
+
+
+def sync_key_personnel(session, project_id, desired):
+    """Make a project's key personnel match {personnel_id: role} touching only the rows that differ.
+
+    Returns (added, removed, changed) personnel ids.
+    """
+    connection = session.connection()
+    current = dict(connection.execute(
+        select(project_key_personnel.c.personnel_id, project_key_personnel.c.role)
+        .where(project_key_personnel.c.project_id == project_id)
+    ).all())
+
+    removed = [personnel_id for personnel_id in current if personnel_id not in desired]
+    added = [personnel_id for personnel_id in desired if personnel_id not in current]
+    changed = [personnel_id for personnel_id in desired
+               if personnel_id in current and current[personnel_id] != desired[personnel_id]]
+
+    if removed:
+        connection.execute(delete(project_key_personnel).where(
+            project_key_personnel.c.project_id == project_id,
+            project_key_personnel.c.personnel_id.in_(removed)
+        ))
+    if added or changed:
+        # One upsert for new and changed rows; also safe against a concurrent writer adding the same row
+        stmt = dialects.insert(connection, project_key_personnel).values([
+            {'project_id': project_id, 'personnel_id': personnel_id, 'role': desired[personnel_id]}
+            for personnel_id in added + changed
+        ])
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['project_id', 'personnel_id'],
+            set_={'role': stmt.excluded.role}
+        ))
+    return added, removed, changed
@@ -0,0 +1,126 @@
+"""
+Sparse fieldsets and relation expansion for GET resources.
+
+``?fields=id,name,date`` limits a response to those keys and
+``?include=shots,personnel`` controls which related collections are embedded.
+Each resource declares a FieldSet that maps response keys to the columns they
+need, so the query only loads the requested columns (load_only) and only
+loads relations that were asked for.
+
+Without either parameter a resource returns every field and its default
+relations, exactly as before.
+"""
+
+from sqlalchemy.orm import load_only
+
+
+class ProjectionError(ValueError):
+    """Raised for unknown names in ?fields= or ?include="""
+
+
+class Field:
+    def __init__(self, columns, getter):
+        self.columns = columns
+        self.getter = getter
+
+
+class Relation:
+    def __init__(self, key, getter, options=(), prefetch=None):
+        """
+        key: response key the relation is rendered under
+        getter: getter(obj, prefetched) -> JSON value
+        options: loader options that load the relation (e.g. selectinload)
+        prefetch: optional prefetch(session, objs) run once per response; its
+                  result is passed to getter as `prefetched`
+        """
+        self.key = key
+        self.getter = getter
+        self.options = options
+        self.prefetch = prefetch
+
+
+def _split(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class FieldSet:
+    def __init__(self, model, fields, relations=None, default_fields=None, default_include=None):
+        self.model = model
+        self.fields = fields
+        self.relations = relations or {}
+        self.default_fields = list(self.fields) if default_fields is None else default_fields
+        self.default_include = list(self.relations) if default_include is None else default_include
+
+    def select(self, args):
+        """Build a Selection from request args (?fields= and ?include=)"""
+        fields_arg = args.get('fields')
+        include_arg = args.get('include')
+
+        relation_keys = {relation.key: name for name, relation in self.relations.items()}
+
+        include = _split(include_arg) if include_arg is not None else []
+        unknown = [name for name in include if name not in self.relations]
+        if unknown:
+            raise ProjectionError(
+                f'Unknown include(s): {", ".join(unknown)}. Valid includes: {", ".join(self.relations) or "none"}'
+            )
+
+        if fields_arg is None:
+            fields = list(self.default_fields)
+            if include_arg is None:
+                include = list(self.default_include)
+        else:
+            fields = []
+            for name in _split(fields_arg):
+                if name in self.fields:
+                    fields.append(name)
+                elif name in self.relations:
+                    include.append(name)
+                elif name in relation_keys:
+                    include.append(relation_keys[name])
+                else:
+                    raise ProjectionError(
+                        f'Unknown field: {name}. Valid fields: {", ".join(list(self.fields) + list(relation_keys))}'
+                    )
+
+        return Selection(self, list(dict.fromkeys(fields)), list(dict.fromkeys(include)))
+
+
+class Selection:
+    def __init__(self, field_set, fields, include):
+        self.field_set = field_set
+        self.fields = fields
+        self.include = include
+
+    def options(self):
+        """Loader options that load only the selected columns and relations"""
+        columns = []
+        for name in self.fields:
+            columns.extend(self.field_set.fields[name].columns)
+        # Primary keys are always needed to build the objects and to load relations
+        mapper = self.field_set.model.__mapper__
+        columns.extend(mapper.get_property_by_column(column).class_attribute for column in mapper.primary_key)
+
+        options = [load_only(*dict.fromkeys(columns))]
+        for name in self.include:
+            options.extend(self.field_set.relations[name].options)
+        return options
+
+    def apply(self, query):
+        return query.options(*self.options())
+
+    def serialize(self, obj, prefetched=None):
+        prefetched = prefetched or {}
+        data = {name: self.field_set.fields[name].getter(obj) for name in self.fields}
+        for name in self.include:
+            relation = self.field_set.relations[name]
+            data[relation.key] = relation.getter(obj, prefetched.get(name))
+        return data
+
+    def serialize_all(self, session, objs):
+        prefetched = {}
+        for name in self.include:
+            relation = self.field_set.relations[name]
+            if relation.prefetch:
+                prefetched[name] = relation.prefetch(session, objs)
+        return [self.serialize(obj, prefetched) for obj in objs]
@@ -0,0 +1,123 @@
+"""
+Read-replica routing.
+
+Set HIVE_READ_REPLICA_URLS to a comma separated list of database URLs (a
+read-only copy of the SQLite file, or PostgreSQL streaming replicas) and safe
+requests (GET, HEAD, OPTIONS) read from one of them instead of the primary.
+Each request picks a replica once, round robin, and uses it throughout.
+
+Everything else stays on the primary:
+
+- requests that write (POST, PUT, PATCH, DELETE)
+- reads from a client that wrote within the last HIVE_READ_YOUR_WRITES_SECONDS,
+  so people see their own changes despite replication lag. A successful write
+  sets a short-lived cookie, and API clients that don't keep cookies can send
+  X-Read-Consistency: primary instead.
+- flushes, INSERT/UPDATE/DELETE statements, and every later statement of a
+  session that wrote, even inside a GET
+- work outside a request (background jobs, CLIs, the scheduler)
+
+Each request's decision is counted in hive_db_route_total (target, reason),
+which is served by GET /metrics when HIVE_METRICS=1.
+"""
+
+import itertools
+import math
+import os
+import threading
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session as OrmSession
+from instrumentation import metrics
+
+READ_REPLICA_URLS = [url.strip() for url in os.environ.get('HIVE_READ_REPLICA_URLS', '').split(',') if url.strip()]
+READ_YOUR_WRITES_SECONDS = float(os.environ.get('HIVE_READ_YOUR_WRITES_SECONDS', '5'))
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+COOKIE_NAME = 'hive_primary_until'
+CONSISTENCY_HEADER = 'X-Read-Consistency'
+
+metrics.counter('hive_db_route_total', 'Requests by database target (primary or replica) and routing reason')
+
+replica_engines = []
+_next_replica = None
+_lock = threading.Lock()
+
+
+def replicas_configured():
+    return bool(READ_REPLICA_URLS)
+
+
+def pinned_to_primary():
+    """Whether this read request was kept on the primary although replicas are configured"""
+    return bool(READ_REPLICA_URLS) and has_request_context() and g.get('hive_db_replica') is None
+
+
+def reading_replica():
+    """Whether this request reads from a replica"""
+    return _request_replica() is not None
+
+
+def _request_replica():
+    if not has_request_context():
+        return None
+    return g.get('hive_db_replica')
+
+
+class RoutingSession(OrmSession):
+    """Session that reads from the request's replica, if it has one, and writes to its bind"""
+
+    _wrote = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = _request_replica()
+        if replica is None or self._wrote or self._flushing or (clause is not None and getattr(clause, 'is_dml', False)):
+            return super().get_bind(mapper=mapper, clause=clause, **kw)
+        return replica
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _pin_to_primary(session, flush_context):
+    # Reads after a write must see it, so the rest of the session uses the primary
+    session._wrote = True
+
+
+def _recently_wrote():
+    if request.headers.get(CONSISTENCY_HEADER, '').lower() == 'primary':
+        return True
+    try:
+        return float(request.cookies.get(COOKIE_NAME, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _before_request():
+    if request.method not in SAFE_METHODS:
+        target, reason = 'primary', 'write'
+    elif _recently_wrote():
+        target, reason = 'primary', 'read_your_writes'
+    else:
+        with _lock:
+            g.hive_db_replica = next(_next_replica)
+        target, reason = 'replica', 'read'
+    metrics.inc('hive_db_route_total', {'target': target, 'reason': reason})
+
+
+def _after_request(response):
+    if request.method not in SAFE_METHODS and response.status_code < 400:
+        response.set_cookie(
+            COOKIE_NAME, f'{time.time() + READ_YOUR_WRITES_SECONDS:.3f}',
+            max_age=math.ceil(READ_YOUR_WRITES_SECONDS), httponly=True, samesite='Lax'
+        )
+    return response
+
+
+def init_app(app):
+    """Create the replica engines and route each request; returns the engines"""
+    global _next_replica
+    replica_engines[:] = [create_engine(url) for url in READ_REPLICA_URLS]
+    _next_replica = itertools.cycle(replica_engines)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    return list(replica_engines)
@@ -0,0 +1,231 @@
+"""
+Deadline scheduler for open shot requests.
+
+An in-memory min-heap orders every open shot request (process point not
+delivered, event not deleted) by deadline. Quick-turn requests come first when
+deadlines tie. A request is quick turn if it is flagged itself or its event is
+a quick turnaround. GET /shot-requests/next reads the top n entries in
+O(n log N) and GET /shot-requests/at-risk reads the prefix due within a
+window, without sorting anything per request.
+
+The heap is built from the database at startup. Afterwards it is refreshed
+from the rows a transaction touched, once that transaction commits. ORM
+changes are picked up by session hooks. Code that changes shot requests or
+events with Core SQL calls touch() in the same session.
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session as OrmSession
+from models import Event, Shot_Request, parse_deadline
+import dialects
+
+logger = logging.getLogger('hive.scheduler')
+
+AT_RISK_HOURS = float(os.environ.get('HIVE_AT_RISK_HOURS', '24'))
+
+# Process points (lowercased) after which a request no longer needs work
+CLOSED_PROCESS_POINTS = {'delivered'}
+
+# Refresh queries look rows up in chunks to stay under bound parameter limits
+REFRESH_CHUNK_SIZE = 500
+
+_PENDING_KEY = 'scheduler_pending'
+_NO_DEADLINE = datetime.max
+
+
+class DeadlineScheduler:
+    """Priority heap with lazy deletion: superseded entries are skipped when they reach the top"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap = []
+        self._entries = {}  # shot request id -> live heap entry
+        self._by_event = {}  # event id -> shot request ids, to drop requests of deleted events
+        self._counter = itertools.count()
+        self.engine = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(deadline, quick_turn, shot_request_id):
+        return (deadline or _NO_DEADLINE, 0 if quick_turn else 1, shot_request_id)
+
+    def _upsert(self, shot_request_id, event_id, deadline, quick_turn):
+        self._remove(shot_request_id)
+        entry = [self._key(deadline, quick_turn, shot_request_id), next(self._counter), shot_request_id, event_id, True]
+        self._entries[shot_request_id] = entry
+        self._by_event.setdefault(event_id, set()).add(shot_request_id)
+        heapq.heappush(self._heap, entry)
+
+    def _remove(self, shot_request_id):
+        entry = self._entries.pop(shot_request_id, None)
+        if entry is not None:
+            entry[4] = False
+            ids = self._by_event.get(entry[3])
+            if ids is not None:
+                ids.discard(shot_request_id)
+                if not ids:
+                    del self._by_event[entry[3]]
+
+    def _take_while(self, keep_going):
+        """Pop live entries while keep_going(entry, taken) holds, then push them back"""
+        taken = []
+        while self._heap:
+            entry = self._heap[0]
+            if not entry[4]:
+                heapq.heappop(self._heap)
+                continue
+            if not keep_going(entry, taken):
+                break
+            taken.append(heapq.heappop(self._heap))
+        for entry in taken:
+            heapq.heappush(self._heap, entry)
+        return taken
+
+    def next(self, n):
+        """The n most urgent open shot requests as (id, deadline) pairs"""
+        with self._lock:
+            taken = self._take_while(lambda entry, taken: len(taken) < n)
+        return [(entry[2], _deadline_of(entry)) for entry in taken]
+
+    def at_risk(self, hours=AT_RISK_HOURS, limit=None, now=None):
+        """Open shot requests due within `hours` (including overdue ones), most urgent first"""
+        cutoff = (now or datetime.now()) + timedelta(hours=hours)
+        with self._lock:
+            taken = self._take_while(lambda entry, taken: entry[0][0] <= cutoff
+                                     and (limit is None or len(taken) < limit))
+        return [(entry[2], _deadline_of(entry)) for entry in taken]
+
+    def rebuild(self, connection):
+        """Load every open shot request"""
+        rows = connection.execute(dialects.stream(_open_requests_query()))
+        with self._lock:
+            self._entries = {}
+            self._by_event = {}
+            for row in rows:
+                entry = [self._key(parse_deadline(row.deadline), row.quick_turn or row.is_quick_turnaround, row.id),
+                         next(self._counter), row.id, row.event_id, True]
+                self._entries[row.id] = entry
+                self._by_event.setdefault(row.event_id, set()).add(row.id)
+            self._heap = list(self._entries.values())
+            heapq.heapify(self._heap)
+
+    def refresh(self, connection, shot_request_ids=(), event_ids=()):
+        """Re-read the given shot requests and every request of the given events"""
+        shot_request_ids, event_ids = set(shot_request_ids), set(event_ids)
+        rows = {}
+        for column, ids in ((Shot_Request.id, list(shot_request_ids)), (Shot_Request.event_id, list(event_ids))):
+            for i in range(0, len(ids), REFRESH_CHUNK_SIZE):
+                for row in connection.execute(_requests_query().where(column.in_(ids[i:i + REFRESH_CHUNK_SIZE]))):
+                    rows[row.id] = row
+
+        with self._lock:
+            stale = set(shot_request_ids)
+            for event_id in event_ids:
+                stale |= self._by_event.get(event_id, set())
+            for shot_request_id in stale - set(rows):
+                self._remove(shot_request_id)
+            for row in rows.values():
+                if _is_open(row):
+                    self._upsert(row.id, row.event_id, parse_deadline(row.deadline),
+                                 row.quick_turn or row.is_quick_turnaround)
+                else:
+                    self._remove(row.id)
+            # Skipped entries pile up under heavy churn; compact when they outnumber live ones
+            if len(self._heap) > 2 * len(self._entries) + 64:
+                self._heap = [entry for entry in self._heap if entry[4]]
+                heapq.heapify(self._heap)
+
+
+def _deadline_of(entry):
+    deadline = entry[0][0]
+    return None if deadline is _NO_DEADLINE else deadline
+
+
+def _requests_query():
+    return (
+        select(Shot_Request.id, Shot_Request.event_id, Shot_Request.deadline, Shot_Request.quick_turn,
+               Shot_Request.process_point, Event.is_quick_turnaround, Event.deleted_at)
+        .outerjoin(Event, Event.id == Shot_Request.event_id)
+    )
+
+
+def _is_open(row):
+    return row.deleted_at is None and (row.process_point or 'idle').lower() not in CLOSED_PROCESS_POINTS
+
+
+def _open_requests_query():
+    return _requests_query().where(
+        Event.deleted_at.is_(None),
+        func.lower(func.coalesce(Shot_Request.process_point, 'idle')).not_in(list(CLOSED_PROCESS_POINTS))
+    )
+
+
+queue = DeadlineScheduler()
+
+
+def init_scheduler(engine):
+    """Build the heap and start following committed changes"""
+    queue.engine = engine
+    # An empty heap until the next rebuild is better than an API that can't start
+    _rebuild_quietly()
+
+
+def touch(session, shot_request_ids=(), event_ids=(), rebuild=False):
+    """Refresh these rows in the scheduler once the session's transaction commits"""
+    pending = session.info.setdefault(_PENDING_KEY, {'shot_requests': set(), 'events': set(), 'rebuild': False})
+    pending['shot_requests'].update(int(i) for i in shot_request_ids)
+    pending['events'].update(int(i) for i in event_ids)
+    pending['rebuild'] = pending['rebuild'] or rebuild
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def _collect_touched(session, flush_context):
+    if queue.engine is None:
+        return
+    shot_request_ids, event_ids = [], []
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Shot_Request) and obj.id is not None:
+            shot_request_ids.append(obj.id)
+        elif isinstance(obj, Event) and obj.id is not None and obj not in session.new:
+            event_ids.append(obj.id)
+    if shot_request_ids or event_ids:
+        touch(session, shot_request_ids, event_ids)
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def _apply_touched(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending is None or queue.engine is None:
+        return
+    # The session can't run SQL in after_commit, so read the committed rows on a separate connection.
+    # The transaction has committed by now, so a failure here must not fail the request.
+    try:
+        with queue.engine.connect() as connection:
+            if pending['rebuild']:
+                queue.rebuild(connection)
+            else:
+                queue.refresh(connection, pending['shot_requests'], pending['events'])
+    except Exception:
+        logger.exception('Scheduler refresh failed; rebuilding')
+        _rebuild_quietly()
+
+
+def _rebuild_quietly():
+    try:
+        with queue.engine.connect() as connection:
+            queue.rebuild(connection)
+    except Exception:
+        logger.exception('Scheduler rebuild failed')
+
+
+@event.listens_for(OrmSession, 'after_rollback')
+def _discard_touched(session):
+    session.info.pop(_PENDING_KEY, None)
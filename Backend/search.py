@@ -0,0 +1,194 @@
+"""
+Full-text search for Hive backed by SQLite FTS5, or GIN indexes on PostgreSQL.
+
+On SQLite each searchable table gets an external-content FTS5 index
+(``<table>_fts``) that stores only the inverted index and reads the text back
+from the source table. Triggers keep the indexes in sync on
+INSERT/UPDATE/DELETE, so no application code has to remember to reindex.
+
+On PostgreSQL each table gets a GIN expression index over the tsvector of its
+searchable columns (``<table>_search``), which PostgreSQL keeps in sync itself.
+Queries use the same expression, so they are answered from the index.
+"""
+
+import re
+from sqlalchemy import text
+
+# table -> (result type, indexed columns, column used as the result title)
+SEARCH_SOURCES = {
+    'events': ('event', ['name', 'description', 'location'], 'name'),
+    'shot_requests': ('shotRequest', ['shot_description', 'stakeholder', 'key_sponsor'], 'shot_description'),
+    'personnel': ('personnel', ['name', 'role', 'email'], 'name'),
+    'projects': ('project', ['name', 'client'], 'name'),
+}
+
+# Extra WHERE clauses that hide soft-deleted rows (see soft_delete.py)
+SEARCH_VISIBILITY = {
+    'events': 'src.deleted_at IS NULL',
+    'shot_requests': 'NOT EXISTS (SELECT 1 FROM events WHERE events.id = src.event_id AND events.deleted_at IS NOT NULL)',
+}
+
+SEARCH_TYPES = {result_type: table for table, (result_type, _, _) in SEARCH_SOURCES.items()}
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_table(table):
+    return f'{table}_fts'
+
+
+def search_available(engine):
+    """Search indexes are maintained on SQLite (FTS5) and PostgreSQL (GIN)"""
+    return engine.dialect.name in ('sqlite', 'postgresql')
+
+
+def _tsvector(columns, alias=None):
+    """The indexed expression; queries must repeat it exactly for PostgreSQL to use the index"""
+    prefix = f'{alias}.' if alias else ''
+    document = " || ' ' || ".join(f"coalesce({prefix}{column}, '')" for column in columns)
+    return f"to_tsvector('simple', {document})"
+
+
+def _create_gin_indexes(conn):
+    for table, (_, columns, _) in SEARCH_SOURCES.items():
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {table}_search ON {table} USING GIN (({_tsvector(columns)}))"
+        ))
+
+
+def _index_ddl(table, columns):
+    fts = fts_table(table)
+    cols = ', '.join(columns)
+    new_cols = ', '.join(f'new.{c}' for c in columns)
+    old_cols = ', '.join(f'old.{c}' for c in columns)
+    # prefix='2 3' builds extra prefix indexes so short "foo*" queries stay fast
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"{cols}, content='{table}', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old_cols}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new_cols}); END",
+    ]
+
+
+def create_search_index(engine):
+    """Create the FTS5 tables and sync triggers, backfilling any newly created index"""
+    if not search_available(engine):
+        return
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as conn:
+            _create_gin_indexes(conn)
+        return
+
+    with engine.begin() as conn:
+        existing = {row[0] for row in conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table'")
+        )}
+        for table, (_, columns, _) in SEARCH_SOURCES.items():
+            fts = fts_table(table)
+            is_new = fts not in existing
+            for statement in _index_ddl(table, columns):
+                conn.execute(text(statement))
+            if is_new:
+                # Index rows that were written before search existed
+                conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+def rebuild_search_index(engine):
+    """Rebuild every FTS index from its source table"""
+    if not search_available(engine):
+        return
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as conn:
+            for table in SEARCH_SOURCES:
+                conn.execute(text(f'REINDEX INDEX {table}_search'))
+        return
+
+    with engine.begin() as conn:
+        for table in SEARCH_SOURCES:
+            fts = fts_table(table)
+            conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+def build_match_query(q):
+    """Turn free text into an FTS5 MATCH expression.
+
+    Every word is quoted (so user input can't inject FTS syntax) and prefix
+    matched, and all words must appear: "jo smi" -> "jo"* "smi"*
+    """
+    tokens = _TOKEN_RE.findall(q or '')
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def build_tsquery(q):
+    """The PostgreSQL equivalent of build_match_query: "jo smi" -> jo:* & smi:*"""
+    tokens = _TOKEN_RE.findall(q or '')
+    return ' & '.join(f"'{token}':*" for token in tokens)
+
+
+def _fts5_select(table, result_type, title_column):
+    fts = fts_table(table)
+    return (
+        f"SELECT '{result_type}' AS type, {fts}.rowid AS id, src.{title_column} AS title, "
+        f"snippet({fts}, -1, '<mark>', '</mark>', '…', 12) AS snippet, bm25({fts}) AS rank "
+        f"FROM {fts} JOIN {table} AS src ON src.id = {fts}.rowid "
+        f"WHERE {fts} MATCH :match"
+    )
+
+
+def _gin_select(table, result_type, columns, title_column):
+    document = ", ".join(f"src.{column}" for column in columns)
+    vector = _tsvector(columns, alias='src')
+    # ts_rank grows with relevance; negate it so "ORDER BY rank" is best first, as with bm25
+    return (
+        f"SELECT '{result_type}' AS type, src.id AS id, src.{title_column} AS title, "
+        f"ts_headline('simple', concat_ws(' ', {document}), query, "
+        f"'StartSel=<mark>, StopSel=</mark>, MaxWords=12, MinWords=4') AS snippet, "
+        f"-ts_rank({vector}, query) AS rank "
+        f"FROM {table} AS src, to_tsquery('simple', :match) AS query "
+        f"WHERE {vector} @@ query"
+    )
+
+
+def search(session, q, types=None, limit=DEFAULT_LIMIT, offset=0):
+    """Run a ranked search across all indexed tables.
+
+    Returns (results, has_more). Results are ordered by rank (bm25 on SQLite,
+    negated ts_rank on PostgreSQL), best first.
+    """
+    postgresql = session.get_bind().dialect.name == 'postgresql'
+    match = build_tsquery(q) if postgresql else build_match_query(q)
+    if not match:
+        return [], False
+
+    tables = [SEARCH_TYPES[t] for t in types] if types else list(SEARCH_SOURCES)
+
+    selects = []
+    for table in tables:
+        result_type, columns, title_column = SEARCH_SOURCES[table]
+        select_sql = (_gin_select(table, result_type, columns, title_column) if postgresql
+                      else _fts5_select(table, result_type, title_column))
+        selects.append(
+            select_sql + (f" AND {SEARCH_VISIBILITY[table]}" if table in SEARCH_VISIBILITY else '')
+        )
+
+    # Fetch one extra row to know whether another page exists without a COUNT(*)
+    sql = ' UNION ALL '.join(selects) + ' ORDER BY rank LIMIT :limit OFFSET :offset'
+    rows = session.execute(text(sql), {'match': match, 'limit': limit + 1, 'offset': offset}).fetchall()
+
+    results = [{
+        'type': row.type,
+        'id': str(row.id),
+        'title': row.title,
+        'snippet': row.snippet,
+        'rank': row.rank
+    } for row in rows[:limit]]
+    return results, len(rows) > limit
@@ -0,0 +1,232 @@
+"""
+Slow-query log for the Hive API.
+
+Enable with HIVE_SLOW_QUERY_MS=<threshold>. Any SQL statement slower than the
+threshold is logged and aggregated by fingerprint (the statement with literals
+and IN lists collapsed), so the same ORM query issued with different IDs is a
+single entry. Bound parameters are never stored, only their types.
+
+The first time a fingerprint turns up slow its query plan is captured with
+EXPLAIN QUERY PLAN (SQLite) or EXPLAIN (PostgreSQL), which makes full table
+scans easy to spot. Only SELECT, INSERT, UPDATE, DELETE and WITH statements
+are explained. The EXPLAIN runs in the caller's transaction, so on PostgreSQL
+it runs in a savepoint: a failed EXPLAIN would otherwise abort the transaction.
+The top offenders are served by GET /admin/slow-queries.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import event
+
+logger = logging.getLogger('hive.slow_queries')
+
+SLOW_QUERY_MS = os.environ.get('HIVE_SLOW_QUERY_MS')
+MAX_FINGERPRINTS = int(os.environ.get('HIVE_SLOW_QUERY_MAX_FINGERPRINTS', '500'))
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER_RE = re.compile(r'%\(\w+\)s|%s|:\w+|\$\d+|\?')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_VALUES_LIST_RE = re.compile(r'VALUES\s*(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Statements EXPLAIN can plan; anything else (DDL, SET, COPY, ...) is logged without a plan
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+SORT_KEYS = {
+    'total': 'totalMs',
+    'max': 'maxMs',
+    'count': 'count',
+    'mean': 'meanMs'
+}
+
+
+def slow_query_log_enabled():
+    return SLOW_QUERY_MS is not None
+
+
+def normalize_sql(statement):
+    """Reduce a statement to its shape: literals and placeholders become ?, lists collapse to (...)"""
+    sql = _STRING_RE.sub('?', statement)
+    sql = _PLACEHOLDER_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _WHITESPACE_RE.sub(' ', sql).strip()
+    sql = _VALUES_LIST_RE.sub(r'VALUES \1, ...', sql)
+    sql = _IN_LIST_RE.sub('(...)', sql)
+    return sql
+
+
+def fingerprint(normalized_sql):
+    return hashlib.sha1(normalized_sql.encode('utf-8')).hexdigest()[:16]
+
+
+def redact_parameters(parameters):
+    """Describe bound parameters by type only so no values leak into the log"""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def _is_full_scan(plan):
+    for line in plan:
+        stripped = line.strip()
+        # SQLite: "SCAN events" (a "SCAN ... USING COVERING INDEX" still reads the whole index)
+        if stripped.startswith('SCAN ') and 'USING INDEX' not in stripped and 'USING INTEGER PRIMARY KEY' not in stripped:
+            return True
+        if 'Seq Scan' in stripped:
+            return True
+    return False
+
+
+def explainable(statement):
+    words = statement.lstrip().split(None, 1)
+    return bool(words) and words[0].upper() in EXPLAINABLE
+
+
+class SlowQueryLog:
+    """Aggregates slow statements by fingerprint"""
+
+    def __init__(self, threshold_ms, max_fingerprints=MAX_FINGERPRINTS):
+        self.threshold_ms = threshold_ms
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def needs_plan(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is None or entry['plan'] is None
+
+    def record(self, statement, parameters, duration_ms, plan=None):
+        normalized = normalize_sql(statement)
+        key = fingerprint(normalized)
+        now = datetime.now().isoformat()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                if len(self._entries) >= self.max_fingerprints:
+                    # Make room by dropping the entry that has cost the least so far
+                    cheapest = min(self._entries, key=lambda k: self._entries[k]['totalMs'])
+                    del self._entries[cheapest]
+                entry = self._entries[key] = {
+                    'fingerprint': key,
+                    'sql': normalized,
+                    'count': 0,
+                    'totalMs': 0.0,
+                    'maxMs': 0.0,
+                    'firstSeen': now,
+                    'lastSeen': now,
+                    'parameterTypes': redact_parameters(parameters),
+                    'plan': None,
+                    'fullScan': False
+                }
+            entry['count'] += 1
+            entry['totalMs'] += duration_ms
+            entry['maxMs'] = max(entry['maxMs'], duration_ms)
+            entry['lastSeen'] = now
+            if plan is not None and entry['plan'] is None:
+                entry['plan'] = plan
+                entry['fullScan'] = _is_full_scan(plan)
+        return key
+
+    def top(self, limit=20, sort='total'):
+        sort_key = SORT_KEYS[sort]
+        with self._lock:
+            entries = [dict(entry, meanMs=entry['totalMs'] / entry['count']) for entry in self._entries.values()]
+        entries.sort(key=lambda entry: entry[sort_key], reverse=True)
+        for entry in entries:
+            entry['totalMs'] = round(entry['totalMs'], 3)
+            entry['maxMs'] = round(entry['maxMs'], 3)
+            entry['meanMs'] = round(entry['meanMs'], 3)
+        return entries[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slow_query_log = SlowQueryLog(float(SLOW_QUERY_MS) if SLOW_QUERY_MS else 0.0)
+
+
+def explain(dialect_name, cursor, statement, parameters):
+    """Capture the plan for a statement on the same DBAPI connection it ran on"""
+    if dialect_name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif dialect_name == 'postgresql':
+        # Plain EXPLAIN plans the statement without executing it
+        prefix = 'EXPLAIN '
+    else:
+        return None
+
+    dbapi_connection = cursor.connection
+    # An error inside a PostgreSQL transaction aborts it, so contain the EXPLAIN in a savepoint
+    savepoint = dialect_name == 'postgresql' and not getattr(dbapi_connection, 'autocommit', False)
+    explain_cursor = dbapi_connection.cursor()
+    try:
+        if savepoint:
+            explain_cursor.execute('SAVEPOINT hive_explain')
+        try:
+            explain_cursor.execute(prefix + statement, parameters)
+            rows = explain_cursor.fetchall()
+        except Exception:
+            if savepoint:
+                explain_cursor.execute('ROLLBACK TO SAVEPOINT hive_explain')
+            raise
+        finally:
+            if savepoint:
+                explain_cursor.execute('RELEASE SAVEPOINT hive_explain')
+    finally:
+        explain_cursor.close()
+
+    if dialect_name == 'sqlite':
+        # (id, parent, notused, detail): indent each step under its parent
+        depth = {0: -1}
+        plan = []
+        for row in rows:
+            node_id, parent = row[0], row[1]
+            depth[node_id] = depth.get(parent, -1) + 1
+            plan.append('  ' * depth[node_id] + row[3])
+        return plan
+    return [row[0] for row in rows]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('hive_slow_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration_ms = (time.perf_counter() - conn.info['hive_slow_query_start'].pop()) * 1000
+    if duration_ms < slow_query_log.threshold_ms:
+        return
+
+    plan = None
+    key = fingerprint(normalize_sql(statement))
+    if not executemany and explainable(statement) and slow_query_log.needs_plan(key):
+        try:
+            plan = explain(conn.dialect.name, cursor, statement, parameters)
+        except Exception as e:
+            plan = [f'EXPLAIN failed: {e}']
+
+    slow_query_log.record(statement, parameters, duration_ms, plan)
+    logger.warning('Slow query (%.1f ms) [%s]: %s', duration_ms, key, normalize_sql(statement))
+
+
+def _handle_error(exception_context):
+    if exception_context.connection is not None:
+        starts = exception_context.connection.info.get('hive_slow_query_start')
+        if starts:
+            starts.pop()
+
+
+def init_engine(engine):
+    """Start recording slow statements issued through engine"""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
@@ -0,0 +1,100 @@
+"""
+Soft delete for events and shots.
+
+DELETE /events/<id> and DELETE /shots/<id> only stamp deleted_at, a single-row
+UPDATE, so they never hold the write lock for a whole cascade. A
+do_orm_execute hook adds criteria to every ORM query that hide:
+
+- events with deleted_at set
+- shots with deleted_at set, or whose event is soft-deleted
+- shot requests whose event is soft-deleted
+
+Relationship loads inherit the same criteria. Pass
+execution_options(include_deleted=True) to see soft-deleted rows anyway.
+Core statements run on a Connection are not filtered.
+
+The dashboard counters drop a row when it is soft-deleted. The rows
+themselves (and shot image files) are purged later by compaction.py.
+"""
+
+from datetime import datetime
+from sqlalchemy import and_, event, select, true, update
+from sqlalchemy.orm import Session as OrmSession, with_loader_criteria
+from models import Event, Shot, Shot_Request
+import outbox
+import scheduler
+import stats
+
+_events = Event.__table__
+
+# Plain table columns, so the Event criteria below doesn't apply inside the subquery
+_deleted_event_ids = select(_events.c.id).where(_events.c.deleted_at.isnot(None))
+
+VISIBILITY_CRITERIA = [
+    (Event, Event.deleted_at.is_(None)),
+    (Shot, Shot.deleted_at.is_(None) & Shot.event_id.not_in(_deleted_event_ids)),
+    (Shot_Request, Shot_Request.event_id.is_(None) | Shot_Request.event_id.not_in(_deleted_event_ids)),
+]
+
+
+def visible(model):
+    """Criteria matching the live rows of model, for Core statements the hook doesn't see"""
+    criteria = [criteria for criteria_model, criteria in VISIBILITY_CRITERIA if criteria_model is model]
+    return and_(*criteria) if criteria else true()
+
+
+@event.listens_for(OrmSession, 'do_orm_execute')
+def _hide_deleted(execute_state):
+    if (execute_state.is_select
+            and not execute_state.is_column_load
+            and not execute_state.is_relationship_load
+            and not execute_state.execution_options.get('include_deleted', False)):
+        execute_state.statement = execute_state.statement.options(*(
+            with_loader_criteria(model, criteria, include_aliases=True)
+            for model, criteria in VISIBILITY_CRITERIA
+        ))
+
+
+def soft_delete_event(session, event_id):
+    """Mark an event deleted and drop it (and its children) from the counters.
+
+    Returns False if there is no live event with that id. The caller commits.
+    """
+    connection = session.connection()
+    # Claim and stamp the row in one statement, so two concurrent deletes can't both adjust the counters
+    row = connection.execute(
+        update(Event).where(Event.id == event_id, Event.deleted_at.is_(None))
+        .values(deleted_at=datetime.now())
+        .returning(Event.project_id, Event.organization_id, Event.is_covered, Event.process_point)
+    ).first()
+    if row is None:
+        return False
+
+    # The event's shots and shot requests leave the counters with it
+    stats.remove_events(session, [(event_id, row.project_id, row.organization_id, row.is_covered, row.process_point)])
+    scheduler.touch(session, event_ids=[event_id])
+    # The mirror drops the event's shot requests along with it
+    outbox.record(session, 'events', [event_id])
+    outbox.record_select(session, 'shot_requests', select(Shot_Request.id).where(Shot_Request.event_id == event_id))
+    return True
+
+
+def soft_delete_shot(session, shot_id):
+    """Mark a shot deleted and drop it from the counters.
+
+    Returns False if there is no live shot with that id. The caller commits.
+    """
+    connection = session.connection()
+    row = connection.execute(
+        update(Shot).where(Shot.id == shot_id, Shot.deleted_at.is_(None), Shot.event_id.not_in(_deleted_event_ids))
+        .values(deleted_at=datetime.now())
+        .returning(Shot.event_id)
+    ).first()
+    if row is None:
+        return False
+    parent = connection.execute(
+        select(Event.project_id, Event.organization_id).where(Event.id == row.event_id)
+    ).first()
+
+    stats.remove_shots(session, [(row.event_id, parent.project_id, parent.organization_id, 1)])
+    return True
@@ -0,0 +1,407 @@
+"""
+Dashboard statistics for Hive.
+
+Counts of shots, shot requests (by process point) and events (total, covered,
+by process point) are kept per organization, project and event in the
+stats_counters table. Session flush hooks turn every ORM insert, update and
+delete of a Shot, Shot_Request or Event into counter deltas and apply them on
+the same connection, so the counters commit or roll back together with the
+change that caused them. Reading a scope's stats is a single primary key range
+scan regardless of how many shots it has.
+
+Code that bypasses the ORM (bulk SQL) must call rebuild_stats(), or report the
+change with apply_event_change() / apply_shot_request_change(), or with
+remove_events() / remove_shots() / remove_shot_requests() for rows it deleted
+or soft-deleted.
+"""
+
+from collections import Counter
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.orm import Session as OrmSession
+from models import Event, Project, Organization, Shot, Shot_Request, StatsCounter
+import dialects
+
+# Metrics that belong to an event and roll up into its project and organization
+EVENT_CHILD_METRIC_PREFIXES = ('shots', 'shotRequests')
+
+# Columns whose changes move counters; code that updates them with Core SQL must
+# report the change with apply_event_change() / apply_shot_request_change()
+EVENT_STATS_COLUMNS = ('project_id', 'organization_id', 'is_covered', 'process_point')
+SHOT_REQUEST_STATS_COLUMNS = ('event_id', 'process_point')
+
+_DELTAS_KEY = 'stats_deltas'
+_REMOVED_SCOPES_KEY = 'stats_removed_scopes'
+
+
+def _process_point(value):
+    return value or 'idle'
+
+
+def _is_covered(value):
+    # The API treats a missing is_covered as covered
+    return value if value is not None else True
+
+
+def _id(value):
+    """IDs posted as JSON strings are stored as integers; anything else non-numeric is no ID"""
+    if isinstance(value, str):
+        return int(value) if value.isdigit() else None
+    return value
+
+
+def _previous(obj, attr):
+    """Value of attr as it was loaded from the database, before pending changes"""
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(obj, attr)
+
+
+def _scopes_for_event(event_ref, event_rows):
+    """(scope, scope_id) pairs an event-owned row counts towards"""
+    if isinstance(event_ref, Event):
+        # Pending event: its id is assigned during the flush, so keep the object
+        return [('event', event_ref), ('project', event_ref.project_id), ('organization', event_ref.organization_id)]
+    if event_ref is None or event_ref not in event_rows:
+        return []
+    project_id, organization_id = event_rows[event_ref]
+    return [('event', event_ref), ('project', project_id), ('organization', organization_id)]
+
+
+def _child_metrics(obj, previous=False):
+    if isinstance(obj, Shot):
+        return ['shots']
+    process_point = _previous(obj, 'process_point') if previous else obj.process_point
+    return ['shotRequests', f'shotRequests.{_process_point(process_point)}']
+
+
+def _event_metrics(is_covered, process_point):
+    metrics = ['events', f'events.{_process_point(process_point)}']
+    if _is_covered(is_covered):
+        metrics.append('coveredEvents')
+    return metrics
+
+
+def _event_ref(obj, previous=False):
+    """The event a shot or shot request belongs to: an id, or the Event itself if it is still pending"""
+    ref = _previous(obj, 'event_id') if previous else obj.event_id
+    if ref is None and not previous and obj.event is not None:
+        ref = obj.event if obj.event.id is None else obj.event.id
+    return ref if isinstance(ref, Event) else _id(ref)
+
+
+def _add(deltas, scopes, metrics, amount):
+    for scope, scope_id in scopes:
+        scope_id = scope_id if isinstance(scope_id, Event) else _id(scope_id)
+        if scope_id is None:
+            continue
+        for metric in metrics:
+            deltas[(scope, scope_id, metric)] += amount
+
+
+def _current_counters(session, scope, scope_id):
+    rows = session.execute(
+        select(StatsCounter.metric, StatsCounter.value)
+        .where(StatsCounter.scope == scope, StatsCounter.scope_id == scope_id)
+    )
+    return {metric: value for metric, value in rows}
+
+
+@event.listens_for(OrmSession, 'before_flush')
+def _collect_deltas(session, flush_context, instances):
+    # Start fresh each flush so deltas from a flush that failed are never applied
+    deltas = session.info[_DELTAS_KEY] = Counter()
+    removed_scopes = session.info[_REMOVED_SCOPES_KEY] = set()
+
+    children = [obj for obj in session.new if isinstance(obj, (Shot, Shot_Request))]
+    deleted_children = [obj for obj in session.deleted if isinstance(obj, (Shot, Shot_Request))]
+    changed_children = [obj for obj in session.dirty
+                        if isinstance(obj, (Shot, Shot_Request)) and session.is_modified(obj)]
+    changed_events = [obj for obj in session.dirty if isinstance(obj, Event) and session.is_modified(obj)]
+
+    # Look up project/organization for every persistent event we touch in one query
+    event_ids = set()
+    for obj in children + changed_children:
+        ref = _event_ref(obj)
+        if ref is not None and not isinstance(ref, Event):
+            event_ids.add(ref)
+    for obj in deleted_children + changed_children:
+        ref = _event_ref(obj, previous=True)
+        if ref is not None:
+            event_ids.add(ref)
+    event_rows = {}
+    if event_ids:
+        event_rows = {row.id: (row.project_id, row.organization_id) for row in session.execute(
+            select(Event.id, Event.project_id, Event.organization_id).where(Event.id.in_(event_ids))
+        )}
+
+    for obj in children:
+        _add(deltas, _scopes_for_event(_event_ref(obj), event_rows), _child_metrics(obj), 1)
+
+    for obj in deleted_children:
+        _add(deltas, _scopes_for_event(_event_ref(obj, previous=True), event_rows), _child_metrics(obj, previous=True), -1)
+
+    for obj in changed_children:
+        _add(deltas, _scopes_for_event(_event_ref(obj, previous=True), event_rows), _child_metrics(obj, previous=True), -1)
+        _add(deltas, _scopes_for_event(_event_ref(obj), event_rows), _child_metrics(obj), 1)
+
+    for obj in session.new:
+        if isinstance(obj, Event):
+            _add(deltas, [('project', obj.project_id), ('organization', obj.organization_id)],
+                 _event_metrics(obj.is_covered, obj.process_point), 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Event):
+            _add(deltas, [('project', _previous(obj, 'project_id')), ('organization', _previous(obj, 'organization_id'))],
+                 _event_metrics(_previous(obj, 'is_covered'), _previous(obj, 'process_point')), -1)
+            removed_scopes.add(('event', obj.id))
+        elif isinstance(obj, Project):
+            removed_scopes.add(('project', obj.id))
+        elif isinstance(obj, Organization):
+            removed_scopes.add(('organization', obj.id))
+
+    for obj in changed_events:
+        old = {column: _previous(obj, column) for column in EVENT_STATS_COLUMNS}
+        new = {column: getattr(obj, column) for column in EVENT_STATS_COLUMNS}
+        _add_event_change(session, deltas, obj.id, old, new)
+
+
+def _add_event_change(session, deltas, event_id, old, new):
+    """Deltas for an event whose EVENT_STATS_COLUMNS changed from old to new"""
+    old_scopes = [('project', _id(old['project_id'])), ('organization', _id(old['organization_id']))]
+    new_scopes = [('project', _id(new['project_id'])), ('organization', _id(new['organization_id']))]
+    _add(deltas, old_scopes, _event_metrics(old['is_covered'], old['process_point']), -1)
+    _add(deltas, new_scopes, _event_metrics(new['is_covered'], new['process_point']), 1)
+
+    if old_scopes != new_scopes:
+        # The event moved, so its shots and shot requests move with it
+        for metric, value in _current_counters(session, 'event', event_id).items():
+            if metric.startswith(EVENT_CHILD_METRIC_PREFIXES):
+                for (scope, old_id), (_, new_id) in zip(old_scopes, new_scopes):
+                    if old_id != new_id:
+                        if old_id is not None:
+                            deltas[(scope, old_id, metric)] -= value
+                        if new_id is not None:
+                            deltas[(scope, new_id, metric)] += value
+
+
+@event.listens_for(OrmSession, 'after_flush')
+def _apply_pending_deltas(session, flush_context):
+    deltas = session.info.pop(_DELTAS_KEY, None)
+    removed_scopes = session.info.pop(_REMOVED_SCOPES_KEY, None)
+
+    if deltas:
+        # Pending events have their ids now
+        resolved = Counter()
+        for (scope, scope_id, metric), value in deltas.items():
+            if isinstance(scope_id, Event):
+                scope_id = scope_id.id
+            resolved[(scope, scope_id, metric)] += value
+        apply_deltas(session.connection(), resolved)
+
+    if removed_scopes:
+        clear_scopes(session.connection(), removed_scopes)
+
+
+def apply_deltas(connection, deltas):
+    """Add {(scope, scope_id, metric): delta} to the counters in one statement"""
+    rows = [{'scope': scope, 'scope_id': scope_id, 'metric': metric, 'value': value}
+            for (scope, scope_id, metric), value in deltas.items() if value]
+    if not rows:
+        return
+
+    stmt = dialects.insert(connection, StatsCounter).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['scope', 'scope_id', 'metric'],
+        set_={'value': StatsCounter.value + stmt.excluded.value}
+    )
+    connection.execute(stmt)
+
+
+def clear_scopes(connection, scopes):
+    """Drop all counters for the given (scope, scope_id) pairs"""
+    for scope, scope_id in scopes:
+        connection.execute(delete(StatsCounter).where(
+            StatsCounter.scope == scope, StatsCounter.scope_id == scope_id
+        ))
+
+
+def apply_event_change(session, event_id, old, new):
+    """Update the counters for an event changed outside the ORM.
+
+    old and new map EVENT_STATS_COLUMNS to the values before and after.
+    """
+    deltas = Counter()
+    _add_event_change(session, deltas, event_id, old, new)
+    apply_deltas(session.connection(), deltas)
+
+
+def apply_shot_request_change(session, old, new):
+    """Update the counters for a shot request changed outside the ORM.
+
+    old and new map SHOT_REQUEST_STATS_COLUMNS to the values before and after.
+    """
+    old_event, new_event = _id(old['event_id']), _id(new['event_id'])
+    event_ids = {event_id for event_id in (old_event, new_event) if event_id is not None}
+    event_rows = {}
+    if event_ids:
+        event_rows = {row.id: (row.project_id, row.organization_id) for row in session.execute(
+            select(Event.id, Event.project_id, Event.organization_id).where(Event.id.in_(event_ids))
+        )}
+
+    deltas = Counter()
+    _add(deltas, _scopes_for_event(old_event, event_rows),
+         ['shotRequests', f'shotRequests.{_process_point(old["process_point"])}'], -1)
+    _add(deltas, _scopes_for_event(new_event, event_rows),
+         ['shotRequests', f'shotRequests.{_process_point(new["process_point"])}'], 1)
+    apply_deltas(session.connection(), deltas)
+
+
+def remove_events(session, events):
+    """Take events deleted or soft-deleted outside the ORM out of the counters.
+
+    events are (event_id, project_id, organization_id, is_covered, process_point)
+    rows. Each event leaves its project and organization together with the shots
+    and shot requests still counted under it, and its own counters are dropped.
+    """
+    events = list(events)
+    if not events:
+        return
+    event_ids = [event_id for event_id, _, _, _, _ in events]
+    children = {}
+    for scope_id, metric, value in session.execute(
+        select(StatsCounter.scope_id, StatsCounter.metric, StatsCounter.value)
+        .where(StatsCounter.scope == 'event', StatsCounter.scope_id.in_(event_ids))
+    ):
+        if metric.startswith(EVENT_CHILD_METRIC_PREFIXES):
+            children.setdefault(scope_id, []).append((metric, value))
+
+    deltas = Counter()
+    for event_id, project_id, organization_id, is_covered, process_point in events:
+        parents = [('project', project_id), ('organization', organization_id)]
+        _add(deltas, parents, _event_metrics(is_covered, process_point), -1)
+        for metric, value in children.get(event_id, []):
+            _add(deltas, parents, [metric], -value)
+
+    connection = session.connection()
+    apply_deltas(connection, deltas)
+    connection.execute(delete(StatsCounter).where(StatsCounter.scope == 'event', StatsCounter.scope_id.in_(event_ids)))
+
+
+def remove_shots(session, counts):
+    """Take shots deleted or soft-deleted outside the ORM out of the counters.
+
+    counts are (event_id, project_id, organization_id, number of shots) rows.
+    """
+    deltas = Counter()
+    for event_id, project_id, organization_id, count in counts:
+        _add(deltas, [('event', event_id), ('project', project_id), ('organization', organization_id)],
+             ['shots'], -count)
+    apply_deltas(session.connection(), deltas)
+
+
+def remove_shot_requests(session, counts):
+    """Take shot requests deleted outside the ORM out of the counters.
+
+    counts are (event_id, project_id, organization_id, process_point, number of requests) rows.
+    """
+    deltas = Counter()
+    for event_id, project_id, organization_id, process_point, count in counts:
+        _add(deltas, [('event', event_id), ('project', project_id), ('organization', organization_id)],
+             ['shotRequests', f'shotRequests.{_process_point(process_point)}'], -count)
+    apply_deltas(session.connection(), deltas)
+
+
+def rebuild_stats(session, organization_id=None):
+    """Recompute counters from the source tables with set-based aggregates.
+
+    With organization_id only that organization's counters are rebuilt.
+    """
+    deltas = Counter()
+    # Soft-deleted rows don't count, whether or not soft_delete's query hook is installed
+    org_filter = [Event.deleted_at.is_(None)]
+    if organization_id is not None:
+        org_filter.append(Event.organization_id == organization_id)
+
+    shot_rows = session.execute(
+        select(Event.id, Event.project_id, Event.organization_id, func.count(Shot.id))
+        .join(Shot, Shot.event_id == Event.id)
+        .where(Shot.deleted_at.is_(None), *org_filter)
+        .group_by(Event.id, Event.project_id, Event.organization_id)
+    )
+    for event_id, project_id, organization_id_, count in shot_rows:
+        _add(deltas, [('event', event_id), ('project', project_id), ('organization', organization_id_)], ['shots'], count)
+
+    request_rows = session.execute(
+        select(Event.id, Event.project_id, Event.organization_id, Shot_Request.process_point, func.count(Shot_Request.id))
+        .join(Shot_Request, Shot_Request.event_id == Event.id)
+        .where(*org_filter)
+        .group_by(Event.id, Event.project_id, Event.organization_id, Shot_Request.process_point)
+    )
+    for event_id, project_id, organization_id_, process_point, count in request_rows:
+        _add(deltas, [('event', event_id), ('project', project_id), ('organization', organization_id_)],
+             ['shotRequests', f'shotRequests.{_process_point(process_point)}'], count)
+
+    event_rows = session.execute(
+        select(Event.project_id, Event.organization_id, Event.is_covered, Event.process_point, func.count(Event.id))
+        .where(*org_filter)
+        .group_by(Event.project_id, Event.organization_id, Event.is_covered, Event.process_point)
+    )
+    for project_id, organization_id_, is_covered, process_point, count in event_rows:
+        _add(deltas, [('project', project_id), ('organization', organization_id_)],
+             _event_metrics(is_covered, process_point), count)
+
+    connection = session.connection()
+    if organization_id is None:
+        connection.execute(delete(StatsCounter))
+    else:
+        connection.execute(delete(StatsCounter).where(
+            (StatsCounter.scope == 'organization') & (StatsCounter.scope_id == organization_id)
+            | (StatsCounter.scope == 'project') & StatsCounter.scope_id.in_(
+                select(Project.id).where(Project.organization_id == organization_id))
+            | (StatsCounter.scope == 'event') & StatsCounter.scope_id.in_(
+                select(Event.id).where(Event.organization_id == organization_id))
+        ))
+    apply_deltas(connection, deltas)
+
+
+def backfill_stats(engine):
+    """Build the counters for a database that has data but no counters yet"""
+    session = OrmSession(bind=engine)
+    try:
+        has_counters = session.execute(select(StatsCounter.scope).limit(1)).first() is not None
+        has_events = session.execute(select(Event.id).limit(1)).first() is not None
+        if has_events and not has_counters:
+            rebuild_stats(session)
+            session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def get_stats(session, scope, scope_id):
+    """Read the counters for one scope and shape them for the API"""
+    counters = _current_counters(session, scope, scope_id)
+
+    def breakdown(prefix):
+        return {metric[len(prefix) + 1:]: value for metric, value in counters.items()
+                if metric.startswith(prefix + '.') and value}
+
+    stats = {
+        'shots': counters.get('shots', 0),
+        'shotRequests': {
+            'total': counters.get('shotRequests', 0),
+            'byProcessPoint': breakdown('shotRequests')
+        }
+    }
+    if scope != 'event':
+        stats['events'] = {
+            'total': counters.get('events', 0),
+            'covered': counters.get('coveredEvents', 0),
+            'byProcessPoint': breakdown('events')
+        }
+    return stats
@@ -0,0 +1,75 @@
+"""
+Shared fixtures.
+
+The tests run against the real app and a real database: a temporary SQLite
+file filled with the benchmark dataset (benchmarks/datagen.py, scale 1), or
+an empty PostgreSQL database named by HIVE_TEST_DATABASE_URL. Everything is
+configured through the environment before main and models are imported,
+since both read it at import time. Background threads are off so the tests
+drive jobs, compaction and the outbox themselves.
+
+The database is shared by the whole run, so tests create the rows they change
+or pick rows no other test touches.
+"""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+_database_dir = tempfile.mkdtemp(prefix='hive-tests-')
+os.environ['DATABASE_URL'] = (
+    os.environ.get('HIVE_TEST_DATABASE_URL') or f'sqlite:///{os.path.join(_database_dir, "hive.db")}'
+)
+os.environ['HIVE_COMPACTION_INTERVAL_SECONDS'] = '0'
+os.environ['HIVE_JOB_WORKERS'] = '0'
+os.environ['HIVE_FIRESTORE_MIRROR'] = '0'
+
+
+@pytest.fixture(scope='session')
+def app():
+    from sqlalchemy import create_engine
+    from benchmarks import datagen
+    engine = create_engine(os.environ['DATABASE_URL'])
+    datagen.prepare_database(engine)
+    datagen.generate(engine, scale=1)
+    datagen.finish_database(engine)
+    engine.dispose()
+
+    import main
+    app = main.create_app()
+    main.get_engine()
+    yield app
+    main.engine.dispose()
+    shutil.rmtree(_database_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def session_factory(app):
+    import main
+    return main.Session
+
+
+@pytest.fixture
+def engine(app):
+    import main
+    return main.engine
+
+
+@pytest.fixture
+def new_event(client):
+    """Create an event in organization 1; returns its JSON"""
+    count = iter(range(1, 1000000))
+
+    def create(**fields):
+        body = {'name': f'Test event {next(count)}', 'date': '2025-06-01', 'organizationId': 1, **fields}
+        response = client.post('/events', json=body)
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()
+    return create
@@ -0,0 +1,96 @@
+"""Response compression and the response cache (compression.py)"""
+
+import gzip
+import os
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, delete, text
+
+import compression
+import dialects
+from models import Role
+
+
+@pytest.fixture
+def outside_engine(app):
+    """An engine the app doesn't watch, like another process writing to the database"""
+    engine = create_engine(os.environ['DATABASE_URL'])
+    yield engine
+    engine.dispose()
+
+
+def rename_outside(outside_engine, event_id, name):
+    with outside_engine.begin() as connection:
+        connection.execute(text('UPDATE events SET name = :name WHERE id = :id'), {'name': name, 'id': int(event_id)})
+
+
+def test_cached_response_is_served_until_a_write_commits(client, engine, outside_engine, new_event):
+    event_id = new_event()['id']
+    url = f'/events/{event_id}'
+    assert client.get(url).get_json()['name'].startswith('Test event')
+
+    rename_outside(outside_engine, event_id, 'Renamed elsewhere')
+    assert client.get(url).get_json()['name'].startswith('Test event')
+
+    assert client.patch(url, json={'location': 'Hall B', 'version': 1}).status_code == 200
+    event = client.get(url).get_json()
+    assert (event['name'], event['location']) == ('Renamed elsewhere', 'Hall B')
+
+
+def test_rolled_back_write_keeps_the_cache(client, engine, outside_engine, new_event):
+    event_id = new_event()['id']
+    url = f'/events/{event_id}'
+    client.get(url)
+    rename_outside(outside_engine, event_id, 'Renamed elsewhere')
+
+    with engine.connect() as connection:
+        connection.execute(text('UPDATE events SET location = :location WHERE id = :id'),
+                           {'location': 'Never', 'id': int(event_id)})
+        connection.rollback()
+    assert client.get(url).get_json()['name'].startswith('Test event')
+
+
+def test_with_statement_that_writes_clears_the_cache(client, engine, outside_engine, new_event):
+    event_id = new_event()['id']
+    url = f'/events/{event_id}'
+    client.get(url)
+    rename_outside(outside_engine, event_id, 'Renamed elsewhere')
+
+    with engine.begin() as connection:
+        connection.execute(text('WITH target AS (SELECT :id AS id) '
+                                'UPDATE events SET location = :location WHERE id IN (SELECT id FROM target)'),
+                           {'location': 'Hall C', 'id': int(event_id)})
+    assert client.get(url).get_json()['name'] == 'Renamed elsewhere'
+
+
+def test_read_only_with_statement_keeps_the_cache(client, engine, new_event):
+    event_id = new_event()['id']
+    client.get(f'/events/{event_id}')
+    generation = compression.cache.generation
+
+    with engine.begin() as connection:
+        connection.execute(text('WITH target AS (SELECT 1 AS id) SELECT id FROM target'))
+    assert compression.cache.generation == generation
+
+
+@pytest.mark.skipif(not os.environ['DATABASE_URL'].startswith('postgresql'), reason='COPY is PostgreSQL only')
+def test_copy_clears_the_cache(engine):
+    generation = compression.cache.generation
+    slug = f'copied-{uuid.uuid4().hex[:8]}'
+    with engine.begin() as connection:
+        dialects.copy_rows(connection, Role.__table__, [{'name': 'Copied', 'slug': slug}])
+    assert compression.cache.generation > generation
+    with engine.begin() as connection:
+        connection.execute(delete(Role).where(Role.slug == slug))
+
+
+def test_large_responses_are_compressed(client):
+    response = client.get('/shots', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(gzip.decompress(response.get_data())) > compression.COMPRESSION_MIN_BYTES
+
+    # The cached copy is served compressed the same way
+    again = client.get('/shots', headers={'Accept-Encoding': 'gzip'})
+    assert gzip.decompress(again.get_data()) == gzip.decompress(response.get_data())
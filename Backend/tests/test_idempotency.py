@@ -0,0 +1,110 @@
+"""Retry-safe creates with Idempotency-Key (idempotency.py)"""
+
+import threading
+import uuid
+
+import pytest
+from flask import Flask
+from sqlalchemy import func, select
+
+import idempotency
+from models import Event
+
+
+def key():
+    return uuid.uuid4().hex
+
+
+def count_events(session_factory, name):
+    with session_factory() as session:
+        return session.scalar(select(func.count()).select_from(Event).where(Event.name == name))
+
+
+def test_retry_replays_the_first_response(client, session_factory):
+    body = {'name': f'Idempotent {key()}', 'date': '2025-06-01', 'organizationId': 1}
+    headers = {'Idempotency-Key': key()}
+    first = client.post('/events', json=body, headers=headers)
+    retry = client.post('/events', json=body, headers=headers)
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == first.get_json()
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert 'Idempotent-Replayed' not in first.headers
+    assert count_events(session_factory, body['name']) == 1
+
+
+def test_key_is_scoped_to_the_path(client):
+    headers = {'Idempotency-Key': key()}
+    event = client.post('/events', json={'name': f'Scoped {key()}', 'date': '2025-06-01'}, headers=headers)
+    request = client.post('/shot-requests', json={'shotDescription': 'Scoped'}, headers=headers)
+    assert event.status_code == request.status_code == 201
+    assert 'Idempotent-Replayed' not in request.headers
+
+
+def test_reused_key_with_another_body_is_rejected(client, session_factory):
+    headers = {'Idempotency-Key': key()}
+    name = f'First body {key()}'
+    assert client.post('/events', json={'name': name, 'date': '2025-06-01'}, headers=headers).status_code == 201
+
+    other = f'Second body {key()}'
+    response = client.post('/events', json={'name': other, 'date': '2025-06-01'}, headers=headers)
+    assert response.status_code == 422
+    assert count_events(session_factory, other) == 0
+
+
+@pytest.mark.parametrize('value', ['', 'k' * (idempotency.MAX_KEY_LENGTH + 1)])
+def test_invalid_key(client, value):
+    response = client.post('/events', json={'name': 'x', 'date': '2025-06-01'}, headers={'Idempotency-Key': value})
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def flaky_app():
+    """A one-route app whose create fails with a 500 until told otherwise, and can be held mid-request"""
+    app = Flask(__name__)
+    state = {'calls': 0, 'fail': True, 'started': threading.Event(), 'release': threading.Event()}
+    state['release'].set()
+
+    @app.post('/things')
+    @idempotency.idempotent
+    def create():
+        state['calls'] += 1
+        state['started'].set()
+        state['release'].wait(5)
+        if state['fail']:
+            return {'error': 'database unavailable'}, 500
+        return {'id': state['calls']}, 201
+
+    return app, state
+
+
+def test_server_error_is_not_remembered(flaky_app):
+    app, state = flaky_app
+    client = app.test_client()
+    headers = {'Idempotency-Key': key()}
+    assert client.post('/things', json={}, headers=headers).status_code == 500
+
+    state['fail'] = False
+    response = client.post('/things', json={}, headers=headers)
+    assert (response.status_code, response.get_json()) == (201, {'id': 2})
+    assert client.post('/things', json={}, headers=headers).headers['Idempotent-Replayed'] == 'true'
+    assert state['calls'] == 2
+
+
+def test_retry_while_the_first_request_runs_is_a_conflict(flaky_app):
+    app, state = flaky_app
+    state['fail'] = False
+    state['release'].clear()
+    headers = {'Idempotency-Key': key()}
+    results = []
+    first = threading.Thread(target=lambda: results.append(app.test_client().post('/things', json={}, headers=headers)))
+    first.start()
+    assert state['started'].wait(5)
+
+    retry = app.test_client().post('/things', json={}, headers=headers)
+    state['release'].set()
+    first.join()
+    assert retry.status_code == 409
+    assert retry.headers['Retry-After'] == '1'
+    assert results[0].status_code == 201
+    assert state['calls'] == 1
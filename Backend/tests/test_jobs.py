@@ -0,0 +1,149 @@
+"""Claiming, leases and retries of the job queue (jobs.py)"""
+
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, update
+
+import jobs
+from models import Job
+
+
+@pytest.fixture
+def run(session_factory, monkeypatch):
+    """An empty queue with a 'test' handler that runs the per-target function in run[target]"""
+    actions = {}
+    monkeypatch.setitem(jobs.queue.handlers, 'test', lambda factory, job: actions[job.target](job))
+    with session_factory() as session:
+        session.execute(delete(Job))
+        session.commit()
+    yield actions
+    with session_factory() as session:
+        session.execute(delete(Job))
+        session.commit()
+
+
+def enqueue(session_factory, target='noop', priority=0, max_attempts=jobs.DEFAULT_MAX_ATTEMPTS):
+    with session_factory() as session:
+        job_id = jobs.queue.enqueue(session, 'test', target, priority=priority, max_attempts=max_attempts).id
+        session.commit()
+    return job_id
+
+
+def load(session_factory, job_id):
+    with session_factory() as session:
+        return session.get(Job, job_id)
+
+
+def expire_lease(session_factory, job_id):
+    with session_factory() as session:
+        session.execute(update(Job).where(Job.id == job_id).values(
+            locked_at=datetime.now() - timedelta(seconds=jobs.JOB_LEASE_SECONDS + 1)
+        ))
+        session.commit()
+
+
+def test_claim_order(run, session_factory):
+    old = enqueue(session_factory)
+    new = enqueue(session_factory)
+    urgent = enqueue(session_factory, priority=5)
+
+    claimed = [jobs.queue.claim(session_factory, 'w').id for _ in range(3)]
+    assert claimed == [urgent, old, new]
+    assert jobs.queue.claim(session_factory, 'w') is None
+
+
+def test_concurrent_workers_claim_each_job_once(run, session_factory):
+    job_ids = {enqueue(session_factory) for _ in range(30)}
+    claimed = []
+
+    def worker(worker_id):
+        while True:
+            row = jobs.queue.claim(session_factory, worker_id)
+            if row is None:
+                return
+            claimed.append(row.id)
+
+    threads = [threading.Thread(target=worker, args=(f'w{i}',)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(job_ids)
+
+
+def test_live_lease_is_not_taken_over(run, session_factory):
+    job_id = enqueue(session_factory)
+    assert jobs.queue.claim(session_factory, 'a').id == job_id
+    assert jobs.queue.claim(session_factory, 'b') is None
+
+
+def test_expired_lease_is_taken_over_and_fences_the_old_worker(run, session_factory):
+    job_id = enqueue(session_factory)
+    first = jobs.queue.claim(session_factory, 'a')
+    expire_lease(session_factory, job_id)
+
+    second = jobs.queue.claim(session_factory, 'b')
+    assert second.id == job_id
+    assert second.attempts == 2
+
+    # The first worker wakes up: its progress and its result must not land on b's lease
+    jobs.RunningJob(jobs.queue, session_factory, 'a', first).report(50, 100)
+    jobs.queue._update(session_factory, job_id, 'a', status='succeeded', locked_by=None)
+    job = load(session_factory, job_id)
+    assert (job.status, job.locked_by, job.done, job.total) == ('running', 'b', 0, None)
+
+
+def test_progress_renews_the_lease(run, session_factory, client):
+    def handler(job):
+        expire_lease(session_factory, job.id)
+        job.report(3, 4)
+        assert jobs.queue.claim(session_factory, 'other') is None
+    run['progress'] = handler
+    job_id = enqueue(session_factory, 'progress')
+
+    assert jobs.queue.run_one(session_factory, 'w')
+    body = client.get(f'/jobs/{job_id}').get_json()
+    assert body['status'] == 'succeeded'
+    assert body['progress'] == {'done': 3, 'total': 4, 'percent': 75.0}
+
+
+def test_failing_job_is_retried_after_a_backoff_then_fails(run, session_factory):
+    def fail(job):
+        raise RuntimeError(f'boom {job.attempts}')
+    run['fail'] = fail
+    job_id = enqueue(session_factory, 'fail', max_attempts=2)
+
+    assert jobs.queue.run_one(session_factory, 'w')
+    job = load(session_factory, job_id)
+    assert (job.status, job.attempts, job.error, job.locked_by) == ('queued', 1, 'boom 1', None)
+    assert job.available_at > datetime.now()
+    assert not jobs.queue.run_one(session_factory, 'w')
+
+    with session_factory() as session:
+        session.execute(update(Job).where(Job.id == job_id).values(available_at=datetime.now()))
+        session.commit()
+    assert jobs.queue.run_one(session_factory, 'w')
+    job = load(session_factory, job_id)
+    assert (job.status, job.attempts, job.error) == ('failed', 2, 'boom 2')
+    assert job.finished_at is not None
+
+
+def test_job_whose_last_worker_died_is_failed_not_rerun(run, session_factory):
+    calls = []
+    run['once'] = calls.append
+    job_id = enqueue(session_factory, 'once', max_attempts=1)
+    jobs.queue.claim(session_factory, 'dead')
+    expire_lease(session_factory, job_id)
+
+    assert jobs.queue.run_one(session_factory, 'w')
+    job = load(session_factory, job_id)
+    assert (job.status, job.error) == ('failed', 'The worker running the job stopped')
+    assert calls == []
+
+
+def test_enqueue_rejects_unknown_kind(run, session_factory):
+    with session_factory() as session, pytest.raises(ValueError):
+        jobs.queue.enqueue(session, 'no-such-kind')
@@ -0,0 +1,135 @@
+"""Organization export and import (org_transfer.py)"""
+
+import gzip
+import json
+
+import pytest
+from sqlalchemy import func, select
+
+from models import Event, Organization, Project, Shot, Shot_Request, event_personnel
+
+# Primary and foreign keys get new values on import, and the signup code is replaced
+KEY_COLUMNS = {'id', 'organization_id', 'project_id', 'event_id', 'personnel_id', 'role_id', 'photographer_id',
+               'signup_code'}
+
+
+def export(client, organization_id):
+    response = client.get(f'/organizations/{organization_id}/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    return response.get_data()
+
+
+def content(dump):
+    """{table: sorted rows without their key columns}"""
+    tables = {}
+    for line in dump.splitlines()[1:]:
+        chunk = json.loads(line)
+        keep = [i for i, name in enumerate(chunk['columns']) if name not in KEY_COLUMNS]
+        tables.setdefault(chunk['table'], []).extend(tuple(row[i] for i in keep) for row in chunk['rows'])
+    return {table: sorted(rows, key=repr) for table, rows in tables.items()}
+
+
+def event_tree(session, organization_id):
+    """Every event of an organization with its project and the sizes of what hangs off it"""
+    count = lambda table, column: (
+        select(func.count()).select_from(table).where(column == Event.id).scalar_subquery()
+    )
+    rows = session.execute(
+        select(Event.name, Event.date, Project.name,
+               count(Shot.__table__, Shot.event_id),
+               count(Shot_Request.__table__, Shot_Request.event_id),
+               count(event_personnel, event_personnel.c.event_id))
+        .outerjoin(Project, Project.id == Event.project_id)
+        .where(Event.organization_id == organization_id)
+    ).all()
+    return sorted(tuple(row) for row in rows)
+
+
+def test_round_trip(client, session_factory):
+    dump = export(client, 2)
+    response = client.post('/organizations/import?signupCode=ROUNDTRIP', data=dump)
+    assert response.status_code == 201, response.get_json()
+    imported = response.get_json()
+    new_id = int(imported['id'])
+    assert new_id != 2
+
+    exported_rows = {table: len(rows) for table, rows in content(dump).items()}
+    # Roles are matched by slug, everything else is inserted
+    assert imported['rows'] == {**exported_rows, 'roles': 0}
+
+    assert content(export(client, new_id)) == content(dump)
+    with session_factory() as session:
+        assert event_tree(session, new_id) == event_tree(session, 2)
+        assert session.get(Organization, new_id).signup_code == 'ROUNDTRIP'
+
+    old_stats = client.get('/stats/organizations/2').get_json()
+    new_stats = client.get(f'/stats/organizations/{new_id}').get_json()
+    assert {**new_stats, 'id': '2'} == old_stats
+
+
+def test_gzip_import(client):
+    dump = gzip.compress(export(client, 2))
+    response = client.post('/organizations/import?signupCode=GZIPPED', data=dump,
+                           headers={'Content-Encoding': 'gzip'})
+    assert response.status_code == 201, response.get_json()
+    assert response.get_json()['rows']['shots'] == 2000
+
+
+def replace_chunk(dump, table, change):
+    lines = dump.splitlines()
+    for i, line in enumerate(lines):
+        chunk = json.loads(line)
+        if chunk.get('table') == table:
+            change(chunk)
+            lines[i] = json.dumps(chunk).encode()
+            break
+    return b'\n'.join(lines)
+
+
+def set_first_value(table, column, value):
+    def change(chunk):
+        chunk['rows'][0][chunk['columns'].index(column)] = value
+    return lambda dump: replace_chunk(dump, table, change)
+
+
+@pytest.mark.parametrize('corrupt, error', [
+    (lambda dump: b'', 'The dump is empty'),
+    (lambda dump: b'not json\n' + dump, 'Invalid dump header'),
+    (lambda dump: b'{"format": "something-else", "version": 1}\n', 'Not a hive-organization dump'),
+    (lambda dump: dump.replace(b'"version": 1', b'"version": 99', 1), 'Unsupported dump version 99'),
+    (lambda dump: dump + b'\n[1, 2, 3]', 'expected a JSON object'),
+    (lambda dump: dump + b'\n{"table": "no_such_table", "columns": [], "rows": []}', 'no_such_table'),
+    (lambda dump: replace_chunk(dump, 'shots', lambda chunk: chunk['rows'][0].pop()), 'list of 19 values'),
+    (lambda dump: replace_chunk(dump, 'events', lambda chunk: chunk.update(columns='name')), 'list of column names'),
+    (set_first_value('shots', 'event_id', 'one'), 'shots.event_id'),
+    (set_first_value('shots', 'event_id', 123456789), '123456789'),
+    (set_first_value('events', 'date', '2025-13-45'), 'invalid date in events.date'),
+    (lambda dump: dump + b'\n\xff\xfe', 'Invalid JSON on line'),
+], ids=['empty', 'bad header', 'wrong format', 'wrong version', 'chunk not an object', 'unknown table',
+        'short row', 'columns not a list', 'key not an integer', 'dangling key', 'bad date', 'not utf-8'])
+def test_malformed_dump_is_rejected_and_nothing_is_written(client, session_factory, corrupt, error):
+    with session_factory() as session:
+        before = session.scalar(select(func.count()).select_from(Organization))
+    response = client.post('/organizations/import?signupCode=MALFORMED', data=corrupt(export(client, 1)))
+    assert response.status_code == 400
+    assert error in response.get_json()['error']
+    with session_factory() as session:
+        assert session.scalar(select(func.count()).select_from(Organization)) == before
+
+
+def test_signup_code_is_required(client):
+    dump = set_first_value('organizations', 'signup_code', None)(export(client, 1))
+    response = client.post('/organizations/import', data=dump)
+    assert response.status_code == 400
+    assert 'no signup code' in response.get_json()['error']
+
+
+def test_signup_code_must_be_free(client):
+    response = client.post('/organizations/import', data=export(client, 1))
+    assert response.status_code == 400
+    assert 'already used by organization 1' in response.get_json()['error']
+
+
+def test_export_of_missing_organization(client):
+    assert client.get('/organizations/999999/export').status_code == 404
@@ -0,0 +1,127 @@
+"""The Firestore mirror's outbox relay (outbox.py)"""
+
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, func, select, update
+
+import outbox
+from models import OutboxEntry
+
+
+@pytest.fixture
+def mirror(session_factory, monkeypatch):
+    """Turn the mirror on over an empty outbox"""
+    def clear():
+        with session_factory() as session:
+            session.execute(delete(OutboxEntry))
+            session.commit()
+    monkeypatch.setattr(outbox, 'MIRROR_ENABLED', True)
+    clear()
+    yield
+    clear()
+
+
+def entries(session_factory):
+    with session_factory() as session:
+        return session.scalars(select(OutboxEntry).order_by(OutboxEntry.id)).all()
+
+
+def rename(client, event_id, name):
+    version = client.get(f'/events/{event_id}').get_json()['version']
+    response = client.patch(f'/events/{event_id}', json={'name': name, 'version': version})
+    assert response.status_code == 200, response.get_json()
+
+
+def test_changes_are_queued_and_mirrored(mirror, session_factory, client, new_event):
+    event_id = new_event()['id']
+    rename(client, event_id, 'Renamed once')
+    rename(client, event_id, 'Renamed twice')
+    assert [entry.entity_id for entry in entries(session_factory)] == [int(event_id)] * 3
+
+    firestore = outbox.FakeFirestore()
+    assert outbox.Relay(session_factory, firestore).run() == 3
+    # Three entries for one row are written once, with its latest state
+    assert firestore.commits == [1]
+    assert firestore.collections['events'][event_id]['name'] == 'Renamed twice'
+    assert entries(session_factory) == []
+
+
+def test_soft_deleted_row_is_removed_from_the_mirror(mirror, session_factory, client, new_event):
+    event_id = new_event()['id']
+    firestore = outbox.FakeFirestore()
+    relay = outbox.Relay(session_factory, firestore)
+    relay.run()
+    assert event_id in firestore.collections['events']
+
+    assert client.delete(f'/events/{event_id}').status_code == 200
+    relay.run()
+    assert event_id not in firestore.collections['events']
+
+
+def test_row_claimed_by_one_relay_waits_for_it(mirror, session_factory, client, new_event):
+    first = new_event()['id']
+    a = outbox.Relay(session_factory, outbox.FakeFirestore())
+    b = outbox.Relay(session_factory, outbox.FakeFirestore())
+    assert [entry.entity_id for entry in a.claim()] == [int(first)]
+
+    # A newer change to the same row must not be written by b while a may still write the older one
+    rename(client, first, 'Newer')
+    second = new_event()['id']
+    assert [entry.entity_id for entry in b.claim()] == [int(second)]
+    assert b.claim() == []
+
+    # Once a's lease runs out (a died), b takes over everything
+    with session_factory() as session:
+        session.execute(update(OutboxEntry).where(OutboxEntry.locked_by == a.relay_id).values(
+            locked_at=datetime.now() - timedelta(seconds=outbox.OUTBOX_LEASE_SECONDS + 1)
+        ))
+        session.commit()
+    assert sorted(entry.entity_id for entry in b.claim()) == [int(first), int(first)]
+
+
+def test_concurrent_relays_write_every_entry_once(mirror, session_factory, new_event):
+    event_ids = [new_event()['id'] for _ in range(20)]
+    firestore = outbox.FakeFirestore()
+    relays = [outbox.Relay(session_factory, firestore, batch_size=3) for _ in range(4)]
+    handled = []
+    threads = [threading.Thread(target=lambda relay=relay: handled.append(relay.run())) for relay in relays]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(handled) == len(event_ids)
+    assert sum(firestore.commits) == len(event_ids)
+    assert set(event_ids) <= set(firestore.collections['events'])
+    assert entries(session_factory) == []
+
+
+def test_failed_batch_is_retried_after_a_backoff(mirror, session_factory, new_event):
+    event_id = new_event()['id']
+    firestore = outbox.FakeFirestore(fail_commits=1)
+    relay = outbox.Relay(session_factory, firestore)
+
+    assert relay.run_batch() == 0
+    [entry] = entries(session_factory)
+    assert (entry.attempts, entry.locked_by) == (1, None)
+    assert 'Simulated Firestore outage' in entry.last_error
+    assert entry.available_at > datetime.now()
+    assert relay.run() == 0
+
+    with session_factory() as session:
+        session.execute(update(OutboxEntry).values(available_at=datetime.now()))
+        session.commit()
+    assert relay.run() == 1
+    assert event_id in firestore.collections['events']
+    with session_factory() as session:
+        assert session.scalar(select(func.count()).select_from(OutboxEntry)) == 0
+
+
+def test_nothing_is_queued_with_the_mirror_off(session_factory, new_event):
+    with session_factory() as session:
+        before = session.scalar(select(func.count()).select_from(OutboxEntry))
+    new_event()
+    with session_factory() as session:
+        assert session.scalar(select(func.count()).select_from(OutboxEntry)) == before
@@ -0,0 +1,71 @@
+"""Version-checked partial updates (patching.py)"""
+
+import threading
+
+import pytest
+
+import patching
+from models import Event
+
+
+def test_patch_bumps_the_version(client, new_event):
+    event_id = new_event()['id']
+    response = client.patch(f'/events/{event_id}', json={'name': 'Patched'}, headers={'If-Match': '"1"'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"2"'
+    assert response.get_json()['version'] == 2
+
+    event = client.get(f'/events/{event_id}').get_json()
+    assert (event['name'], event['version'], event['location']) == ('Patched', 2, '')
+
+
+@pytest.mark.parametrize('body, status', [
+    ({'name': 'x'}, 428),
+    ({'name': 'x', 'version': 'one'}, 400),
+    ({'nmae': 'x', 'version': 1}, 400),
+    ({'date': 'not a date', 'version': 1}, 400),
+])
+def test_bad_patch_changes_nothing(client, new_event, body, status):
+    event = new_event()
+    response = client.patch(f'/events/{event["id"]}', json=body)
+    assert response.status_code == status
+    assert client.get(f'/events/{event["id"]}').get_json()['version'] == 1
+
+
+def test_stale_version_is_a_conflict(client, new_event):
+    event_id = new_event()['id']
+    assert client.patch(f'/events/{event_id}', json={'name': 'First', 'version': 1}).status_code == 200
+
+    response = client.patch(f'/events/{event_id}', json={'name': 'Second', 'version': 1})
+    assert response.status_code == 409
+    assert response.get_json()['currentVersion'] == 2
+    assert client.get(f'/events/{event_id}').get_json()['name'] == 'First'
+
+
+def test_missing_row_is_not_found(client, session_factory):
+    assert client.patch('/events/999999', json={'name': 'x', 'version': 1}).status_code == 404
+    with session_factory() as session, pytest.raises(patching.NotFound):
+        patching.apply_patch(session, Event, 999999, 1, {'name': 'x'})
+
+
+def test_concurrent_patches_of_one_version_have_one_winner(app, new_event):
+    event_id = new_event()['id']
+    barrier = threading.Barrier(6)
+    results = {}
+
+    def patch(name):
+        client = app.test_client()
+        barrier.wait()
+        results[name] = client.patch(f'/events/{event_id}', json={'name': name, 'version': 1}).status_code
+
+    threads = [threading.Thread(target=patch, args=(f'Writer {i}',)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    winners = [name for name, status in results.items() if status == 200]
+    assert len(winners) == 1
+    assert sorted(results.values()) == [200] + [409] * 5
+    event = app.test_client().get(f'/events/{event_id}').get_json()
+    assert (event['name'], event['version']) == (winners[0], 2)
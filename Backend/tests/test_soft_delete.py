@@ -0,0 +1,73 @@
+"""Soft deletes and their visibility (soft_delete.py, compaction.py)"""
+
+import uuid
+
+import pytest
+from sqlalchemy import func, select
+
+import compaction
+from models import Event, Shot, Shot_Request
+
+PHOTOGRAPHER_ID = 7
+
+
+@pytest.fixture
+def event_tree(client, new_event):
+    """An event with a uniquely named shot request and two shots; returns (event, name word, shot ids, shot request id)"""
+    word = f'zq{uuid.uuid4().hex[:10]}'
+    event = new_event(name=f'Soft delete {word}')
+    shot_ids = []
+    for i in range(2):
+        response = client.post('/shots', json={
+            'image': f'/images/{word}-{i}.jpg', 'date_created': '2025-06-01', 'camera': 'Test camera',
+            'filename': f'{word}-{i}.CR3', 'event_id': int(event['id']), 'photographer_id': PHOTOGRAPHER_ID
+        })
+        assert response.status_code == 201, response.get_json()
+        shot_ids.append(response.get_json()['id'])
+    response = client.post('/shot-requests', json={'shotDescription': f'Request {word}', 'eventId': int(event['id'])})
+    assert response.status_code == 201, response.get_json()
+    return event, word, shot_ids, response.get_json()['id']
+
+
+def organization_shots(client):
+    return client.get('/stats/organizations/1').get_json()['shots']
+
+
+def test_deleted_event_and_everything_under_it_disappear(client, session_factory, event_tree):
+    event, word, shot_ids, shot_request_id = event_tree
+    event_id = event['id']
+    shots_before = organization_shots(client)
+    assert client.get(f'/search?q={word}').get_json()['results']
+
+    assert client.delete(f'/events/{event_id}').status_code == 200
+    assert client.get(f'/events/{event_id}').status_code == 404
+    assert client.delete(f'/events/{event_id}').status_code == 404
+    assert event_id not in [event['id'] for event in client.get('/events').get_json()['events']]
+    assert all(client.get(f'/shots/{shot_id}').status_code == 404 for shot_id in shot_ids)
+    assert client.get(f'/shot-requests/{shot_request_id}').status_code == 404
+    assert client.get(f'/search?q={word}').get_json()['results'] == []
+    assert organization_shots(client) == shots_before - 2
+
+    # The rows stay until compaction purges them
+    with session_factory() as session:
+        hidden = session.execute(
+            select(Event.deleted_at).where(Event.id == int(event_id)).execution_options(include_deleted=True)
+        ).scalar_one()
+        assert hidden is not None
+    compaction.Compactor(session_factory).run()
+    with session_factory() as session:
+        for model, row_id in [(Event, event_id), (Shot, shot_ids[0]), (Shot_Request, shot_request_id)]:
+            count = select(func.count()).select_from(model).where(model.id == int(row_id))
+            assert session.execute(count.execution_options(include_deleted=True)).scalar() == 0
+
+
+def test_deleted_shot_disappears_from_its_event(client, event_tree):
+    event, _, shot_ids, _ = event_tree
+    shots_before = organization_shots(client)
+
+    assert client.delete(f'/shots/{shot_ids[0]}').status_code == 200
+    assert client.get(f'/shots/{shot_ids[0]}').status_code == 404
+    remaining = client.get(f'/events/{event["id"]}/shots').get_json()
+    assert [shot['id'] for shot in remaining] == [shot_ids[1]]
+    assert client.get(f'/stats/events/{event["id"]}').get_json()['shots'] == 1
+    assert organization_shots(client) == shots_before - 1
@@ -0,0 +1,11 @@
+"""Cold start budget (see benchmarks/startup.py)"""
+
+import io
+
+from benchmarks import startup
+
+
+def test_boot_is_within_budget():
+    report = io.StringIO()
+    failures = startup.check(out=report)
+    assert not failures, report.getvalue() + '\n'.join(failures)